@@ -1,12 +1,14 @@
 import os.path
 import pathlib
 import sys
+import time
 
 import click
 import toml
 from packaging.version import Version
 
 from . import git
+from . import instances
 
 try:
     from importlib.metadata import entry_points
@@ -24,6 +26,13 @@ except ImportError:  # pragma: no cover
         __version__ = 'v0.0.1'
 
 
+_clients = {}
+# how many invocations are running, imported projects run inside the outermost one
+_depth = 0
+# the process serving ``teststack agent``, which keeps configs and shared results between invocations
+_agent = None
+
+
 class DictConfig(dict):
     def get(self, key, default=None):
         if isinstance(default, dict):
@@ -72,10 +81,23 @@ class DictConfig(dict):
     default=None,
     help='Prefix for docker objects.',
 )
+@click.option(
+    '--instance',
+    default=None,
+    envvar='TESTSTACK_INSTANCE',
+    help='Name of an isolated instance of the stack, to run several at once on one host.',
+)
 @click.option('--path', '-p', default=os.getcwd(), type=click.Path(exists=True), help='Directory to run teststack in.')
+@click.option(
+    '--profile',
+    is_flag=True,
+    envvar='TESTSTACK_PROFILE',
+    help='Print timing and engine connection statistics when finished.',
+)
 @click.version_option(__version__)
 @click.pass_context
-def cli(ctx, config, local_config, project_name, path):
+def cli(ctx, config, local_config, project_name, instance, path, profile):
+    global _depth
     ctx.ensure_object(DictConfig)
     config = pathlib.Path(config)
     local_config = pathlib.Path(local_config)
@@ -84,19 +106,23 @@ def cli(ctx, config, local_config, project_name, path):
     def change_dir_to_original():
         os.chdir(ctx.obj['currentdir'])
 
+    if _depth == 0:
+        # this is the outermost invocation, imported projects reuse its clients until it finishes,
+        # and the commands run by an agent reuse them until the agent stops
+        if _agent is None:
+            ctx.call_on_close(_clients.clear)
+        if profile is True:
+            ctx.call_on_close(_print_profile(time.monotonic()))
+    _depth += 1
+    ctx.call_on_close(_leave)
+
     # change dir before everything else is calculated
     ctx.obj['currentdir'] = os.getcwd()
     os.chdir(path)
 
-    if config.exists():
-        with config.open('r') as fh_:
-            config = DictConfig(toml.load(fh_))
-    else:
-        config = DictConfig()
-
-    if local_config.exists():
-        with local_config.open('r') as fh_:
-            local_config = toml.load(fh_)
+    config = DictConfig(_load_config(config) or {})
+    local_config = _load_config(local_config)
+    if local_config is not None:
         config.merge(local_config)
 
     min_version = Version(config.get('tests.min_version', 'v0.0.0').lstrip('v'))
@@ -106,17 +132,70 @@ def cli(ctx, config, local_config, project_name, path):
 
     ctx.obj['services'] = config.get('services', {})
     ctx.obj['tests'] = config.get('tests', {})
-    ctx.obj['project_name'] = os.path.basename(path.strip('/')) if project_name is None else project_name
+    ctx.obj['gc'] = config.get('gc', {})
+    ctx.obj['instances'] = config.get('instances', {})
+    ctx.obj['instance'] = instance
+    ctx.obj['project_name'] = instances.project_name(
+        os.path.basename(path.strip('/')) if project_name is None else project_name,
+        instance,
+    )
 
     ctx.obj['client'] = get_client(config.get('client', {}))
+    client_key = _client_key(config.get('client', {}))
     ctx.obj['prefix'] = config.get('client.prefix', '')
     ctx.obj.update(git.get_tag(prefix=config.get('client.prefix', '')))
     if ctx.obj.get("tests.stage", None) is not None:
         ctx.obj["tag"] = f"{ctx.obj['tag']}-{ctx.obj.get('tests.stage')}"
+    # results shared by the chained commands of this invocation, cleared by anything that changes the engine state
+    ctx.obj['memo'] = {}
+    if _agent is not None:
+        ctx.obj['memo'] = _agent.memo(
+            ctx.obj['client'], client_key, os.getcwd(), ctx.obj['project_name'], ctx.obj['tag'], config
+        )
+
+
+def _leave():
+    global _depth
+    _depth -= 1
+
+
+def _load_config(path):
+    if _agent is not None:
+        return _agent.config(path)
+    if not path.exists():
+        return None
+    with path.open('r') as fh_:
+        return toml.load(fh_)
+
+
+def _print_profile(started):
+    def print_profile():
+        click.echo(f'teststack: finished in {time.monotonic() - started:.3f}s', err=True)
+        for (name, _), client in _clients.items():
+            stats = client.pool_stats() if hasattr(client, 'pool_stats') else {}
+            stats = ', '.join(f'{key}={value}' for key, value in stats.items())
+            click.echo(f'teststack: client {name}: {stats or "no pool statistics"}', err=True)
+
+    return print_profile
+
+
+def _client_key(client):
+    return (client.get('name', 'docker'), repr(sorted((key, value) for key, value in client.items() if key != 'name')))
 
 
 def get_client(client):
+    """
+    Get the client for the configured driver.
+
+    Clients are shared by every project in an invocation, so imported projects
+    reuse the same engine connection pool instead of opening their own.
+    """
     group = 'teststack.clients'
+    key = _client_key(client)
+    client_name = client.pop('name', 'docker')
+    if key in _clients:
+        return _clients[key]
+
     entries = entry_points()
 
     if hasattr(entries, 'select'):
@@ -124,10 +203,16 @@ def get_client(client):
     else:
         entries = entries.get(group, [])
 
-    client_name = client.pop('name', 'docker')
     for entry_point in entries:
         if entry_point.name == client_name:
-            return entry_point.load().Client(**client)
+            module = entry_point.load()
+            if hasattr(module, 'Client'):
+                _clients[key] = module.Client(**client)
+            else:
+                from .containers.aio import SyncClient
+
+                _clients[key] = SyncClient(module.AsyncClient(**client))
+            return _clients[key]
 
 
 def import_commands():
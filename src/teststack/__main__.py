@@ -1,4 +1,4 @@
-from . import main  # pragma: no cover
+from teststack_agent import main  # pragma: no cover
 
 
 if __name__ == '__main__':  # pragma: no cover
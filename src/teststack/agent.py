@@ -0,0 +1,212 @@
+"""
+Serve teststack commands from a long running process.
+
+Every ``teststack`` call loads the config, imports the container sdk, connects
+to the engine and looks up the state of the containers again. ``teststack
+agent`` keeps all of that in one process, listening on
+``.teststack/agent.sock``, and while it runs, ``teststack`` in the same
+directory only forwards its arguments to the agent and prints what comes back.
+
+.. code-block:: bash
+
+    teststack agent --background
+    teststack env
+    teststack agent --stop
+
+The agent keeps the engine clients, the parsed config files until they change,
+and the results that chained commands share, like the environment and the
+state of the containers, until the engine reports any change to a container,
+image, network or volume. Commands are run one at a time, in the directory and
+with the environment of the caller. ``exec`` takes over the terminal, and
+``watch`` runs until it is interrupted, so the agent hands them back to run
+locally.
+
+The client side, which forwards the commands, is in :mod:`teststack_agent`, so
+the ``teststack`` script can reach the agent without importing this package.
+"""
+
+import copy
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import toml
+from teststack_agent import SOCKET
+
+LOCAL = ('agent', 'exec', 'proxy', 'watch')
+EVENTS = {'type': ['container', 'image', 'network', 'volume']}
+
+
+def commands(args):
+    """
+    Get the names of the chained commands in ``args``, leaving out option values and posargs.
+    """
+    import click
+    from . import cli
+
+    names = []
+    try:
+        with cli.make_context('teststack', list(args), resilient_parsing=True) as ctx:
+            rest = [*ctx.protected_args, *ctx.args]
+            while rest:
+                name, command, rest = cli.resolve_command(ctx, rest)
+                if command is None:
+                    break
+                names.append(name)
+                sub_ctx = command.make_context(
+                    name,
+                    rest,
+                    parent=ctx,
+                    allow_extra_args=True,
+                    allow_interspersed_args=False,
+                    resilient_parsing=True,
+                )
+                rest = [*sub_ctx.protected_args, *sub_ctx.args]
+    except click.ClickException:
+        # running it reports the error
+        pass
+    return names
+
+
+class _Output(io.RawIOBase):
+    def __init__(self, send, key):
+        self.send = send
+        self.key = key
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.send({self.key: bytes(data).decode('utf-8', errors='replace')})
+        return len(data)
+
+
+class Agent:
+    """
+    Run the commands sent to ``.teststack/agent.sock``, keeping what they load between them.
+    """
+
+    def __init__(self):
+        self.configs = {}
+        self.memos = {}
+        self.watched = set()
+        self.stopping = False
+
+    def config(self, path):
+        """
+        Get a copy of a parsed config file, or None if it is missing, only reading it again when it changes.
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        key = str(path.resolve())
+        if key not in self.configs or self.configs[key][0] != stat.st_mtime_ns:
+            with path.open('r') as fh_:
+                self.configs[key] = (stat.st_mtime_ns, toml.load(fh_))
+        return copy.deepcopy(self.configs[key][1])
+
+    def memo(self, client, client_key, *key):
+        """
+        Get the results shared by commands for ``key``, kept until the engine of ``client`` reports a change.
+
+        ``client_key`` identifies the client config, and one watcher is started
+        for each. Clients whose events can not be watched get an empty memo
+        every time.
+        """
+        if client_key not in self.watched and not self._watch(client, client_key):
+            return {}
+        return self.memos.setdefault(json.dumps([client_key, *key], sort_keys=True, default=str), {})
+
+    def _watch(self, client, client_key):
+        from .containers.aio import SyncClient
+
+        if isinstance(client, SyncClient) or not hasattr(client, 'events'):
+            return False
+        since = int(time.time())
+        self.watched.add(client_key)
+        threading.Thread(target=self._clear_on_events, args=(client, client_key, since), daemon=True).start()
+        return True
+
+    def _clear_on_events(self, client, client_key, since):
+        try:
+            for _ in client.events(filters=EVENTS, since=since):
+                self.memos.clear()
+        except Exception:
+            pass
+        finally:
+            self.watched.discard(client_key)
+            self.memos.clear()
+
+    def _run(self, request, send):
+        from . import cli
+
+        environ, cwd, stdout, stderr = dict(os.environ), os.getcwd(), sys.stdout, sys.stderr
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        sys.stdout = io.TextIOWrapper(_Output(send, 'stdout'), encoding='utf-8', write_through=True)
+        sys.stderr = io.TextIOWrapper(_Output(send, 'stderr'), encoding='utf-8', write_through=True)
+        try:
+            cli.main(request['args'], prog_name='teststack')
+            exit_code = 0
+        except SystemExit as exc:
+            exit_code = exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+        return exit_code
+
+    def _handle(self, connection):
+        with connection, connection.makefile('rwb') as stream:
+
+            def send(message):
+                stream.write(json.dumps(message).encode('utf-8') + b'\n')
+                stream.flush()
+
+            request = json.loads(stream.readline() or b'{}')
+            if request.get('stop'):
+                self.stopping = True
+                send({'exit': 0})
+                return
+            if 'args' in request:
+                if any(name in LOCAL for name in commands(request['args'])):
+                    send({'local': True})
+                    return
+                send({'exit': self._run(request, send)})
+
+    def serve(self):
+        """
+        Serve commands until ``stop`` is called.
+        """
+        import teststack
+
+        SOCKET.parent.mkdir(parents=True, exist_ok=True)
+        # left behind by an agent that was killed
+        SOCKET.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(SOCKET))
+        server.listen()
+        teststack._agent = self
+        try:
+            while self.stopping is False:
+                connection, _ = server.accept()
+                try:
+                    self._handle(connection)
+                except (OSError, ValueError):
+                    # the caller went away, or sent something that is not a request
+                    pass
+        finally:
+            teststack._agent = None
+            server.close()
+            SOCKET.unlink(missing_ok=True)
@@ -0,0 +1,86 @@
+"""
+Keep package manager caches in named volumes, shared by every tests container.
+
+A fresh tests container would otherwise download every dependency again in
+its ``install`` step.
+
+.. code-block:: toml
+
+    [tests.caches]
+    pip = "/root/.cache/pip"
+    npm = "/home/node/.npm"
+
+Each cache is a named volume, ``teststack-cache-<name>``, labeled
+``teststack.cache``, created the first time a tests container needs it, and
+mounted by every tests container that uses the same name, including the ones of
+other projects and instances. pip, poetry and npm lock their caches, so they
+are safe to share between stacks that run at once.
+
+Volumes have no access time, so the last time each cache was mounted is kept
+in the cache directory, to prune the least recently used caches first.
+"""
+
+import time
+
+from .containers.base import CACHE_LABEL
+from .utils import load_cache
+from .utils import save_cache
+
+CACHE = 'caches.json'
+PREFIX = 'teststack-cache-'
+
+
+def volume(name):
+    return f'{PREFIX}{name}'
+
+
+def mounts(config):
+    """
+    Get the ``run`` volumes for a ``tests.caches`` table.
+    """
+    return {volume(name): {'bind': target, 'mode': 'rw'} for name, target in (config or {}).items()}
+
+
+def ensure(client, config):
+    """
+    Create the volumes for a ``tests.caches`` table, and mark them as used.
+    """
+    if not config:
+        return
+    used = load_cache(CACHE)
+    for name in config:
+        client.volume_ensure(volume(name), labels={CACHE_LABEL: name})
+        used[volume(name)] = time.time()
+    save_cache(CACHE, used)
+
+
+def list_(client):
+    """
+    List the cache volumes with their ``name``, ``size`` and ``last_used`` time, least recently used first.
+    """
+    used = load_cache(CACHE)
+    caches = [{**cache, 'last_used': used.get(cache['name'], 0)} for cache in client.volume_list(CACHE_LABEL)]
+    return sorted(caches, key=lambda cache: (cache['last_used'], cache['name']))
+
+
+def prune(client, max_size=0, dry_run=False):
+    """
+    Remove the least recently used caches until the rest fit in ``max_size`` bytes, and return the removed caches.
+
+    Caches that are in use can not be removed, and are skipped.
+    """
+    caches = list_(client)
+    total = sum(cache['size'] or 0 for cache in caches)
+    removed = []
+    for cache in caches:
+        if total <= max_size:
+            break
+        if dry_run is True or client.volume_remove(cache['name']):
+            removed.append(cache)
+            total -= cache['size'] or 0
+    if removed and dry_run is False:
+        used = load_cache(CACHE)
+        for cache in removed:
+            used.pop(cache['name'], None)
+        save_cache(CACHE, used)
+    return removed
@@ -18,13 +18,41 @@ the tests you could do the following.
     teststack build --rebuild run
 """
 
+import asyncio
+import concurrent.futures
+import functools
+import itertools
 import os
+import pathlib
 import sys
+import time
 
 import click
 import jinja2
+import teststack_agent
+from teststack import agent as agent_
+from teststack import caches
 from teststack import cli
+from teststack import events
+from teststack import hosts
+from teststack import instances
+from teststack import isolation
+from teststack import lazy
+from teststack import reconcile
+from teststack import services as services_
+from teststack import sharding
+from teststack import snapshots
+from teststack import warm
+from teststack import watch as watch_
+from teststack.containers.aio import gather
+from teststack.containers.base import CONFIG_LABEL
+from teststack.containers.base import PROJECT_LABEL
+from teststack.containers.base import SERVICE_LABEL
+from teststack.containers.base import SHARD_LABEL
 from teststack.git import get_path
+from teststack.utils import human_size
+from teststack.utils import parse_size
+from teststack.utils import spawn
 
 
 @cli.command()
@@ -32,8 +60,11 @@ from teststack.git import get_path
 @click.option('--no-mount', '-m', is_flag=True, help='Don\'t mount the current directory')
 @click.option('--imp', '-i', is_flag=True, help='Start container as an import')
 @click.option('--prefix', '-p', default='', help='Prefix to start a container name with')
+@click.option(
+    '--service', '-s', 'services', multiple=True, default=[services_.ALL], help='Service to start, default: all'
+)
 @click.pass_context
-def start(ctx, no_tests, no_mount, imp, prefix):
+def start(ctx, no_tests, no_mount, imp, prefix, services):
     """
     Start services and tests containers.
 
@@ -41,6 +72,14 @@ def start(ctx, no_tests, no_mount, imp, prefix):
     started, and only the services are started. This is useful if running tests
     outside of a docker container.
 
+    Only what differs from the config is changed. Missing containers are
+    created, stopped ones are started, and containers created from different
+    settings or an older image are recreated, all concurrently. ``teststack
+    plan`` shows what would change.
+
+    Services with a ``healthcheck`` configured are waited on until the engine
+    reports them healthy, before the tests container is started.
+
     --no-tests, -n
 
         do not build an image or start a tests container
@@ -49,119 +88,431 @@ def start(ctx, no_tests, no_mount, imp, prefix):
 
         do not mount the current directory as a volume
 
+    --service, -s
+
+        only start this service, can be passed more than once. Default: all
+
     .. code-block:: bash
 
         teststack start --no-tests
+        teststack start -s database -s cache
+
+    Commands chained after ``start`` in the same invocation, like ``run`` and
+    ``exec``, reuse its result instead of starting everything again.
     """
+    services = tuple(services)
+    key = ('start', no_tests, no_mount, imp, prefix, services)
+    everything = ('start', no_tests, no_mount, imp, prefix, (services_.ALL,))
+    if everything in ctx.obj['memo']:
+        return ctx.obj['memo'][everything]
+    if key not in ctx.obj['memo']:
+        ctx.obj['memo'][key] = _start(ctx, no_tests, no_mount, imp, prefix, services)
+    return ctx.obj['memo'][key]
+
+
+def _start(ctx, no_tests, no_mount, imp, prefix, services=(services_.ALL,)):
     client = ctx.obj.get('client')
+    selected = services_.select(ctx, services)
+    for service, data in selected.items():
+        if 'import' not in data and lazy.enabled(data):
+            lazy.ensure(ctx, f'{prefix}{ctx.obj.get("project_name")}_{service}', service, data, prefix=prefix)
+    selected = {service: data for service, data in selected.items() if 'import' in data or not lazy.enabled(data)}
     if no_mount is not True:
         no_mount = not ctx.obj.get('tests.mount', True)
 
-    for service, data in ctx.obj.get('services').items():
+    if hasattr(client, 'pod_create'):
+        owner = f'{prefix}{ctx.obj["project_name"]}'
+        ports = {} if no_tests is True else instances.host_ports(ctx, owner, 'tests', ctx.obj.get('tests.ports', {}))
+        for service, data in selected.items():
+            ports.update(instances.host_ports(ctx, owner, service, data.get('ports', {})))
+        client.pod_create(name=owner, ports=ports, network=ctx.obj['project_name'])
+
+    since = int(time.time())
+    specs, images = _service_specs(ctx, prefix, services=selected)
+    changes = reconcile.plan(client, specs, images=images)
+    _echo_changes(changes)
+    reconcile.apply(client, changes)
+
+    for name, status in client.status_many(list(specs)).items():
+        if status != "running":
+            click.echo(f'Failed to start container for {specs[name]["service"]}')
+            click.echo(client.logs(name))
+            raise click.Abort
+
+    healthchecks = [name for name, spec in specs.items() if selected.get(spec['service'], {}).get('healthcheck')]
+    if healthchecks:
+        _wait_healthy(ctx, healthchecks, since)
+
+    created = {change['name'] for change in changes if change['action'] in (reconcile.CREATE, reconcile.RECREATE)}
+    for service, data in selected.items():
+        if 'import' in data or not (data.get('isolation') or {}).get('setup'):
+            continue
+        name = f'{prefix}{ctx.obj.get("project_name")}_{service}'
+        if not data.get('healthcheck'):
+            _wait_accepting(ctx, [container for container in isolation.containers(name, data) if container in created])
+        if isolation.setup(client, name, data, created):
+            click.echo(f'Failed to set up workers for {service}')
+            raise click.Abort
+
+    if no_tests is True:
+        return
+
+    env = ctx.invoke(
+        cli.get_command(ctx, 'env'), prefix=prefix, inside=True, no_export=True, quiet=True, services=services
+    )
+    env = dict(line.split('=') for line in env)
+    image = _image_id(ctx, ctx.obj['tag'])
+    if image is None:
+        image = _image_id(ctx, ctx.invoke(build))
+
+    spec = _tests_spec(ctx, prefix, image, env, imp, no_mount, specs)
+    ctx.obj['memo'][('tests', prefix)] = spec
+    caches.ensure(client, ctx.obj.get('tests.caches'))
+    changes = reconcile.plan(client, {spec['name']: spec}, images={spec['name']: image})
+    _claim_warm(ctx, changes)
+    _echo_changes(changes)
+    reconcile.apply(client, changes)
+    container = changes[0]['id']
+
+    if imp is True and changes[0]['action'] in (reconcile.CREATE, reconcile.RECREATE):
+        for step in ctx.obj.get('tests.import.setup', []):
+            client.run_command(
+                container,
+                step,
+            )
+
+    return container
+
+
+@cli.command()
+@click.option('--no-tests', '-n', is_flag=True, help='Don\'t plan the tests container')
+@click.option('--prefix', '-p', default='', help='Prefix to start a container name with')
+@click.pass_context
+def plan(ctx, no_tests, prefix):
+    """
+    Show what ``start`` would change, without changing anything.
+
+    Each container is listed with the action ``start`` would take for it,
+    ``create``, ``recreate``, ``start`` or ``keep``, and the reason. Imported
+    projects are not included.
+
+    --no-tests, -n
+
+        do not plan the tests container
+
+    .. code-block:: bash
+
+        teststack plan
+    """
+    client = ctx.obj['client']
+    specs, images = _service_specs(ctx, prefix, build_images=False)
+    services = dict(specs)
+    if no_tests is not True:
+        image = _image_id(ctx, ctx.obj['tag'])
+        spec = _tests_spec(ctx, prefix, image, {}, False, not ctx.obj.get('tests.mount', True), services)
+        specs[spec['name']] = spec
+        images[spec['name']] = image
+
+    changes = reconcile.plan(client, specs, images=images)
+    for change in changes:
+        if change['service'] == 'tests' and images[change['name']] is None and change['action'] != reconcile.CREATE:
+            change.update(action=reconcile.RECREATE, reason='image not built')
+        click.echo(f'{change["name"]}: {change["action"]} ({change["reason"]})')
+    return changes
+
+
+def _image_id(ctx, tag):
+    """
+    Get the id of an image, looking each tag up only once per invocation.
+    """
+    images = ctx.obj['memo'].setdefault('images', {})
+    if tag not in images:
+        images[tag] = ctx.obj['client'].image_get(tag)
+    return images[tag]
+
+
+def _volumes(mounts):
+    volumes = {}
+    for mount in (mounts or {}).values():
+        volumes.update(
+            {
+                os.path.expanduser(mount["source"]): {
+                    "bind": mount["target"],
+                    "mode": mount.get("mode", "ro"),
+                }
+            }
+        )
+    return volumes
+
+
+def _tmpfs(config):
+    """
+    Convert a ``tmpfs`` table, of paths to a size or a table of mount options, to the options for the drivers.
+    """
+    tmpfs = {}
+    for path, options in (config or {}).items():
+        if not isinstance(options, dict):
+            options = {'size': options} if options else {}
+        flags = {key: value for key, value in options.items() if value is not False}
+        tmpfs[path] = ','.join(key if value is True else f'{key}={value}' for key, value in flags.items())
+    return tmpfs
+
+
+def _service_specs(ctx, prefix, build_images=True, services=None):
+    """
+    Get the ``run`` arguments for each service, all of them or ``services``, and the ids of the images they should run.
+
+    Imported projects are started, and missing service images are built,
+    unless ``build_images`` is False.
+    """
+    client = ctx.obj['client']
+    specs = {}
+    if services is None:
+        services = ctx.obj.get('services')
+    for service, data in services.items():
         if 'import' in data:
-            ctx.invoke(import_, **data['import'])
+            if build_images is True:
+                ctx.invoke(import_, **data['import'])
             continue
         name = f'{prefix}{ctx.obj.get("project_name")}_{service}'
-        container = client.container_get(name)
+        overrides = {}
         if 'build' in data:
             data['image'] = f'{ctx.obj.get("prefix")}{service}:{ctx.obj.get("commit", "latest")}'
-            image = client.image_get(data['image'])
-            if image is None:
+            # the tag changes with every commit, the image id decides if the container is out of date
+            overrides['image'] = data['build']
+            if build_images is True and _image_id(ctx, data['image']) is None:
                 ctx.invoke(
                     build,
                     directory=data['build'],
                     tag=data['image'],
                     service=service,
                 )
-        if container is None:
-            click.echo(f'Starting container: {name}')
-            mounts = data.get("mounts", None)
-            volumes = {}
-            if mounts:
-                for mount in mounts.values():
-                    volumes.update(
-                        {
-                            os.path.expanduser(mount["source"]): {
-                                "bind": mount["target"],
-                                "mode": mount.get("mode", "ro"),
-                            }
-                        }
-                    )
-            client.run(
-                image=data['image'],
-                ports=data.get('ports', {}),
-                name=name,
-                command=data.get('command', None),
-                environment=data.get('environment', {}),
-                mount_cwd=False,
-                network=ctx.obj['project_name'],
-                service=service,
-                volumes=volumes,
-            )
-        else:
-            client.start(name=name)
-
-        if client.status(name) != "running":
-            click.echo(f'Failed to start container for {service}')
-            click.echo(client.logs(name))
-            raise click.Abort
+        specs[name] = reconcile.label(
+            {
+                'name': name,
+                'image': data['image'],
+                'ports': instances.host_ports(
+                    ctx, f'{prefix}{ctx.obj["project_name"]}', service, data.get('ports', {})
+                ),
+                'command': data.get('command', None),
+                'environment': dict(data.get('environment', {})),
+                'mount_cwd': False,
+                'network': ctx.obj['project_name'],
+                'service': service,
+                'volumes': _volumes(data.get('mounts')),
+                'tmpfs': _tmpfs(data.get('tmpfs')),
+                'healthcheck': _healthcheck(data.get('healthcheck')),
+            },
+            ctx.obj['project_name'],
+            service,
+            isolation=data.get('isolation'),
+            **overrides,
+        )
+        for replica in isolation.replicas(name, data):
+            spec = {key: value for key, value in specs[name].items() if key != 'labels'}
+            spec.update(name=replica, ports={port: None for port in spec['ports']})
+            specs[replica] = reconcile.label(spec, ctx.obj['project_name'], service, **overrides)
+    present = client.images_present([spec['image'] for spec in specs.values()])
+    images = {name: present[spec['image']] for name, spec in specs.items()}
+    return specs, images
 
-    if no_tests is True:
-        return
 
-    env = ctx.invoke(cli.get_command(ctx, 'env'), prefix=prefix, inside=True, no_export=True, quiet=True)
-    env = dict(line.split('=') for line in env)
-    image = client.image_get(ctx.obj['tag'])
-    if image is None:
-        image = client.image_get(ctx.invoke(build))
+def _tests_spec(ctx, prefix, image, env, imp, no_mount, services):
+    """
+    Get the ``run`` arguments for the tests container.
 
+    The environment holds addresses of the services, so instead of it, the
+    config hash covers the environment settings and the config of the
+    services, and the image is compared by id.
+    """
+    command = ctx.obj.get('tests.command', True)
+    if imp is True:
+        command = ctx.obj.get('tests.import.command', None)
     name = f'{prefix}{ctx.obj.get("project_name")}_tests'
+    return reconcile.label(
+        {
+            'name': name,
+            'image': image,
+            'stream': True,
+            'environment': env,
+            'command': command,
+            'ports': instances.host_ports(
+                ctx, f'{prefix}{ctx.obj["project_name"]}', 'tests', ctx.obj.get('tests.ports', {})
+            ),
+            'mount_cwd': not no_mount,
+            'network': ctx.obj['project_name'],
+            'volumes': {**_volumes(ctx.obj.get('tests.mounts')), **caches.mounts(ctx.obj.get('tests.caches'))},
+            'tmpfs': _tmpfs(ctx.obj.get('tests.tmpfs')),
+        },
+        ctx.obj['project_name'],
+        'tests',
+        image=None,
+        environment=dict(ctx.obj.get('tests.environment', {})),
+        services={spec_name: spec['labels'][CONFIG_LABEL] for spec_name, spec in services.items()},
+    )
+
+
+def _start_shards(ctx, count, prefix=''):
+    """
+    Start the extra tests containers for ``run --shards``, copied from the tests container ``start`` created.
+
+    Shards are recreated whenever the tests container would be.
+    """
+    client = ctx.obj['client']
+    spec = ctx.obj['memo'][('tests', prefix)]
+    specs = _shard_specs(ctx, spec, count)
+    changes = reconcile.plan(client, specs, images={name: spec['image'] for name in specs})
+    _claim_warm(ctx, changes)
+    _echo_changes(changes)
+    reconcile.apply(client, changes)
+    return [change['id'] for change in changes]
 
-    current_image_id = client.container_get_current_image(name)
-    if current_image_id != image:
-        client.end_container(name)
-        current_image_id = None
-    else:
-        container = client.container_get(name)
-
-    if current_image_id is None:
-        command = ctx.obj.get('tests.command', True)
-        if imp is True:
-            command = ctx.obj.get('tests.import.command', None)
-
-        mounts = ctx.obj.get("tests.mounts")
-        volumes = {}
-        if mounts:
-            for mount in mounts.values():
-                volumes.update(
-                    {
-                        os.path.expanduser(mount["source"]): {
-                            "bind": mount["target"],
-                            "mode": mount.get("mode", "ro"),
-                        }
-                    }
-                )
 
-        container = client.run(
-            image=image,
-            stream=True,
-            name=name,
-            environment=env,
-            command=command,
-            ports=ctx.obj.get('tests.ports', {}),
-            mount_cwd=not no_mount,
-            network=ctx.obj['project_name'],
-            volumes=volumes,
+def _shard_specs(ctx, spec, count):
+    """
+    Get the ``run`` arguments for the extra tests containers of ``count`` shards, from those of the tests container.
+    """
+    specs = {}
+    for shard in range(1, count):
+        shard_spec = {key: value for key, value in spec.items() if key != 'labels'}
+        shard_spec['name'] = f'{spec["name"]}_{shard}'
+        # fixed host ports would collide between shards
+        shard_spec['ports'] = {port: None for port in spec['ports']}
+        reconcile.label(
+            shard_spec,
+            ctx.obj['project_name'],
+            'tests',
+            image=None,
+            environment=None,
+            tests=spec['labels'][CONFIG_LABEL],
         )
+        shard_spec['labels'][SHARD_LABEL] = str(shard)
+        specs[shard_spec['name']] = shard_spec
+    return specs
 
-        if imp is True:
-            for step in ctx.obj.get('tests.import.setup', []):
-                client.run_command(
-                    container,
-                    step,
-                )
 
-    return container
+def _claim_warm(ctx, changes):
+    """
+    Rename a warm container into place for each tests container in ``changes`` that would be created.
+
+    The pool is refilled in the background afterwards.
+    """
+    client = ctx.obj['client']
+    pending = [change for change in changes if change['action'] in (reconcile.CREATE, reconcile.RECREATE)]
+    if not pending or not warm.size(ctx):
+        return
+    names = sorted(client.container_names({PROJECT_LABEL: ctx.obj['project_name'], SERVICE_LABEL: 'tests'}))
+    claimed = False
+    for change in pending:
+        candidates = [name for name in names if name.startswith(f'{change["name"]}_warm_')]
+        found = warm.find(client, candidates, change['spec'], change['spec']['image'])
+        if found is None:
+            continue
+        warm_name, container = found
+        if change['action'] == reconcile.RECREATE:
+            client.end_container(change['name'])
+        client.rename(warm_name, change['name'])
+        change.update(id=container, action=reconcile.KEEP, reason='warm')
+        click.echo(f'Using warm container: {change["name"]}')
+        claimed = True
+    if claimed is True:
+        warm.refill(ctx)
+
+
+def _start_host(ctx, client, count):
+    """
+    Start a complete stack on another engine host, and return the tests containers for ``count`` shards on it.
+
+    The host gets the images it is missing from the local engine, and a copy of
+    the working directory in its tests containers instead of a mount.
+    """
+    if any('import' in data for data in ctx.obj['services'].values()):
+        raise click.UsageError('Shards of projects that import other projects can only run on the local host')
+    local, memo, services = ctx.obj['client'], ctx.obj['memo'], ctx.obj['services']
+    # the proxies of lazy services only run on the local host
+    ctx.obj['client'], ctx.obj['memo'], ctx.obj['services'] = client, {}, lazy.eager(services)
+    try:
+        specs, _ = _service_specs(ctx, '', build_images=False)
+        hosts.sync_images(local, client, [spec['image'] for spec in specs.values()] + [ctx.obj['tag']])
+        containers = [_start(ctx, False, True, False, '')] + _start_shards(ctx, count)
+        with hosts.context_archive() as archive:
+            for container in containers:
+                archive.seek(0)
+                client.put_archive(container, archive)
+    finally:
+        ctx.obj['client'], ctx.obj['memo'], ctx.obj['services'] = local, memo, services
+    return containers
+
+
+def _echo_changes(changes):
+    for change in changes:
+        if change['action'] == reconcile.CREATE or change['action'] == reconcile.START:
+            click.echo(f'Starting container: {change["name"]}')
+        elif change['action'] == reconcile.RECREATE:
+            click.echo(f'Recreating container: {change["name"]} ({change["reason"]})')
+
+
+def _healthcheck(config):
+    """
+    Convert a ``[services.<name>.healthcheck]`` table, with durations in seconds, for the drivers.
+    """
+    if not config:
+        return None
+    test = config['test']
+    if isinstance(test, str):
+        test = ['CMD-SHELL', test]
+    elif test[0] not in ('CMD', 'CMD-SHELL', 'NONE'):
+        test = ['CMD', *test]
+    healthcheck = {'test': test}
+    for key in ('interval', 'timeout', 'start_period'):
+        if key in config:
+            healthcheck[key] = int(config[key] * 1_000_000_000)
+    if 'retries' in config:
+        healthcheck['retries'] = config['retries']
+    return healthcheck
+
+
+def _wait_healthy(ctx, names, since):
+    client = ctx.obj['client']
+    found = client.inspect_many(names)
+    names = [name for name in names if (found[name] or {}).get('health') != 'healthy']
+    if not names:
+        return
+    click.echo(f'Waiting for services to be healthy: {", ".join(names)}')
+    result = events.wait_for(
+        client,
+        ctx.obj['project_name'],
+        names,
+        actions=(events.HEALTHY,),
+        failures=('die', events.UNHEALTHY),
+        since=since,
+        timeout=ctx.obj.get('tests.start_timeout', 300),
+    )
+    for name, action in result.items():
+        if action != events.HEALTHY:
+            click.echo(f'Service is not healthy: {name} ({action})')
+            click.echo(client.logs(name))
+            raise click.Abort
+
+
+def _wait_accepting(ctx, names):
+    """
+    Wait until the tcp ports of each of ``names`` accept connections, for services without a healthcheck.
+    """
+    client = ctx.obj['client']
+    for name in dict.fromkeys(names):
+        # inside the network, every exposed port is listed, not only the forwarded ones
+        data = client.get_container_data(name, network=ctx.obj['project_name'], inside=True) or {}
+        ports = [key.split(';', 1)[1] for key in data if key.startswith('PORT;') and not key.endswith('/udp')]
+        try:
+            lazy.wait_ready(
+                lazy.targets(client, name, ctx.obj['project_name'], ports).values(),
+                timeout=ctx.obj.get('tests.start_timeout', 300),
+            )
+        except OSError:
+            click.echo(f'Service is not accepting connections: {name}')
+            click.echo(client.logs(name))
+            raise click.Abort
 
 
 @cli.command()
@@ -171,6 +522,8 @@ def stop(ctx, prefix):
     """
     Stop all containers
 
+    The project network is removed as well, but only if teststack created it.
+
     --prefix, -p
 
         prefix for container names for imports
@@ -181,22 +534,79 @@ def stop(ctx, prefix):
     """
     client = ctx.obj['client']
     project_name = ctx.obj["project_name"]
+    ctx.obj['memo'].clear()
+    if hasattr(client, 'pod_remove'):
+        client.pod_remove(f'{prefix}{project_name}')
+    names = []
     for service, data in ctx.obj['services'].items():
         if 'import' in data:
             ctx.invoke(import_, stop=True, **data['import'])
             continue
-        name = f'{prefix}{project_name}_{service}'
-        container = client.container_get(name)
-        if container is None:
+        names.append(f'{prefix}{project_name}_{service}')
+        if lazy.enabled(data):
+            lazy.stop(names[-1])
+        names.extend(isolation.replicas(names[-1], data))
+    tests = f'{prefix}{project_name}_tests'
+    shards = [
+        name
+        for name in client.container_names({PROJECT_LABEL: project_name, SERVICE_LABEL: 'tests'})
+        if name.startswith(f'{tests}_')
+    ]
+    names.extend(shards)
+    found = client.inspect_many(names + [tests])
+
+    containers = []
+    for name in names:
+        if found[name] is None:
             continue
         click.echo(f'Stopping container: {name}')
-        client.end_container(container)
-    container = client.container_get(f'{prefix}{project_name}_tests')
-    if container is None:
+        containers.append((found[name]['id'],))
+    if found[tests] is not None:
+        containers.append((found[tests]['id'],))
+    gather(client, 'end_container', *containers)
+    if ctx.obj.get('instance'):
+        instances.release(f'{prefix}{project_name}')
+    if found[tests] is None:
         return
-    client.end_container(container)
-    if hasattr(client, 'network_prune'):
-        client.network_prune()
+    if hasattr(client, 'network_remove'):
+        client.network_remove(project_name)
+
+
+@cli.command()
+@click.option('--prefix', '-p', default='', help='Prefix to start a container name with')
+@click.argument('service')
+@click.pass_context
+def proxy(ctx, prefix, service):
+    """
+    Pass connections to a lazy service through, starting it on the first one.
+
+    ``start`` runs this in the background for each service with ``lazy`` set,
+    and ``stop`` ends it. The service is stopped again after it has had no
+    connections for its ``idle`` timeout.
+
+    --prefix, -p
+
+        prefix for container names for imports
+
+    .. code-block:: bash
+
+        teststack proxy search
+    """
+    client = ctx.obj['client']
+    config = services_.select(ctx, (service,))[service]
+    ctx.obj['services'] = lazy.eager(ctx.obj['services'])
+    name = f'{prefix}{ctx.obj["project_name"]}_{service}'
+    ports = lazy.ports(ctx, name, config)
+
+    def wake():
+        ctx.obj['memo'].clear()
+        _start(ctx, True, True, False, prefix, (service,))
+        targets = lazy.targets(client, name, ctx.obj['project_name'], ports)
+        lazy.wait_ready(targets.values())
+        return targets
+
+    hosts = lazy.listen_hosts(client, ctx.obj['project_name'])
+    asyncio.run(lazy.Proxy(ports, wake, functools.partial(client.stop, name), lazy.idle(config)).serve(hosts))
 
 
 @cli.command()
@@ -213,6 +623,130 @@ def restart(ctx):  # pragma: no cover
     ctx.invoke(start)
 
 
+def _snapshot_services(ctx, services):
+    """
+    Get the config of ``services``, or of every service with ``snapshot`` directories.
+    """
+    if services:
+        selected = services_.select(ctx, services)
+    else:
+        selected = {service: data for service, data in ctx.obj.get('services').items() if data.get('snapshot')}
+    for service, data in selected.items():
+        if not data.get('snapshot'):
+            raise click.UsageError(f'Service {service} has no snapshot directories configured')
+        for path in data['snapshot']:
+            if any(f'{path.rstrip("/")}/'.startswith(f'{tmpfs.rstrip("/")}/') for tmpfs in data.get('tmpfs') or {}):
+                # a tmpfs is emptied when the container stops, and hides what is extracted before it starts
+                raise click.UsageError(f'Service {service} can not snapshot {path}, it is on a tmpfs')
+    return selected
+
+
+@cli.command()
+@click.option('--name', '-n', default='default', help='Name of the snapshot')
+@click.argument('services', nargs=-1)
+@click.pass_context
+def snapshot(ctx, name, services):
+    """
+    Save the data of services, to restore with ``teststack reset``.
+
+    Each service is stopped while the directories in its ``snapshot`` setting
+    are saved, and started again after.
+
+    --name, -n
+
+        name of the snapshot, to keep more than one. Default: default
+
+    services
+
+        services to save. Default: every service with ``snapshot`` directories
+
+    .. code-block:: bash
+
+        teststack start run --step seed snapshot database
+    """
+    client = ctx.obj['client']
+    ctx.obj['memo'].clear()
+    since = int(time.time())
+    healthchecks = []
+    for service, data in _snapshot_services(ctx, services).items():
+        container = f'{ctx.obj["project_name"]}_{service}'
+        if client.container_get(container) is None:
+            raise click.ClickException(f'Container {container} does not exist, run teststack start first')
+        click.echo(f'Saving snapshot {name} of {container}')
+        client.stop(container)
+        try:
+            missing = snapshots.save(client, container, name, data['snapshot'])
+        finally:
+            client.start(container)
+        for path in missing:
+            click.echo(click.style(f'Directory {path} does not exist in {container}', fg='red'))
+        if data.get('healthcheck'):
+            healthchecks.append(container)
+    if healthchecks:
+        _wait_healthy(ctx, healthchecks, since)
+
+
+@cli.command()
+@click.option('--name', '-n', default='default', help='Name of the snapshot')
+@click.argument('services', nargs=-1)
+@click.pass_context
+def reset(ctx, name, services):
+    """
+    Restore services to the data saved by ``teststack snapshot``.
+
+    Each service container is recreated with its saved data in place before it
+    starts, on the same host ports, which takes seconds instead of seeding the
+    data again. If the address of a service changes, the tests container is
+    removed, so the next ``start`` recreates it with the new address.
+
+    --name, -n
+
+        name of the snapshot to restore. Default: default
+
+    services
+
+        services to restore. Default: every service with ``snapshot`` directories
+
+    .. code-block:: bash
+
+        teststack reset database run --step integration
+    """
+    client = ctx.obj['client']
+    ctx.obj['memo'].clear()
+    network = ctx.obj['project_name']
+    selected = _snapshot_services(ctx, services)
+    specs, _ = _service_specs(ctx, '', build_images=False, services=selected)
+    archives = {}
+    for service, data in selected.items():
+        container = f'{ctx.obj["project_name"]}_{service}'
+        archives[container] = snapshots.load(container, name, data['snapshot'])
+        if archives[container] is None:
+            raise click.ClickException(f'There is no snapshot {name} of {container}')
+
+    since = int(time.time())
+    moved = False
+    for container, archive in archives.items():
+        click.echo(f'Resetting {container} to snapshot {name}')
+        inside = client.get_container_data(container, network=network, inside=True) or {}
+        outside = client.get_container_data(container, network=network) or {}
+        spec = dict(specs[container])
+        # keep the host ports that were exported
+        spec['ports'] = {port: host or outside.get(f'PORT;{port}') for port, host in spec['ports'].items()}
+        client.end_container(container)
+        client.run(**spec, archives=archive)
+        moved = moved or inside.get('HOST') != (
+            client.get_container_data(container, network=network, inside=True) or {}
+        ).get('HOST')
+
+    healthchecks = [container for container in archives if specs[container]['healthcheck']]
+    if healthchecks:
+        _wait_healthy(ctx, healthchecks, since)
+    tests = f'{ctx.obj["project_name"]}_tests'
+    if moved and client.container_get(tests) is not None:
+        click.echo(f'Removing {tests}, the address of a service changed')
+        client.end_container(tests)
+
+
 @cli.command()
 @click.option(
     '--template-file',
@@ -339,9 +873,13 @@ def build(ctx, rebuild, tag, dockerfile, template_file, directory, service, stag
             for name, mount in ctx.obj.get(f"services.{service}.mounts", {}).items()
             if mount["secret"] is True
         }
+        cache_from = ctx.obj.get(f'services.{service}.cache_from')
+        cache_to = ctx.obj.get(f'services.{service}.cache_to')
     else:
         buildargs = ctx.obj.get('tests.buildargs')
         secrets = {name: mount for name, mount in ctx.obj.get("tests.mounts", {}).items() if mount["secret"] is True}
+        cache_from = ctx.obj.get('tests.cache_from')
+        cache_to = ctx.obj.get('tests.cache_to')
 
     if stage is None:
         stage = ctx.obj.get('tests.stage', None)
@@ -374,15 +912,256 @@ def build(ctx, rebuild, tag, dockerfile, template_file, directory, service, stag
         buildargs=buildargs,
         secrets=secrets,
         stage=stage,
+        cache_from=cache_from,
+        cache_to=cache_to,
     )
+    ctx.obj['memo'].clear()
     image = client.image_get(tag)
     if image is None:
         click.echo(click.style('Failed to build image!', fg='red'))
         sys.exit(11)
 
+    if ctx.obj.get('gc.auto', False) is True:
+        ctx.invoke(gc)
+
+    if not service and warm.size(ctx):
+        warm.refill(ctx)
+
     return tag
 
 
+@cli.command(name='warm')
+@click.option('--size', type=int, default=None, help='Number of warm containers for each tests container')
+@click.pass_context
+def warm_(ctx, size):
+    """
+    Create the warm tests containers that ``start`` uses instead of creating its own.
+
+    With ``[tests.warm]`` configured, this runs in the background after the
+    tests image is built, and after ``start`` uses a warm container. Warm
+    containers get their environment from the running services, so nothing is
+    created unless the services are running and the tests image is built.
+    Tests containers that forward fixed host ports are not warmed, because the
+    ports would collide.
+
+    ``run`` only starts the services its steps need, and only exports theirs to
+    the tests container, so the pool is filled for each set of services that
+    ``start`` and ``run`` can select, as long as those services are running.
+
+    --size
+
+        number of warm containers for each tests container and shard. Default: ``tests.warm.size`` or 1
+
+    .. code-block:: bash
+
+        teststack warm --size 2
+    """
+    client = ctx.obj['client']
+    if size is None:
+        size = ctx.obj.get('tests.warm.size', 1)
+    with warm.locked(ctx.obj['project_name']) as acquired:
+        if acquired is False:
+            click.echo('The warm pool is already being filled')
+            return
+        image = _image_id(ctx, ctx.obj['tag'])
+        targets = []
+        for services in _service_sets(ctx) if image is not None else []:
+            # the same services as _start, which leaves lazy ones to their proxy
+            selected = {
+                service: data
+                for service, data in services_.select(ctx, services).items()
+                if 'import' in data or not lazy.enabled(data)
+            }
+            specs, _ = _service_specs(ctx, '', build_images=False, services=selected)
+            if any(status != 'running' for status in client.status_many(list(specs)).values()):
+                continue
+            env = ctx.invoke(cli.get_command(ctx, 'env'), inside=True, no_export=True, quiet=True, services=services)
+            env = dict(line.split('=') for line in env)
+            spec = _tests_spec(ctx, '', image, env, False, not ctx.obj.get('tests.mount', True), specs)
+            if all(spec['labels'][CONFIG_LABEL] != target['labels'][CONFIG_LABEL] for target in targets):
+                targets.extend([spec, *_shard_specs(ctx, spec, ctx.obj.get('tests.shards.count', 1)).values()])
+        if not targets:
+            click.echo('Services must be running and the tests image built to fill the warm pool')
+            return
+
+        warm_specs = {}
+        for target in targets:
+            if any(port is not None for port in target['ports'].values()):
+                click.echo(f'Not warming {target["name"]}, it forwards fixed host ports')
+                continue
+            first = sum(name.startswith(f'{target["name"]}_warm_') for name in warm_specs)
+            warm_specs.update(warm.specs(target, size, first=first))
+
+        surplus = [
+            (name,)
+            for name in client.container_names({PROJECT_LABEL: ctx.obj['project_name'], SERVICE_LABEL: 'tests'})
+            if '_warm_' in name and name not in warm_specs
+        ]
+        gather(client, 'end_container', *surplus)
+        changes = reconcile.plan(client, warm_specs, images={name: image for name in warm_specs})
+        _echo_changes(changes)
+        reconcile.apply(client, changes)
+
+
+@cli.command()
+@click.option('--background', '-b', is_flag=True, help='Run the agent in the background')
+@click.option('--stop', is_flag=True, help='Stop the running agent')
+@click.pass_context
+def agent(ctx, background, stop):
+    """
+    Serve teststack commands for this directory from a long running process.
+
+    While the agent runs, ``teststack`` commands in this directory are
+    forwarded to it, and reuse its engine connections, config and results, so
+    shell hooks calling ``teststack env`` and repeated ``teststack run`` calls
+    return quickly.
+
+    --background, -b
+
+        start the agent in the background and return once it is listening
+
+    --stop
+
+        stop the running agent
+
+    .. code-block:: bash
+
+        teststack agent --background
+        teststack agent --stop
+    """
+    if stop is True:
+        click.echo('Stopped the agent' if teststack_agent.stop() else 'No agent is running')
+        return
+    if teststack_agent.running():
+        raise click.ClickException(f'An agent is already running on {teststack_agent.SOCKET}')
+    if background is False:
+        agent_.Agent().serve()
+        return
+    spawn(ctx, 'agent')
+    deadline = time.monotonic() + 30
+    while not teststack_agent.running():
+        if time.monotonic() > deadline:
+            raise click.ClickException('The agent did not start')
+        time.sleep(0.1)
+    click.echo(f'Agent listening on {teststack_agent.SOCKET}')
+
+
+def _image_repositories(ctx):
+    """
+    Repositories that teststack tags images into for this project.
+    """
+    repositories = [ctx.obj['tag'].rsplit(':', 1)[0]]
+    for service, data in ctx.obj.get('services').items():
+        if 'build' in data:
+            repositories.append(f'{ctx.obj.get("prefix")}{service}')
+    return repositories
+
+
+@cli.command()
+@click.option('--keep', '-k', type=int, default=None, help='Number of images to keep for each repository')
+@click.option('--dry-run', is_flag=True, help='Only show the images that would be removed')
+@click.pass_context
+def gc(ctx, keep, dry_run):
+    """
+    Remove old images built by teststack.
+
+    Every commit gets a new tag for the tests image and for each service that
+    is built, so old images pile up. The most recently used images for each
+    repository are kept, the rest are removed along with any dangling images.
+    If ``gc.caches`` is set, the least recently used cache volumes are pruned
+    down to that size as well.
+
+    --keep, -k
+
+        number of images to keep for each repository. Default: ``gc.keep`` or 3
+
+    --dry-run
+
+        only print the images that would be removed
+
+    .. code-block:: bash
+
+        teststack gc
+        teststack gc --keep 1
+    """
+    client = ctx.obj['client']
+    if keep is None:
+        keep = ctx.obj.get('gc.keep', 3)
+
+    reclaimed = 0
+    for repository in _image_repositories(ctx):
+        images = sorted(client.image_list(repository), key=lambda image: image['last_used'], reverse=True)
+        for image in images[keep:]:
+            removed = False
+            for tag in image['tags']:
+                if tag == ctx.obj['tag']:
+                    continue
+                click.echo(f'{"Would remove" if dry_run else "Removing"} image: {tag}')
+                if dry_run is True or client.image_remove(tag):
+                    removed = True
+                else:
+                    click.echo(click.style(f'Failed to remove image: {tag}', fg='yellow'))
+            if removed is True:
+                reclaimed += image['size']
+
+    if ctx.obj.get('gc.caches') is not None:
+        for cache in caches.prune(client, parse_size(ctx.obj.get('gc.caches')), dry_run=dry_run):
+            click.echo(f'{"Would remove" if dry_run else "Removing"} cache: {cache["name"]}')
+            reclaimed += cache['size'] or 0
+
+    if dry_run is False:
+        reclaimed += client.image_prune()
+        ctx.obj['memo'].pop('images', None)
+    click.echo(f'Space reclaimed: {human_size(reclaimed)}')
+
+
+@cli.command(name='caches')
+@click.option('--prune', is_flag=True, help='Remove the least recently used caches')
+@click.option('--max-size', default=None, help='Size to prune the caches down to, like 10G')
+@click.option('--dry-run', is_flag=True, help='Only show the caches that would be removed')
+@click.pass_context
+def caches_(ctx, prune, max_size, dry_run):
+    """
+    Show the size of the cache volumes from ``tests.caches``, or prune them.
+
+    Caches are listed least recently used first, which is the order they are
+    pruned in. Caches mounted by a container are not removed.
+
+    --prune
+
+        remove the least recently used caches until the rest fit in ``--max-size``
+
+    --max-size
+
+        total size of the caches to keep when pruning. Default: ``gc.caches`` or 0
+
+    --dry-run
+
+        only print the caches that would be removed
+
+    .. code-block:: bash
+
+        teststack caches
+        teststack caches --prune --max-size 10G
+    """
+    client = ctx.obj['client']
+    if prune is False:
+        for cache in caches.list_(client):
+            size = 'unknown' if cache['size'] is None else human_size(cache['size'])
+            last_used = (
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(cache['last_used'])) if cache['last_used'] else 'never'
+            )
+            click.echo(f'{cache["name"]}: {size}, last used {last_used}')
+        return
+
+    if max_size is None:
+        max_size = ctx.obj.get('gc.caches', 0)
+    removed = caches.prune(client, parse_size(max_size), dry_run=dry_run)
+    for cache in removed:
+        click.echo(f'{"Would remove" if dry_run else "Removing"} cache: {cache["name"]}')
+    click.echo(f'Space reclaimed: {human_size(sum(cache["size"] or 0 for cache in removed))}')
+
+
 @cli.command()
 @click.pass_context
 @click.option('--user', '-u', default=None, nargs=1, type=click.STRING, help='User to exec to the container as')
@@ -430,12 +1209,14 @@ def _run(command, user, ctx):
     """
     if isinstance(command, str):
         command = [command]
+    kwargs = {'echo': ctx['echo']} if 'echo' in ctx else {}
     exit_code = 0
     for cmd in command:
         exit_code += ctx['client'].run_command(
             ctx['container'],
             cmd.format(posargs=' '.join(ctx['posargs'])),
             user=user,
+            **kwargs,
         )
     return exit_code
 
@@ -507,6 +1288,29 @@ def _run_commands(ctx):
     return sum([result['exit_code'] for result in ctx['commands'].values()])
 
 
+def _select_steps(steps, step):
+    """
+    Get the steps that ``run`` runs for ``--step``, every step if it is not passed.
+    """
+    if not step:
+        return steps
+    stepobj = steps.get(step, '{posargs}')
+    new_steps = {step: stepobj}
+    if 'requires' in stepobj:
+        new_steps.update({s: steps[s] for s in stepobj['requires']})
+    return new_steps
+
+
+def _service_sets(ctx):
+    """
+    Get the services that ``start`` starts, and that ``run`` starts for all the steps and for each ``--step``.
+    """
+    steps = ctx.obj['tests'].get('steps', {})
+    sets = [(services_.ALL,), services_.needed(steps)]
+    sets.extend(services_.needed(_select_steps(steps, step)) for step in steps)
+    return list(dict.fromkeys(sets))
+
+
 @cli.command()
 @click.option('--step', '-s', help='Which step to run')
 @click.option(
@@ -516,9 +1320,10 @@ def _run_commands(ctx):
     default=False,
     help='Copy files out of the container after all the steps have been run',
 )
+@click.option('--shards', type=int, default=None, help='Number of tests containers to split the tests across')
 @click.argument('posargs', nargs=-1, type=click.UNPROCESSED)
 @click.pass_context
-def run(ctx, step, copy, posargs):
+def run(ctx, step, copy, shards, posargs):
     """
     Run the specified test steps from the teststack.toml.
 
@@ -530,6 +1335,11 @@ def run(ctx, step, copy, posargs):
 
         specify a single step to run.
 
+    --shards
+
+        Number of tests containers to split the test files across, running the
+        steps in all of them at once. Default: ``tests.shards.count`` or 1
+
     posargs
 
         All other leftover unprocessed arguments are passed as {posargs} to be
@@ -539,20 +1349,29 @@ def run(ctx, step, copy, posargs):
 
         teststack run
         teststack run --step tests -- -k test_add_user tests/unit/test_users.py
+        teststack run --shards 4 -- tests/
+
+    Posargs that are paths are split between the shards, and a directory is
+    split into the files matching ``tests.shards.files`` inside it. The other
+    posargs are passed to every shard. Without any paths, the files matching
+    ``tests.shards.files`` are split. Each shard gets about the same share of
+    the time the files took on previous runs. Shards are also placed on the
+    other engine hosts in ``tests.shards.hosts``.
+
+    Only the services that the steps being run declare in ``services`` are
+    started, and only their variables are exported to the tests container.
     """
-    container = ctx.invoke(start)
+    if shards is None:
+        shards = ctx.obj.get('tests.shards.count', 1)
 
-    steps = ctx.obj['tests'].get('steps', {})
-    if step:
-        stepobj = steps.get(step, '{posargs}')
-        new_steps = {step: stepobj}
-        if 'requires' in stepobj:
-            new_steps.update({s: steps[s] for s in stepobj['requires']})
-        steps = new_steps
-    exit_code = 0
-    commands = _process_steps(steps)
-    runctx = {'commands': commands, 'container': container, 'posargs': posargs, 'client': ctx.obj['client']}
-    exit_code = _run_commands(runctx)
+    steps = _select_steps(ctx.obj['tests'].get('steps', {}), step)
+    container = ctx.invoke(start, services=services_.needed(steps))
+    if shards > 1:
+        exit_code = _run_shards(ctx, container, steps, shards, posargs, copy=copy)
+    else:
+        commands = _process_steps(steps)
+        runctx = {'commands': commands, 'container': container, 'posargs': posargs, 'client': ctx.obj['client']}
+        exit_code = _run_commands(runctx)
 
     if copy is True:
         ctx.invoke(copy_)
@@ -561,6 +1380,144 @@ def run(ctx, step, copy, posargs):
         sys.exit(exit_code)
 
 
+@cli.command()
+@click.option('--step', '-s', 'steps', multiple=True, help='Step to rerun on changes, can be passed more than once')
+@click.option('--debounce', type=float, default=None, help='Seconds without changes to wait before running')
+@click.argument('posargs', nargs=-1, type=click.UNPROCESSED)
+@click.pass_context
+def watch(ctx, steps, debounce, posargs):
+    """
+    Run the steps, and rerun the ones that changed files affect until interrupted.
+
+    Steps list the files they depend on in ``watch``. The stack is started
+    once, and every rerun uses the same tests container and environment.
+    Steps that are required by a watched step are only run the first time,
+    unless a change affects them too.
+
+    --step, -s
+
+        step to watch, can be passed more than once. Default: the steps with
+        ``watch`` patterns, or every step if none have them
+
+    --debounce
+
+        seconds without changes to wait before running the steps. Default:
+        ``tests.watch.debounce`` or 0.2
+
+    posargs
+
+        passed as {posargs} to the steps, like for ``run``
+
+    .. code-block:: bash
+
+        teststack watch
+        teststack watch --step tests -- -x -k test_add_user
+    """
+    config = ctx.obj['tests'].get('steps', {})
+    unknown = set(steps) - set(config)
+    if unknown:
+        raise click.UsageError(f'Unknown steps: {", ".join(sorted(unknown))}')
+    if debounce is None:
+        debounce = ctx.obj.get('tests.watch.debounce', watch_.DEBOUNCE)
+    watched = watch_.steps(config, steps)
+
+    def _steps(names):
+        selected = {name: config[name] for name in names}
+        for name in names:
+            if isinstance(config[name], dict):
+                selected.update({require: config[require] for require in config[name].get('requires', [])})
+        return selected
+
+    container = ctx.invoke(start, services=services_.needed(_steps(watched)))
+    runctx = {'container': container, 'posargs': posargs, 'client': ctx.obj['client']}
+    names = list(watched)
+    for changed in itertools.chain([None], watch_.changes(debounce=debounce)):
+        if changed is not None:
+            names = [name for name, patterns in watched.items() if watch_.affected(changed, patterns)]
+            if not names:
+                continue
+            click.echo(f'Changed: {", ".join(changed)}')
+        commands = _process_steps(_steps(names))
+        if changed is not None:
+            # requirements already ran the first time
+            for name, command in commands.items():
+                if name not in names:
+                    command['exit_code'] = 0
+        runctx['commands'] = commands
+        exit_code = _run_commands(runctx)
+        click.echo(click.style(f'Ran {", ".join(names)}: exit code {exit_code}', fg='red' if exit_code else 'green'))
+
+
+def _shard_items(ctx, posargs):
+    """
+    Split posargs into the test files to shard and the arguments for every shard.
+    """
+    configured = ctx.obj.get('tests.shards.files')
+    pattern = configured or '**/test_*.py'
+    items, args = [], []
+    for arg in posargs:
+        path = pathlib.Path(arg)
+        if path.is_dir():
+            items.extend(str(child) for child in sorted(path.glob(pattern)))
+        elif path.exists():
+            items.append(arg)
+        else:
+            args.append(arg)
+    if not items and configured:
+        items = [str(path) for path in sorted(pathlib.Path('.').glob(pattern))]
+    return items, args
+
+
+def _run_shards(ctx, container, steps, count, posargs, copy=False):
+    items, args = _shard_items(ctx, posargs)
+    if not items:
+        raise click.UsageError('Nothing to shard, pass test paths as posargs or set tests.shards.files')
+    count = min(count, len(items))
+    timings = sharding.load_timings()
+    assignments = sharding.split(items, count, timings)
+    pool = hosts.clients(ctx)
+    placement = hosts.place(count, [capacity for _, _, capacity in pool])
+    targets = []
+    for index, ((label, client, _), shards) in enumerate(zip(pool, placement)):
+        if not shards:
+            continue
+        if index == 0:
+            started = [container] + _start_shards(ctx, shards)
+        else:
+            click.echo(f'Starting {shards} shards on {label}')
+            started = _start_host(ctx, client, shards)
+        targets.extend((label, client, shard) for shard in started)
+
+    def run_shard(index):
+        label, client, shard = targets[index]
+        echo = sharding.PrefixedEcho(f'[{index}] ' if len(pool) == 1 else f'[{index}@{label}] ')
+        runctx = {
+            'commands': _process_steps(steps),
+            'container': shard,
+            'posargs': args + assignments[index],
+            'client': client,
+            'echo': echo,
+        }
+        started = time.monotonic()
+        exit_code = _run_commands(runctx)
+        echo.flush()
+        return exit_code, time.monotonic() - started
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        results = list(executor.map(run_shard, range(count)))
+
+    for index, (exit_code, duration) in enumerate(results):
+        click.echo(f'Shard {index}: {len(assignments[index])} files, exit code {exit_code}, {duration:.1f}s')
+    sharding.save_timings(sharding.update_timings(timings, assignments, [duration for _, duration in results]))
+    # a sum could wrap around to 0 as an exit status
+    exit_code = max(exit_code for exit_code, _ in results)
+    if copy is True:
+        # the first shard is the tests container, which ``run`` copies from into the current directory
+        for index, (_, client, shard) in enumerate(targets[1:], start=1):
+            exit_code = max(exit_code, _copy(ctx, client, pathlib.Path('.teststack', 'shards', str(index)), shard))
+    return exit_code
+
+
 @cli.command()
 @click.pass_context
 def status(ctx):
@@ -574,17 +1531,18 @@ def status(ctx):
     client = ctx.obj['client']
     click.echo('{:_^16}|{:_^36}|{:_^16}'.format('status', 'name', 'data'))
     network_name = ctx.obj['project_name']
+    names = []
     for service, data in ctx.obj['services'].items():
-        if "import" in data:
-            continue
-        name = f'{ctx.obj["project_name"]}_{service}'
-        container = client.get_container_data(name, network_name) or {}
+        if "import" not in data:
+            names.append(f'{ctx.obj["project_name"]}_{service}')
+            names.extend(isolation.replicas(names[-1], data))
+    names.append(f'{ctx.obj["project_name"]}_tests')
+    statuses = client.status_many(names)
+    containers = client.container_data_many(names, network_name)
+    for name in names:
+        container = containers[name] or {}
         container.pop('HOST', None)
-        click.echo(f'{client.status(name):^16}|{name:^36}|{str(container):^16}')
-    name = f'{ctx.obj["project_name"]}_tests'
-    container = client.get_container_data(name, network_name) or {}
-    container.pop('HOST', None)
-    click.echo(f'{client.status(name):^16}|{name:^36}|{str(container):^16}')
+        click.echo(f'{statuses[name]:^16}|{name:^36}|{str(container):^16}')
 
 
 @cli.command(name='import')
@@ -624,6 +1582,7 @@ def import_(ctx, repo, ref, stop):
             cli,
             [
                 f'--path={path}',
+                *instances.options(ctx),
                 'stop',
                 f'--prefix={ctx.obj.get("project_name")}.',
             ],
@@ -634,6 +1593,7 @@ def import_(ctx, repo, ref, stop):
             cli,
             [
                 f'--path={path}',
+                *instances.options(ctx),
                 'start',
                 '-m',
                 '--imp',
@@ -645,13 +1605,30 @@ def import_(ctx, repo, ref, stop):
 @cli.command(name='copy')
 @click.pass_context
 def copy_(ctx):
-    client = ctx.obj['client']
-    name = f'{ctx.obj.get("project_name")}_tests'
-    exit_code = 0
-    for src in ctx.obj.get('tests.copy', []):
-        result = client.cp(name, src)
-        if result is False:
-            click.echo(click.style(f'Failed to retrieve {src}!', fg='red'))
-            exit_code = 12
+    exit_code = _copy(ctx, ctx.obj['client'])
     if exit_code:
         sys.exit(exit_code)
+
+
+def _copy(ctx, client, directory=None, name=None):
+    """
+    Copy the files in ``tests.copy`` out of the tests container, into ``directory`` or the current directory.
+
+    ``name`` is the container to copy from instead, like the container of a shard.
+    """
+    if name is None:
+        name = f'{ctx.obj.get("project_name")}_tests'
+    exit_code = 0
+    cwd = os.getcwd()
+    if directory is not None:
+        directory.mkdir(parents=True, exist_ok=True)
+        os.chdir(directory)
+    try:
+        for src in ctx.obj.get('tests.copy', []):
+            result = client.cp(name, src)
+            if result is False:
+                click.echo(click.style(f'Failed to retrieve {src}!', fg='red'))
+                exit_code = 12
+    finally:
+        os.chdir(cwd)
+    return exit_code
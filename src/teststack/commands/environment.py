@@ -1,5 +1,9 @@
 import click.testing
 from teststack import cli
+from teststack import instances
+from teststack import isolation
+from teststack import lazy
+from teststack import services as services_
 from teststack.git import get_path
 
 
@@ -14,8 +18,11 @@ from teststack.git import get_path
 @click.option('--inside', is_flag=True, default=False, help='Export variables for inside a docker container')
 @click.option('--quiet', '-q', is_flag=True, help='Do not print out information')
 @click.option('--prefix', default='', help='Prefix name of containers for import')
+@click.option(
+    '--service', '-s', 'services', multiple=True, default=[services_.ALL], help='Service to export, default: all'
+)
 @click.pass_context
-def env(ctx, no_export, inside, quiet, prefix):
+def env(ctx, no_export, inside, quiet, prefix, services):
     """
     Output the environment variables for the teststack environment.
 
@@ -38,14 +45,31 @@ def env(ctx, no_export, inside, quiet, prefix):
     --prefix
 
         Prefixed name of containers for getting env from imports
+
+    --service, -s
+
+        only export the variables of this service, can be passed more than
+        once. Default: all
     """
+    services = tuple(services)
+    key = ('env', no_export, inside, prefix, services)
+    if key not in ctx.obj['memo']:
+        ctx.obj['memo'][key] = _env(ctx, no_export, inside, prefix, services)
+    envvars = ctx.obj['memo'][key]
+    if quiet is False:
+        click.echo('\n'.join(envvars))
+    return envvars
+
+
+def _env(ctx, no_export, inside, prefix, services=(services_.ALL,)):
     envvars = []
     client = ctx.obj.get('client')
-    for service, data in ctx.obj.get('services').items():
+    for service, data in services_.select(ctx, services).items():
         if 'import' in data:
             path = get_path(**data['import'])
             args = [
                 f'--path={path}',
+                *instances.options(ctx),
                 'import-env',
                 f'--prefix={ctx.obj.get("project_name")}.',
             ]
@@ -58,11 +82,20 @@ def env(ctx, no_export, inside, quiet, prefix):
             envvars.extend([line for line in result.stdout.strip('\n').split('\n') if line])
             continue
         name = f'{prefix}{ctx.obj.get("project_name")}_{service}'
-        container_data = client.get_container_data(name, network=ctx.obj['project_name'], inside=inside)
+        if lazy.enabled(data):
+            container_data = lazy.container_data(client, name, network=ctx.obj['project_name'], inside=inside)
+        else:
+            container_data = client.get_container_data(name, network=ctx.obj['project_name'], inside=inside)
         if container_data is None:
             continue
         container_data.update(data.get('environment', {}).copy())
+        workers = None
         for key, value in data.get('export', {}).items():
+            if isolation.WORKER in value:
+                if workers is None:
+                    workers = _worker_data(ctx, name, data, container_data, inside)
+                envvars.extend(isolation.render(key, value, workers, no_export=no_export))
+                continue
             envvars.append(
                 f'{"" if no_export else "export "}{key}={value}'.format_map(
                     container_data,
@@ -80,11 +113,18 @@ def env(ctx, no_export, inside, quiet, prefix):
     else:
         for key, value in ctx.obj.get('tests.environment', {}).items():
             envvars.append(f'{"" if no_export else "export "}{key}={value}')
-    if quiet is False:
-        click.echo('\n'.join(envvars))
     return envvars
 
 
+def _worker_data(ctx, name, data, container_data, inside):
+    client = ctx.obj['client']
+    values = {name: container_data}
+    for replica in isolation.replicas(name, data):
+        values[replica] = client.get_container_data(replica, network=ctx.obj['project_name'], inside=inside) or {}
+        values[replica].update(data.get('environment', {}).copy())
+    return [values[container] for container in isolation.containers(name, data)]
+
+
 @cli.command(name='import-env')
 @click.option(
     '--no-export',
@@ -0,0 +1,157 @@
+"""
+Asyncio interface for the container clients.
+
+Every client method blocks, so doing many engine operations at once would
+otherwise mean managing threads in each command. :class:`AsyncClient` describes
+the awaitable counterparts of the client methods that commands fan out, so a
+command can ``asyncio.gather`` hundreds of them on one event loop.
+
+Blocking drivers do not need to change. :func:`get_async_client` wraps them in
+:class:`ThreadedAsyncClient`, which runs each call in an executor, one at a
+time unless the client sets ``thread_safe`` to say that it can be called from
+several threads at once. A plugin
+registered under ``teststack.clients`` can instead ship a native
+``AsyncClient`` class in place of ``Client``, and teststack wraps it in
+:class:`SyncClient` for the commands that still call it synchronously.
+"""
+
+import asyncio
+import functools
+
+
+class AsyncClient:
+    """
+    Awaitable client methods that drivers can implement natively.
+    """
+
+    async def run(self, name, image, **kwargs):
+        raise NotImplementedError
+
+    async def start(self, name):
+        raise NotImplementedError
+
+    async def end_container(self, name):
+        raise NotImplementedError
+
+    async def get_container_data(self, name, network, inside=False):
+        raise NotImplementedError
+
+    async def run_command(self, container, command, user=None, echo=None):
+        raise NotImplementedError
+
+    async def cp(self, name, src):
+        raise NotImplementedError
+
+    async def build(self, dockerfile, tag, rebuild, **kwargs):
+        raise NotImplementedError
+
+
+class ThreadedAsyncClient(AsyncClient):
+    """
+    Run the methods of a blocking client in an executor.
+
+    Calls are serialized unless the client is ``thread_safe``.
+    """
+
+    def __init__(self, client, executor=None):
+        self.client = client
+        self.executor = executor
+        self._lock = None
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self.client, method), *args, **kwargs)
+        if getattr(self.client, 'thread_safe', False) is True:
+            return await loop.run_in_executor(self.executor, call)
+        if self._lock is None:
+            # created on first use, so it belongs to the running loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await loop.run_in_executor(self.executor, call)
+
+    async def run(self, name, image, **kwargs):
+        return await self._call('run', name=name, image=image, **kwargs)
+
+    async def start(self, name):
+        return await self._call('start', name)
+
+    async def end_container(self, name):
+        return await self._call('end_container', name)
+
+    async def get_container_data(self, name, network, inside=False):
+        return await self._call('get_container_data', name, network, inside=inside)
+
+    async def run_command(self, container, command, user=None, echo=None):
+        kwargs = {} if echo is None else {'echo': echo}
+        return await self._call('run_command', container, command, user=user, **kwargs)
+
+    async def cp(self, name, src):
+        return await self._call('cp', name, src)
+
+    async def build(self, dockerfile, tag, rebuild, **kwargs):
+        return await self._call('build', dockerfile, tag, rebuild, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        async def wrapper(*args, **kwargs):
+            return await self._call(name, *args, **kwargs)
+
+        return wrapper
+
+
+class SyncClient:
+    """
+    Blocking adapter around a native :class:`AsyncClient`.
+    """
+
+    def __init__(self, client):
+        self.aio = client
+        self.loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        method = getattr(self.aio, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return self.loop.run_until_complete(method(*args, **kwargs))
+
+        return wrapper
+
+
+def get_async_client(client):
+    """
+    Get the awaitable interface for whatever client the project is using.
+    """
+    if isinstance(client, SyncClient):
+        return client.aio
+    if isinstance(client, AsyncClient):
+        return client
+    return ThreadedAsyncClient(client)
+
+
+def run_async(client, main):
+    """
+    Run the coroutine function ``main`` with the awaitable interface of ``client``.
+
+    This is the blocking entry point for commands, which are not coroutines.
+    """
+    aio = get_async_client(client)
+    if isinstance(client, SyncClient):
+        return client.loop.run_until_complete(main(aio))
+    return asyncio.run(main(aio))
+
+
+def gather(client, method, *calls):
+    """
+    Call ``method`` concurrently once for each tuple of arguments in ``calls``.
+    """
+
+    async def _gather(aio):
+        return await asyncio.gather(*(getattr(aio, method)(*args) for args in calls))
+
+    return run_async(client, _gather)
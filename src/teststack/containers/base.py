@@ -0,0 +1,421 @@
+"""
+Base class for container drivers.
+
+Drivers are registered under the ``teststack.clients`` entry point group, and
+each module provides a ``Client`` class. The commands only talk to the engine
+through the methods documented here, so a new driver needs to implement the
+single container methods, and gets working batch methods for free.
+
+The batch methods take every name the command cares about at once, and return
+a dictionary keyed by those names. The defaults here just loop over the single
+item methods, but drivers should override them with one list call to the
+engine, so stack wide commands like ``status`` and ``stop`` make one api call
+instead of one per service.
+
+Every container teststack creates carries the ``teststack.project`` and
+``teststack.service`` labels, which is what :meth:`Client.events` subscribers
+filter on, and a ``teststack.config-hash`` label of the settings it was created
+with, which is how ``start`` tells when a container is out of date.
+"""
+
+import re
+
+PROJECT_LABEL = 'teststack.project'
+SERVICE_LABEL = 'teststack.service'
+CONFIG_LABEL = 'teststack.config-hash'
+SHARD_LABEL = 'teststack.shard'
+CACHE_LABEL = 'teststack.cache'
+WARM_LABEL = 'teststack.warm'
+
+
+def normalize_tag(tag):
+    """
+    Reduce an image reference to the short form docker reports in ``RepoTags``.
+    """
+    if ':' not in tag.rsplit('/', 1)[-1]:
+        tag = f'{tag}:latest'
+    for registry in ('docker.io/', 'localhost/'):
+        if tag.startswith(registry):
+            tag = tag.replace(registry, '', 1)
+    if tag.startswith('library/'):
+        tag = tag.replace('library/', '', 1)
+    return tag
+
+
+def engine_healthcheck(healthcheck):
+    """
+    Convert a docker-py style healthcheck into the engine api ``HealthConfig`` format.
+    """
+    if not healthcheck:
+        return None
+    keys = {
+        'test': 'Test',
+        'interval': 'Interval',
+        'timeout': 'Timeout',
+        'retries': 'Retries',
+        'start_period': 'StartPeriod',
+    }
+    return {keys[key]: value for key, value in healthcheck.items() if key in keys}
+
+
+class Client:
+    # whether the methods can be called from several threads at once, see
+    # :class:`teststack.containers.aio.ThreadedAsyncClient`
+    thread_safe = False
+
+    def end_container(self, name):
+        """
+        Stop and remove a container and its anonymous volumes.
+        """
+        raise NotImplementedError
+
+    def container_get(self, name):
+        """
+        Get the id of a container, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def container_get_current_image(self, name):
+        """
+        Get the image id a container was created from, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def run(
+        self,
+        name,
+        image,
+        ports=None,
+        command=None,
+        environment=None,
+        stream=False,
+        user=None,
+        volumes=None,
+        mount_cwd=False,
+        network=None,
+        service='tests',
+        labels=None,
+        healthcheck=None,
+        archives=None,
+        tmpfs=None,
+    ):
+        """
+        Create and start a container, returning its id.
+
+        ``healthcheck`` uses the docker-py format, with ``test``, ``interval``,
+        ``timeout``, ``retries`` and ``start_period`` keys and durations in
+        nanoseconds.
+
+        ``archives`` is a list of directories and tar archives to extract into
+        them, after the container is created but before it starts.
+
+        ``tmpfs`` maps paths in the container to the options of an in memory
+        filesystem to mount there, like ``size=512m,mode=1777``.
+        """
+        raise NotImplementedError
+
+    def stop(self, name):
+        """
+        Stop a container, keeping it and its data.
+        """
+        raise NotImplementedError
+
+    def rename(self, name, new_name):
+        """
+        Rename a container.
+        """
+        raise NotImplementedError
+
+    def start(self, name):
+        """
+        Start an existing container.
+        """
+        raise NotImplementedError
+
+    def status(self, name):
+        """
+        Get the state of a container, or ``notfound``.
+        """
+        raise NotImplementedError
+
+    def logs(self, name):
+        """
+        Get the logs of a container.
+        """
+        raise NotImplementedError
+
+    def image_get(self, tag):
+        """
+        Get the id of an image, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def image_list(self, repository):
+        """
+        List the images in a repository with their ``id``, ``tags``, ``size`` and ``last_used`` time.
+        """
+        raise NotImplementedError
+
+    def image_remove(self, tag):
+        """
+        Remove an image tag, returning False if the engine refused.
+        """
+        raise NotImplementedError
+
+    def image_prune(self):
+        """
+        Remove dangling images, returning the number of bytes reclaimed.
+        """
+        raise NotImplementedError
+
+    def run_command(self, container, command, user=None, echo=None):
+        """
+        Run a command in a container, streaming its output, and return the exit code.
+
+        Output is written with ``echo``, which defaults to ``click.echo``. When
+        another ``echo`` is passed, the output is being multiplexed with other
+        commands, so stdin is not forwarded to the container.
+        """
+        raise NotImplementedError
+
+    def build(
+        self,
+        dockerfile,
+        tag,
+        rebuild,
+        directory='.',
+        buildargs=None,
+        secrets=None,
+        stage=None,
+        cache_from=None,
+        cache_to=None,
+    ):
+        """
+        Build an image.
+        """
+        raise NotImplementedError
+
+    def cp(self, name, src):
+        """
+        Copy a file out of a container into the current directory.
+        """
+        raise NotImplementedError
+
+    def volume_ensure(self, name, labels=None):
+        """
+        Create a named volume, unless it exists.
+        """
+        raise NotImplementedError
+
+    def volume_list(self, label):
+        """
+        List the named volumes with the label ``label``, with their ``name`` and ``size`` in bytes, or None if unknown.
+        """
+        raise NotImplementedError
+
+    def volume_remove(self, name):
+        """
+        Remove a named volume, returning False if the engine refused, like when it is in use.
+        """
+        raise NotImplementedError
+
+    def get_archive(self, name, path):
+        """
+        Get a tar archive of a path in a container, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def put_archive(self, name, data, path=None):
+        """
+        Extract a tar archive, as bytes or a file, into a container, at ``path`` or its working directory.
+        """
+        raise NotImplementedError
+
+    def image_save(self, tag, output):
+        """
+        Export an image with its tag as a tar archive, written to the file ``output`` as it is streamed.
+        """
+        raise NotImplementedError
+
+    def image_load(self, data):
+        """
+        Import images from a tar archive made by ``image_save``, as bytes or a file.
+        """
+        raise NotImplementedError
+
+    def get_container_data(self, name, network, inside=False):
+        """
+        Get the ``HOST`` and ``PORT;<port>`` values used to render exports.
+        """
+        raise NotImplementedError
+
+    def exec(self, container, user=None, command=None):
+        """
+        Replace the current process with an interactive shell in the container.
+        """
+        raise NotImplementedError
+
+    def events(self, filters=None, since=None, until=None):
+        """
+        Stream engine events as decoded dictionaries in the docker format.
+
+        ``since`` and ``until`` are unix timestamps. Events from before the
+        subscription started are replayed from ``since``, and the stream ends at
+        ``until``, or never if it is None.
+        """
+        raise NotImplementedError
+
+    def inspect_many(self, names):
+        """
+        Get the ``id``, ``image``, ``status``, ``health`` and ``labels`` of many containers.
+
+        ``health`` is None when the container has no healthcheck or the driver
+        cannot tell, and ``labels`` is None when the driver cannot tell.
+
+        Containers that do not exist map to None.
+        """
+        result = {}
+        for name in names:
+            container = self.container_get(name)
+            if container is None:
+                result[name] = None
+                continue
+            result[name] = {
+                'id': container,
+                'image': self.container_get_current_image(name),
+                'status': self.status(name),
+                'health': None,
+                'labels': None,
+            }
+        return result
+
+    def status_many(self, names):
+        """
+        Get the state of many containers.
+        """
+        return {name: self.status(name) for name in names}
+
+    def images_present(self, tags):
+        """
+        Get the ids of many images, with None for images that are missing.
+        """
+        return {tag: self.image_get(tag) for tag in tags}
+
+    def container_data_many(self, names, network, inside=False):
+        """
+        Get the ``get_container_data`` values for many containers.
+        """
+        return {name: self.get_container_data(name, network, inside=inside) for name in names}
+
+    def container_names(self, labels):
+        """
+        Get the names of the containers that have all of ``labels``.
+
+        Drivers that cannot filter on labels find nothing.
+        """
+        return []
+
+
+def usage_size(size):
+    """
+    Get a size from the engine disk usage, where a negative size means it was not calculated.
+    """
+    if size is None or size < 0:
+        return None
+    return size
+
+
+def list_filters(names=None, labels=None):
+    """
+    Build the engine list filters for container names and labels.
+    """
+    filters = {}
+    if names is not None:
+        filters['name'] = list(names)
+    if labels:
+        filters['label'] = [f'{key}={value}' for key, value in labels.items()]
+    return filters
+
+
+def _health_from_status(status):
+    # the list endpoint only reports health inside the status text, like "Up 5 seconds (healthy)"
+    match = re.search(r'\((healthy|unhealthy|health: starting)\)', status or '')
+    if match is None:
+        return None
+    return match.group(1).replace('health: ', '')
+
+
+class ListClient(Client):
+    """
+    Batch methods for engines that serve the docker ``/containers/json`` format.
+
+    Subclasses implement ``_list_containers`` and ``_list_images``, returning
+    the raw list entries from the engine. ``_list_containers`` takes the names
+    and labels to filter on, as in :func:`list_filters`.
+    """
+
+    def _list_containers(self, names=None, labels=None):
+        raise NotImplementedError
+
+    def _list_images(self):
+        raise NotImplementedError
+
+    def _containers_by_name(self, names):
+        wanted = set(names)
+        found = {}
+        for attrs in self._list_containers(names=list(wanted)):
+            for name in attrs.get('Names') or []:
+                name = name.lstrip('/')
+                if name in wanted:
+                    found[name] = attrs
+        return found
+
+    def inspect_many(self, names):
+        found = self._containers_by_name(names)
+        result = {}
+        for name in names:
+            attrs = found.get(name)
+            if attrs is None:
+                result[name] = None
+                continue
+            result[name] = {
+                'id': attrs['Id'],
+                'image': attrs.get('ImageID'),
+                'status': attrs.get('State'),
+                'health': _health_from_status(attrs.get('Status')),
+                'labels': attrs.get('Labels') or {},
+            }
+        return result
+
+    def container_names(self, labels):
+        return [name.lstrip('/') for attrs in self._list_containers(labels=labels) for name in attrs['Names'][:1]]
+
+    def status_many(self, names):
+        found = self._containers_by_name(names)
+        return {name: found[name].get('State') if name in found else 'notfound' for name in names}
+
+    def images_present(self, tags):
+        images = {}
+        for attrs in self._list_images():
+            for tag in attrs.get('RepoTags') or []:
+                images[normalize_tag(tag)] = attrs['Id']
+        return {tag: images.get(normalize_tag(tag)) for tag in tags}
+
+    def container_data_many(self, names, network, inside=False):
+        found = self._containers_by_name(names)
+        result = {}
+        for name in names:
+            attrs = found.get(name)
+            if attrs is None:
+                result[name] = None
+                continue
+            networks = (attrs.get('NetworkSettings') or {}).get('Networks') or {}
+            data = {'HOST': networks.get(network, {}).get('IPAddress') if inside else 'localhost'}
+            for port in attrs.get('Ports') or []:
+                key = f'PORT;{port["PrivatePort"]}/{port.get("Type", "tcp")}'
+                if inside:
+                    data[key] = str(port['PrivatePort'])
+                elif port.get('PublicPort'):
+                    data.setdefault(key, str(port['PublicPort']))
+            result[name] = data
+        return result
@@ -10,12 +10,27 @@ import tarfile
 import click
 import docker.errors
 
+from ..utils import parse_timestamp
 from ..utils import read_from_stdin
+from ..utils import session_pool_stats
+from .base import list_filters
+from .base import ListClient
+from .base import PROJECT_LABEL
+from .base import usage_size
 
 
-class Client:
-    def __init__(self, **kwargs):
-        context = docker.ContextAPI.get_current_context()
+class Client(ListClient):
+    thread_safe = True
+
+    def __init__(self, pool_size=None, keep_alive=True, context=None, **kwargs):
+        if pool_size is not None:
+            kwargs['max_pool_size'] = pool_size
+        if context is None:
+            context = docker.ContextAPI.get_current_context()
+        else:
+            name, context = context, docker.ContextAPI.get_context(context)
+            if context is None:
+                raise click.UsageError(f'Docker context {name} does not exist')
         if context.name == 'default':  # pragma: no branch
             self.client = docker.from_env(**kwargs)
         else:
@@ -24,6 +39,12 @@ class Client:
                 tls=context.TLSConfig,
                 **kwargs,
             )  # pragma: no cover
+        if keep_alive is False:
+            self.client.api.headers['Connection'] = 'close'
+        self._networks = {}
+
+    def pool_stats(self):
+        return session_pool_stats(self.client.api)
 
     def end_container(self, name):
         try:
@@ -46,14 +67,64 @@ class Client:
             return self.client.containers.get(container).image.id
         return None
 
+    def _list_containers(self, names=None, labels=None):
+        filters = list_filters(names, labels)
+        return [container.attrs for container in self.client.containers.list(all=True, sparse=True, filters=filters)]
+
+    def _list_images(self):
+        return [image.attrs for image in self.client.images.list()]
+
     def network_get(self, names=None, ids=None):
         networks = self.client.networks.list(names=names or [], ids=ids or [])
+        if names:
+            # the name filter matches substrings
+            networks = [network for network in networks if network.name in names]
         if not networks:
             return None
         return networks[0]
 
     def network_create(self, name):
-        return self.client.networks.create(name, driver="bridge")
+        network = self.client.networks.create(name, driver="bridge", labels={PROJECT_LABEL: name})
+        self._networks[name] = network.id
+        return network
+
+    def network_ensure(self, name):
+        """
+        Get the id of a network, creating it if it is missing.
+
+        The id is cached for the life of the client, so only the first
+        container on a network costs an api call.
+        """
+        if name not in self._networks:
+            network = self.network_get(names=[name])
+            if network is None:
+                network = self.network_create(name)
+            self._networks[name] = network.id
+        return self._networks[name]
+
+    def network_remove(self, name):
+        """
+        Remove a network, if teststack created it.
+        """
+        self._networks.pop(name, None)
+        network = self.network_get(names=[name])
+        if network is None or (network.attrs.get('Labels') or {}).get(PROJECT_LABEL) != name:
+            return False
+        try:
+            network.remove()
+        except docker.errors.APIError:
+            # containers from outside the project are still attached
+            return False
+        return True
+
+    def network_gateway(self, name):
+        """
+        Get the address of the host on a network, or None if it is missing.
+        """
+        network = self.network_get(names=[name])
+        if network is None:
+            return None
+        return (((network.attrs.get('IPAM') or {}).get('Config') or [{}])[0]).get('Gateway')
 
     def network_prune(self):
         self.client.networks.prune()
@@ -71,13 +142,16 @@ class Client:
         mount_cwd=False,
         network='bridge',
         service='tests',
+        labels=None,
+        healthcheck=None,
+        archives=None,
+        tmpfs=None,
     ):
-        networkobj = self.network_get(names=[network])
-        if networkobj is None:
-            self.network_create(network)
+        self.network_ensure(network)
 
         if mount_cwd is True:
-            volumes = volumes or {}
+            # the caller's spec was already hashed, and may be reused for shards
+            volumes = dict(volumes or {})
             volumes.update(
                 {
                     os.getcwd(): {
@@ -96,19 +170,33 @@ class Client:
         elif command:
             entrypoint = {"command": command}
 
-        return self.client.containers.run(
-            name=name,
-            image=image,
-            detach=True,
-            stream=stream,
-            user=user,
-            ports=ports or {},
-            environment=environment or {},
-            volumes=volumes,
-            network=network,
-            hostname=service,
+        kwargs = {
+            'name': name,
+            'image': image,
+            'user': user,
+            'ports': ports or {},
+            'environment': environment or {},
+            'volumes': volumes,
+            'network': network,
+            'hostname': service,
+            'labels': labels or {},
+            'healthcheck': healthcheck,
+            'tmpfs': tmpfs or {},
             **entrypoint,
-        ).id
+        }
+        if not archives:
+            return self.client.containers.run(detach=True, stream=stream, **kwargs).id
+
+        if self.image_get(image) is None:
+            self.client.images.pull(image)
+        container = self.client.containers.create(**kwargs)
+        for path, data in archives:
+            container.put_archive(path, data)
+        container.start()
+        return container.id
+
+    def events(self, filters=None, since=None, until=None):
+        return self.client.events(since=since, until=until, filters=filters, decode=True)
 
     def cp(self, name, src):
         container = self.client.containers.get(name)
@@ -127,6 +215,56 @@ class Client:
         archive.extract(src)
         return True
 
+    def volume_ensure(self, name, labels=None):
+        try:
+            self.client.volumes.get(name)
+        except docker.errors.NotFound:
+            self.client.volumes.create(name, labels=labels or {})
+
+    def volume_list(self, label):
+        volumes = self.client.volumes.list(filters={'label': [label]})
+        if not volumes:
+            return []
+        sizes = {
+            volume['Name']: (volume.get('UsageData') or {}).get('Size')
+            for volume in self.client.df().get('Volumes') or []
+        }
+        return [{'name': volume.name, 'size': usage_size(sizes.get(volume.name))} for volume in volumes]
+
+    def volume_remove(self, name):
+        try:
+            self.client.volumes.get(name).remove()
+        except docker.errors.APIError:
+            return False
+        return True
+
+    def stop(self, name):
+        self.client.containers.get(name).stop()
+
+    def rename(self, name, new_name):
+        self.client.containers.get(name).rename(new_name)
+
+    def get_archive(self, name, path):
+        try:
+            data, _ = self.client.containers.get(name).get_archive(path)
+        except docker.errors.NotFound:
+            return None
+        return b''.join(data)
+
+    def put_archive(self, name, data, path=None):
+        container = self.client.containers.get(name)
+        container.put_archive(path or container.attrs['Config']['WorkingDir'] or '/', data)
+
+    def image_save(self, tag, output):
+        for chunk in self.client.images.get(tag).save(named=True):
+            output.write(chunk)
+
+    def image_load(self, data):
+        self.client.images.load(data)
+
+    def capacity(self):
+        return self.client.info().get('NCPU', 1)
+
     @staticmethod
     def _get_network_id(network):
         if 'NetworkId' in network:
@@ -138,11 +276,11 @@ class Client:
     def start(self, name):
         container = self.client.containers.get(name)
         for network_name, network in container.attrs['NetworkSettings']['Networks'].items():
-            if not self.network_get(ids=[self._get_network_id(network)]):
+            # reattach containers whose network was removed and recreated since they were created
+            network_id = self.network_ensure(network_name)
+            if self._get_network_id(network) != network_id:
                 self.client.api.disconnect_container_from_network(container.id, network_name, force=True)
-                if not self.network_get(names=[network_name]):
-                    self.network_create(name=network_name)
-                self.network_get(names=[network_name]).connect(container)
+                self.client.api.connect_container_to_network(container.id, network_id)
         container.start()
 
     def status(self, name):
@@ -163,9 +301,37 @@ class Client:
         except docker.errors.ImageNotFound:
             return None
 
-    def run_command(self, container, command, user=None):
+    def image_list(self, repository):
+        images = []
+        for image in self.client.images.list(filters={'reference': repository}):
+            metadata = image.attrs.get('Metadata') or {}
+            images.append(
+                {
+                    'id': image.id,
+                    'tags': [tag for tag in image.tags if tag.rsplit(':', 1)[0] == repository],
+                    'size': image.attrs.get('Size', 0),
+                    'last_used': max(
+                        parse_timestamp(image.attrs.get('Created', 0)),
+                        parse_timestamp(metadata.get('LastTagTime') or 0),
+                    ),
+                }
+            )
+        return images
+
+    def image_remove(self, tag):
+        try:
+            self.client.images.remove(tag)
+        except docker.errors.APIError:
+            return False
+        return True
+
+    def image_prune(self):
+        return self.client.images.prune(filters={'dangling': True}).get('SpaceReclaimed') or 0
+
+    def run_command(self, container, command, user=None, echo=None):
         container = self.client.containers.get(container)
-        click.echo(click.style(f'Run Command: {command}', fg='green'))
+        stdin, echo = echo is None, echo or click.echo
+        echo(click.style(f'Run Command: {command}', fg='green'))
         terminal = shutil.get_terminal_size()
         exec_id = container.client.api.exec_create(
             container.id,
@@ -185,7 +351,7 @@ class Client:
             socket=True,
         )
 
-        with read_from_stdin() as fd:
+        with read_from_stdin(enabled=stdin) as fd:
             if fd is not None:  # pragma: no cover
                 sock = getattr(sock, '_sock', sock)
                 BREAK = False
@@ -196,12 +362,12 @@ class Client:
                             line = read.recv(4096)
                             if not line:
                                 BREAK = True
-                            click.echo(line, nl=False)
+                            echo(line, nl=False)
                         else:
                             sock.send(sys.stdin.read(1).encode('utf-8'))
             else:
                 for line in sock:
-                    click.echo(line, nl=False)
+                    echo(line, nl=False)
         return container.client.api.exec_inspect(exec_id)['ExitCode']
 
     def build(
@@ -213,6 +379,8 @@ class Client:
         buildargs=None,
         secrets=None,
         stage=None,
+        cache_from=None,
+        cache_to=None,
     ):
         command = [
             "docker",
@@ -232,6 +400,10 @@ class Client:
             for key, value in secrets.items():
                 source = os.path.expanduser(value["source"])
                 command.append(f"--secret=id={key},source={source}")
+        for cache in [cache_from] if isinstance(cache_from, str) else cache_from or []:
+            command.append(f"--cache-from={cache}")
+        for cache in [cache_to] if isinstance(cache_to, str) else cache_to or []:
+            command.append(f"--cache-to={cache}")
         subprocess.run(command)
 
     def get_container_data(self, name, network, inside=False):
@@ -240,7 +412,9 @@ class Client:
             container = self.client.containers.get(name)
         except docker.errors.NotFound:
             return None
-        self.start(name)
+        if container.status != 'running':
+            self.start(name)
+            container.reload()
         data['HOST'] = container.attrs['NetworkSettings']['Networks'][network]['IPAddress'] if inside else 'localhost'
         for port, port_data in container.attrs['NetworkSettings']['Ports'].items():
             if inside:
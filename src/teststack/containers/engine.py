@@ -0,0 +1,673 @@
+"""
+Client for talking to the engine api directly over its unix socket.
+
+Docker and podman both serve the same Engine REST API. This driver speaks it
+with only the standard library, over a small pool of keep-alive connections,
+instead of importing the docker or podman SDKs on every ``teststack`` call.
+Each connection is only used by one thread at a time, so the client is safe to
+call concurrently.
+
+.. code-block:: toml
+
+    [client]
+    name = "engine"
+
+The socket is found from ``$DOCKER_HOST``, then ``/var/run/docker.sock``, then
+the rootless podman socket. It can also be set explicitly, along with the cli
+used for builds and ``teststack exec``.
+
+.. code-block:: toml
+
+    [client]
+    name = "engine"
+    base_url = "unix:///run/user/1000/podman/podman.sock"
+    cli = "podman"
+
+The api version is negotiated with the engine on the first request, using the
+newest version both support, like the docker sdk does with ``version = "auto"``.
+A fixed ``version`` can be set in ``[client]`` instead.
+"""
+
+import http.client
+import io
+import json
+import os
+import select
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import urllib.parse
+
+import click
+
+from ..utils import parse_timestamp
+from ..utils import read_from_stdin
+from .base import engine_healthcheck
+from .base import list_filters
+from .base import ListClient
+from .base import PROJECT_LABEL
+from .base import usage_size
+
+# the newest api version the request bodies here are written for
+API_VERSION = '1.44'
+# methods that are safe to send again when a reused connection turns out to be closed
+IDEMPOTENT = ('GET', 'HEAD')
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+
+class NotFound(APIError):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+        self.connects = 0
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+        self.connects += 1
+
+
+def _default_socket():
+    host = os.environ.get('DOCKER_HOST')
+    if host:
+        return host
+    paths = ['/var/run/docker.sock']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        paths.append(os.path.join(os.environ['XDG_RUNTIME_DIR'], 'podman', 'podman.sock'))
+    for path in paths:
+        if os.path.exists(path):
+            return f'unix://{path}'
+    return f'unix://{paths[0]}'
+
+
+class Client(ListClient):
+    thread_safe = True
+
+    def __init__(self, base_url=None, version='auto', cli='docker', timeout=None):
+        base_url = base_url or _default_socket()
+        if not base_url.startswith('unix://'):
+            raise click.UsageError(f'The engine client only supports unix sockets, not {base_url}')
+        self.socket_path = base_url.split('://', 1)[1]
+        self.version = str(version).lstrip('v')
+        self.cli = cli
+        self.timeout = timeout
+        self.requests = 0
+        self._idle = []
+        self._connections = []
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._networks = {}
+
+    def pool_stats(self):
+        with self._lock:
+            return {
+                'pools': 1,
+                'connections': sum(connection.connects for connection in self._connections),
+                'idle': len(self._idle),
+                'requests': self.requests,
+            }
+
+    def _checkout(self):
+        with self._lock:
+            self.requests += 1
+            if self._idle:
+                return self._idle.pop()
+            connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+            self._connections.append(connection)
+            return connection
+
+    def _checkin(self, connection):
+        with self._lock:
+            self._idle.append(connection)
+
+    def _api_version(self):
+        """
+        Get the api version to use, asking the engine for the newest one it supports the first time.
+        """
+        if self.version != 'auto':
+            return self.version
+        with self._version_lock:
+            if self.version == 'auto':
+                try:
+                    version = self._request('GET', '/version', versioned=False)['ApiVersion']
+                except (APIError, KeyError, TypeError):
+                    version = API_VERSION
+                self.version = min(version, API_VERSION, key=lambda value: tuple(map(int, value.split('.'))))
+            return self.version
+
+    def _url(self, path, params=None, versioned=True):
+        url = f'/v{self._api_version()}{path}' if versioned else path
+        if params:
+            params = {key: json.dumps(value) if isinstance(value, dict) else value for key, value in params.items()}
+            url = f'{url}?{urllib.parse.urlencode(params)}'
+        return url
+
+    def _request(self, method, path, params=None, body=None, raw=False, versioned=True, output=None):
+        """
+        Make a request on a keep-alive connection that no other thread is using.
+
+        If the engine closed the connection since it was last used, reconnect
+        and send the request once more, but only if it is idempotent or it
+        failed before it was sent.
+
+        Archives can be passed as a file for ``body``, and a successful
+        response is copied into the file ``output`` instead of being returned,
+        so large images are never held in memory.
+        """
+        headers = {}
+        if isinstance(body, bytes) or hasattr(body, 'read'):
+            headers['Content-Type'] = 'application/x-tar'
+        elif body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if hasattr(body, 'seek'):
+            start = body.tell()
+            headers['Content-Length'] = str(body.seek(0, os.SEEK_END) - start)
+            body.seek(start)
+        # where the files start, to rewind them when the request is sent again
+        positions = [(stream, stream.tell()) for stream in (body, output) if hasattr(stream, 'seek')]
+
+        url = self._url(path, params, versioned)
+        connection = self._checkout()
+        try:
+            for attempt in range(2):
+                sent = False
+                for stream, position in positions:
+                    stream.seek(position)
+                if output is not None:
+                    output.truncate()
+                try:
+                    connection.request(method, url, body=body, headers=headers)
+                    sent = True
+                    response = connection.getresponse()
+                    if output is not None and response.status < 400:
+                        shutil.copyfileobj(response, output)
+                        data = b''
+                    else:
+                        data = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    connection.close()
+                    if attempt or (sent and method not in IDEMPOTENT):
+                        raise
+        finally:
+            self._checkin(connection)
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data).get('message', '')
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise (NotFound if response.status == 404 else APIError)(response.status, message)
+        if raw is True:
+            return data
+        if not data:
+            return None
+        return json.loads(data)
+
+    def events(self, filters=None, since=None, until=None):
+        """
+        Stream events on a connection of their own, so the pool stays free for requests.
+        """
+        params = {'filters': filters or {}}
+        if since is not None:
+            params['since'] = since
+        if until is not None:
+            params['until'] = until
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            connection.request('GET', self._url('/events', params))
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise APIError(response.status, response.read().decode('utf-8', 'replace'))
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+    def _inspect(self, name):
+        return self._request('GET', f'/containers/{name}/json')
+
+    def end_container(self, name):
+        try:
+            self._request('POST', f'/containers/{name}/stop')
+        except NotFound:
+            return
+        self._request('POST', f'/containers/{name}/wait')
+        self._request('DELETE', f'/containers/{name}', params={'v': 1})
+
+    def container_get(self, name):
+        try:
+            return self._inspect(name)['Id']
+        except NotFound:
+            return None
+
+    def container_get_current_image(self, name):
+        try:
+            return self._inspect(name)['Image']
+        except NotFound:
+            return None
+
+    def _list_containers(self, names=None, labels=None):
+        return self._request('GET', '/containers/json', params={'all': 1, 'filters': list_filters(names, labels)})
+
+    def _list_images(self):
+        return self._request('GET', '/images/json')
+
+    def network_get(self, names=None, ids=None):
+        filters = {}
+        if names:
+            filters['name'] = list(names)
+        if ids:
+            filters['id'] = list(ids)
+        for network in self._request('GET', '/networks', params={'filters': filters}):
+            if names and network['Name'] not in names:
+                continue
+            return network
+        return None
+
+    def network_create(self, name):
+        network = self._request(
+            'POST',
+            '/networks/create',
+            body={'Name': name, 'Driver': 'bridge', 'CheckDuplicate': True, 'Labels': {PROJECT_LABEL: name}},
+        )
+        self._networks[name] = network['Id']
+        return network
+
+    def network_ensure(self, name):
+        """
+        Get the id of a network, creating it if it is missing, cached for the life of the client.
+        """
+        if name not in self._networks:
+            network = self.network_get(names=[name])
+            if network is None:
+                network = self.network_create(name)
+            self._networks[name] = network['Id']
+        return self._networks[name]
+
+    def network_remove(self, name):
+        """
+        Remove a network, if teststack created it.
+        """
+        self._networks.pop(name, None)
+        network = self.network_get(names=[name])
+        if network is None or (network.get('Labels') or {}).get(PROJECT_LABEL) != name:
+            return False
+        try:
+            self._request('DELETE', f'/networks/{network["Id"]}')
+        except APIError:
+            return False
+        return True
+
+    def network_connect(self, network, container):
+        self._request('POST', f'/networks/{network}/connect', body={'Container': container})
+
+    def network_gateway(self, name):
+        """
+        Get the address of the host on a network, or None if it is missing.
+        """
+        network = self.network_get(names=[name])
+        if network is None:
+            return None
+        return (((network.get('IPAM') or {}).get('Config') or [{}])[0]).get('Gateway')
+
+    def network_prune(self):
+        self._request('POST', '/networks/prune')
+
+    def _pull(self, image):
+        repository, _, tag = image.rpartition(':')
+        if not repository or '/' in tag:
+            repository, tag = image, 'latest'
+        self._request('POST', '/images/create', params={'fromImage': repository, 'tag': tag}, raw=True)
+
+    def run(
+        self,
+        name,
+        image,
+        ports=None,
+        command=None,
+        environment=None,
+        stream=False,
+        user=None,
+        volumes=None,
+        mount_cwd=False,
+        network='bridge',
+        service='tests',
+        labels=None,
+        healthcheck=None,
+        archives=None,
+        tmpfs=None,
+    ):
+        self.network_ensure(network)
+
+        # the caller's spec was already hashed, and may be reused for shards
+        volumes = dict(volumes or {})
+        if mount_cwd is True:
+            workdir = self._request('GET', f'/images/{image}/json')['Config']['WorkingDir']
+            volumes[os.getcwd()] = {'bind': workdir, 'mode': 'rw'}
+
+        ports = ports or {}
+        config = {
+            'Image': image,
+            'Hostname': service,
+            'Labels': labels or {},
+            'User': user or '',
+            'Env': [f'{key}={value}' for key, value in (environment or {}).items()],
+            'ExposedPorts': {port: {} for port in ports},
+            'HostConfig': {
+                'PortBindings': {port: [{'HostPort': str(hostport or '')}] for port, hostport in ports.items()},
+                'Binds': [f'{source}:{bind["bind"]}:{bind.get("mode", "rw")}' for source, bind in volumes.items()],
+                'NetworkMode': network,
+                'Tmpfs': tmpfs or {},
+            },
+        }
+        if healthcheck:
+            config['Healthcheck'] = engine_healthcheck(healthcheck)
+        if command is True:
+            config['Entrypoint'] = ['/bin/sh']
+            config['Cmd'] = ['-c', 'trap "trap - TERM; kill -s TERM -- -$$" TERM; tail -f /dev/null & wait']
+        elif command:
+            config['Cmd'] = shlex.split(command) if isinstance(command, str) else list(command)
+
+        try:
+            container = self._request('POST', '/containers/create', params={'name': name}, body=config)
+        except NotFound:
+            self._pull(image)
+            container = self._request('POST', '/containers/create', params={'name': name}, body=config)
+        for path, data in archives or []:
+            self.put_archive(container['Id'], data, path=path)
+        self._request('POST', f'/containers/{container["Id"]}/start')
+        return container['Id']
+
+    def cp(self, name, src):
+        if not src.startswith('/'):
+            workdir = self._inspect(name)['Config']['WorkingDir']
+            src_path = '/'.join([workdir.rstrip('/'), src])
+        else:
+            src_path, src = src, os.path.basename(src)
+
+        try:
+            data = self._request('GET', f'/containers/{name}/archive', params={'path': src_path}, raw=True)
+        except NotFound:
+            return False
+        archive = tarfile.TarFile(fileobj=io.BytesIO(data))
+        archive.extract(src)
+        return True
+
+    def volume_ensure(self, name, labels=None):
+        try:
+            self._request('GET', f'/volumes/{name}')
+        except NotFound:
+            self._request('POST', '/volumes/create', body={'Name': name, 'Labels': labels or {}})
+
+    def volume_list(self, label):
+        volumes = (self._request('GET', '/volumes', params={'filters': {'label': [label]}}) or {}).get('Volumes') or []
+        if not volumes:
+            return []
+        sizes = {
+            volume['Name']: (volume.get('UsageData') or {}).get('Size')
+            for volume in self._request('GET', '/system/df').get('Volumes') or []
+        }
+        return [{'name': volume['Name'], 'size': usage_size(sizes.get(volume['Name']))} for volume in volumes]
+
+    def volume_remove(self, name):
+        try:
+            self._request('DELETE', f'/volumes/{name}')
+        except APIError:
+            return False
+        return True
+
+    def stop(self, name):
+        self._request('POST', f'/containers/{name}/stop')
+
+    def rename(self, name, new_name):
+        self._request('POST', f'/containers/{name}/rename', params={'name': new_name})
+
+    def get_archive(self, name, path):
+        try:
+            return self._request('GET', f'/containers/{name}/archive', params={'path': path}, raw=True)
+        except NotFound:
+            return None
+
+    def put_archive(self, name, data, path=None):
+        path = path or self._inspect(name)['Config']['WorkingDir'] or '/'
+        self._request('PUT', f'/containers/{name}/archive', params={'path': path}, body=data, raw=True)
+
+    def image_save(self, tag, output):
+        self._request('GET', f'/images/{tag}/get', raw=True, output=output)
+
+    def image_load(self, data):
+        self._request('POST', '/images/load', params={'quiet': 1}, body=data, raw=True)
+
+    def capacity(self):
+        return self._request('GET', '/info').get('NCPU', 1)
+
+    @staticmethod
+    def _get_network_id(network):
+        if 'NetworkId' in network:
+            return network['NetworkId']
+        if 'NetworkID' in network:
+            return network['NetworkID']
+        return None
+
+    def start(self, name):
+        container = self._inspect(name)
+        for network_name, network in container['NetworkSettings']['Networks'].items():
+            network_id = self.network_ensure(network_name)
+            if self._get_network_id(network) != network_id:
+                self._request(
+                    'POST',
+                    f'/networks/{network_name}/disconnect',
+                    body={'Container': container['Id'], 'Force': True},
+                )
+                self.network_connect(network_id, container['Id'])
+        self._request('POST', f'/containers/{container["Id"]}/start')
+
+    def status(self, name):
+        try:
+            return self._inspect(name)['State']['Status']
+        except NotFound:
+            return 'notfound'
+
+    def logs(self, name):
+        try:
+            data = self._request('GET', f'/containers/{name}/logs', params={'stdout': 1, 'stderr': 1}, raw=True)
+        except NotFound:
+            return 'notfound'
+        if self._inspect(name)['Config'].get('Tty'):
+            return data
+        # without a tty, each frame has an 8 byte header with the stream and length
+        output = []
+        offset = 0
+        while offset + 8 <= len(data):
+            start = offset + 8
+            header = data[offset:start]
+            offset = start + int.from_bytes(header[4:], 'big')
+            output.append(data[start:offset])
+        return b''.join(output)
+
+    def image_get(self, tag):
+        try:
+            return self._request('GET', f'/images/{tag}/json')['Id']
+        except NotFound:
+            return None
+
+    def image_list(self, repository):
+        images = []
+        for image in self._request('GET', '/images/json', params={'filters': {'reference': [repository]}}):
+            images.append(
+                {
+                    'id': image['Id'],
+                    'tags': [tag for tag in image.get('RepoTags') or [] if tag.rsplit(':', 1)[0] == repository],
+                    'size': image.get('Size', 0),
+                    'last_used': parse_timestamp(image.get('Created', 0)),
+                }
+            )
+        return images
+
+    def image_remove(self, tag):
+        try:
+            self._request('DELETE', f'/images/{tag}')
+        except APIError:
+            return False
+        return True
+
+    def image_prune(self):
+        result = self._request('POST', '/images/prune', params={'filters': {'dangling': ['true']}})
+        return (result or {}).get('SpaceReclaimed') or 0
+
+    def _exec_start(self, exec_id):
+        """
+        Start an exec and return the hijacked socket streaming its output.
+
+        The engine takes over the connection for the raw stream, so this uses
+        its own connection instead of one from the pool.
+        """
+        body = json.dumps({'Detach': False, 'Tty': True}).encode('utf-8')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        sock.sendall(
+            b''.join(
+                [
+                    f'POST {self._url(f"/exec/{exec_id}/start")} HTTP/1.1\r\n'.encode('utf-8'),
+                    b'Host: localhost\r\n',
+                    b'Content-Type: application/json\r\n',
+                    b'Connection: Upgrade\r\n',
+                    b'Upgrade: tcp\r\n',
+                    f'Content-Length: {len(body)}\r\n\r\n'.encode('utf-8'),
+                    body,
+                ]
+            )
+        )
+        headers = b''
+        while not headers.endswith(b'\r\n\r\n'):
+            char = sock.recv(1)
+            if not char:
+                break
+            headers += char
+        status_line = headers.split(b'\r\n', 1)[0].decode('utf-8', 'replace')
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            status = 0
+        if status not in (101, 200):
+            sock.close()
+            raise (NotFound if status == 404 else APIError)(status, f'Failed to start exec {exec_id}: {status_line}')
+        return sock
+
+    def run_command(self, container, command, user=None, echo=None):
+        stdin, echo = echo is None, echo or click.echo
+        echo(click.style(f'Run Command: {command}', fg='green'))
+        terminal = shutil.get_terminal_size()
+        exec_id = self._request(
+            'POST',
+            f'/containers/{container}/exec',
+            body={
+                'Cmd': shlex.split(command) if isinstance(command, str) else list(command),
+                'AttachStdin': True,
+                'AttachStdout': True,
+                'AttachStderr': True,
+                'Tty': True,
+                'Env': [f'COLUMNS={terminal.columns or 80}', f'LINES={terminal.lines or 24}'],
+                'User': user or '',
+            },
+        )['Id']
+
+        sock = self._exec_start(exec_id)
+        with read_from_stdin(enabled=stdin) as fd:
+            BREAK = False
+            while not BREAK:
+                reads = [sock] if fd is None else select.select([sock, fd], [], [], 0.0)[0]
+                for read in reads:
+                    if read is sock:
+                        line = sock.recv(4096)
+                        if not line:
+                            BREAK = True
+                        echo(line, nl=False)
+                    else:  # pragma: no cover
+                        sock.send(sys.stdin.read(1).encode('utf-8'))
+        sock.close()
+        return self._request('GET', f'/exec/{exec_id}/json')['ExitCode']
+
+    def build(
+        self,
+        dockerfile,
+        tag,
+        rebuild,
+        directory='.',
+        buildargs=None,
+        secrets=None,
+        stage=None,
+        cache_from=None,
+        cache_to=None,
+    ):
+        command = [
+            self.cli,
+            "build",
+            f"--file={directory}/{dockerfile}",
+            f"--tag={tag}",
+            "--rm",
+            directory,
+        ]
+        if stage is not None:
+            command.append(f"--target={stage}")
+        if buildargs is not None:
+            command.extend([f"--build-arg={key}={value}" for key, value in buildargs.items()])
+        if rebuild is True:
+            command.extend(["--no-cache", "--pull"])
+        if secrets is not None:
+            for key, value in secrets.items():
+                source = os.path.expanduser(value["source"])
+                command.append(f"--secret=id={key},src={source}")
+        for cache in [cache_from] if isinstance(cache_from, str) else cache_from or []:
+            command.append(f"--cache-from={cache}")
+        for cache in [cache_to] if isinstance(cache_to, str) else cache_to or []:
+            command.append(f"--cache-to={cache}")
+        host = f'unix://{self.socket_path}'
+        subprocess.run(command, env={**os.environ, 'DOCKER_HOST': host, 'CONTAINER_HOST': host})
+
+    def get_container_data(self, name, network, inside=False):
+        data = {}
+        try:
+            container = self._inspect(name)
+        except NotFound:
+            return None
+        if container['State']['Status'] != 'running':
+            self.start(name)
+            container = self._inspect(name)
+        data['HOST'] = container['NetworkSettings']['Networks'][network]['IPAddress'] if inside else 'localhost'
+        for port, port_data in container['NetworkSettings']['Ports'].items():
+            if inside:
+                data[f'PORT;{port}'] = port.split('/')[0]
+            elif port_data:
+                data[f'PORT;{port}'] = port_data[0]['HostPort']
+        return data
+
+    def exec(self, container, user=None, command=None):
+        cmd = [self.cli, 'exec', '-ti']
+        if user is not None:
+            cmd.extend(['-u', user])
+        cmd.append(container)
+        if command is not None:
+            cmd.extend(command)
+        else:
+            cmd.extend(['bash'])
+        os.execvp(self.cli, cmd)  # pragma: no cover
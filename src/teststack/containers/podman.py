@@ -14,45 +14,222 @@ There is an extra provided to install the ``podman`` dependency.
 .. code-block:: shell
 
     python3 -m pip install teststack[podman]
+
+Short image names like ``postgres:12`` are pulled from the registries in
+``unqualified-search-registries`` from ``registries.conf`` in order, which
+defaults to ``docker.io``, and the first registry that has the image is
+remembered in ``~/.cache/teststack/``. Like docker, the first component of a
+name is only a registry host if it has a ``.`` or a ``:`` in it, or is
+``localhost``, so ``bitnami/redis`` is qualified too.
+
+Pod mode runs the whole stack inside a single pod named after the project,
+and the prefix of the project that imported it, if any.
+Services and the tests container share the pod's network namespace, so they can
+reach each other on ``localhost``, and ``teststack stop`` removes everything
+with one pod operation. Since they share a network namespace, services in the
+same pod must listen on different ports.
+
+.. code-block:: toml
+
+    [client]
+    name = "podman"
+    pod = true
 """
 
 import json
 import os
 import platform
-import socket
 import subprocess
 
 import click
 import podman.errors
-
-
-class Client:
-    def __init__(self, machine_name=None, **kwargs):
-        if machine_name is not None:
-            kws = self._get_connection(machine_name)
-            kws.update(kwargs)
+import toml
+
+from ..reconcile import config_hash
+from ..utils import load_cache
+from ..utils import parse_timestamp
+from ..utils import save_cache
+from ..utils import session_pool_stats
+from .base import Client as BaseClient
+from .base import CONFIG_LABEL
+from .base import engine_healthcheck
+from .base import list_filters
+from .base import ListClient
+from .base import usage_size
+
+CONNECTION_CACHE = 'podman-connections.json'
+REGISTRY_CACHE = 'podman-registries.json'
+
+_resolved_images = {}
+_search_registries = []
+
+
+def _connection_configs():
+    """
+    Paths of the files podman reads system connections from, in the order it reads them.
+    """
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    paths = [
+        os.environ.get('CONTAINERS_CONF'),
+        os.path.join(config_home, 'containers', 'podman-connections.json'),
+        os.path.join(config_home, 'containers', 'containers.conf'),
+        '/etc/containers/podman-connections.json',
+        '/etc/containers/containers.conf',
+    ]
+    return [path for path in paths if path]
+
+
+class Client(ListClient):
+    thread_safe = True
+
+    def __init__(self, machine_name=None, pod=False, pool_size=None, **kwargs):
+        if pool_size is not None:
+            kwargs['max_pool_size'] = pool_size
+        self.machine_name = machine_name
+        self.pod = pod
+        self.kwargs = kwargs
+        self._client = None
+        # the pod created for each project network by ``pod_create``
+        self._pods = {}
+
+    @property
+    def client(self):
+        """
+        Connect to podman the first time the engine is actually needed.
+        """
+        if self._client is not None:
+            return self._client
+
+        kws = self._connection_kwargs()
+        if kws:
+            self._client = podman.PodmanClient(**kws)
+        else:
+            self._client = podman.from_env()
+        return self._client
+
+    def _connection_kwargs(self):
+        """
+        Get the arguments to connect to podman with, or an empty dict to use the environment.
+        """
+        if self.machine_name is not None:
+            kws = self._get_connection(self.machine_name)
+            kws.update(self.kwargs)
         elif platform.system() == 'Darwin':
             kws = self._get_connection('*')
-            kws.update(kwargs)
+            kws.update(self.kwargs)
         else:
-            kws = kwargs
-
-        if kws:
-            self.client = podman.PodmanClient(**kws)
+            kws = dict(self.kwargs)
+        return kws
+
+    def _cli_connection(self):
+        """
+        Get the podman cli options that reach the same engine as the api client.
+        """
+        kws = self._connection_kwargs()
+        options = []
+        if kws.get('base_url'):
+            # the api client takes http+unix:// and http+ssh:// urls, and http:// for tcp
+            scheme, _, address = kws['base_url'].partition('://')
+            scheme = 'tcp' if scheme == 'http' else scheme.replace('http+', '', 1)
+            options.append(f'--url={scheme}://{address}')
+        if kws.get('identity'):
+            options.append(f'--identity={kws["identity"]}')
+        return options
+
+    def pool_stats(self):
+        if self._client is None:
+            return {}
+        return session_pool_stats(self._client.api)
+
+    @staticmethod
+    def _get_search_registries(default='docker.io'):
+        """
+        Registries to qualify short image names with, read from registries.conf.
+        """
+        if _search_registries:
+            return _search_registries
+
+        paths = [
+            os.environ.get('CONTAINERS_REGISTRIES_CONF'),
+            os.path.expanduser('~/.config/containers/registries.conf'),
+            '/etc/containers/registries.conf',
+        ]
+        for path in filter(None, paths):
+            try:
+                with open(path) as fh_:
+                    config = toml.load(fh_)
+            except (OSError, toml.TomlDecodeError):
+                continue
+            registries = config.get('unqualified-search-registries')
+            if registries is None:
+                registries = config.get('registries', {}).get('search', {}).get('registries')
+            if registries:
+                _search_registries.extend(registries)
+                break
         else:
-            self.client = podman.from_env()
+            _search_registries.append(default)
+        return _search_registries
 
     def _process_image_shortname(self, name, default='docker.io'):
-        if '/' in name:
-            domain = name.split('/')[0]
+        if name in _resolved_images:
+            return _resolved_images[name]
+
+        domain, _, remainder = name.partition('/')
+        if remainder and ('.' in domain or ':' in domain or domain == 'localhost'):
+            resolved = name
+        else:
+            registry = load_cache(REGISTRY_CACHE).get(name) or self._get_search_registries(default)[0]
+            resolved = f'{registry}/{name}'
+        _resolved_images[name] = resolved
+        return resolved
+
+    def _pull(self, name, default='docker.io'):
+        """
+        Pull an image, trying each search registry in order for a short name.
+
+        The first registry that has the image is remembered for the name.
+        """
+        resolved = self._process_image_shortname(name, default)
+        if resolved == name:
+            return self.client.images.pull(name)
+
+        registry = resolved.split('/', 1)[0]
+        registries = [registry] + [other for other in self._get_search_registries(default) if other != registry]
+        for registry in registries:
             try:
-                socket.getaddrinfo(domain, 443)
-                return name
-            except socket.gaierror:
-                pass
-        return f'docker.io/{name}'
+                image = self.client.images.pull(f'{registry}/{name}')
+            except podman.errors.APIError:
+                if registry == registries[-1]:
+                    raise
+                continue
+            _resolved_images[name] = f'{registry}/{name}'
+            cache = load_cache(REGISTRY_CACHE)
+            cache[name] = registry
+            save_cache(REGISTRY_CACHE, cache)
+            return image
+
+    @staticmethod
+    def _list_connections():
+        """
+        List the podman system connections.
+
+        The output of ``podman system connection list`` is cached on disk until
+        one of the files podman stores connections in is created, modified or
+        removed. Without any of those files podman keeps the connections
+        somewhere else, so they are listed every time.
+        """
+        mtimes = {}
+        for path in _connection_configs():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+
+        cache = load_cache(CONNECTION_CACHE)
+        cached = any(mtime is not None for mtime in mtimes.values())
+        if cached and cache.get('mtimes') == mtimes:
+            return cache['connections']
 
-    def _get_connection(self, name):
         connections = subprocess.check_output(
             [
                 'podman',
@@ -62,10 +239,14 @@ class Client:
                 '--format=json',
             ]
         )
+        connections = json.loads(connections) if connections else []
+        if cached:
+            save_cache(CONNECTION_CACHE, {'mtimes': mtimes, 'connections': connections})
+        return connections
 
-        if connections:
-            connections = json.loads(connections)
-        else:
+    def _get_connection(self, name):
+        connections = self._list_connections()
+        if not connections:
             return {}
 
         for connection in connections:
@@ -76,6 +257,17 @@ class Client:
                 }
         return {}
 
+    def _list_containers(self, names=None, labels=None):
+        filters = list_filters(names, labels)
+        return [container.attrs for container in self.client.containers.list(all=True, filters=filters)]
+
+    def _list_images(self):
+        return [image.attrs for image in self.client.images.list()]
+
+    def container_data_many(self, names, network, inside=False):
+        # the libpod list does not include container addresses, so look each one up
+        return BaseClient.container_data_many(self, names, network, inside=inside)
+
     def end_container(self, name):
         try:
             container = self.client.containers.get(name)
@@ -101,6 +293,79 @@ class Client:
             return self.client.containers.get(container).image.id
         return None
 
+    def pod_create(self, name, ports=None, network=None):
+        """
+        Create the pod for a project, with every port the stack publishes.
+
+        Containers in a pod share its network namespace, so ports can only be
+        published when the pod is created. The pod is labeled with a hash of
+        its ports, and if it already exists with the same ports it is started,
+        otherwise it is recreated along with its containers. Containers that
+        ``run`` starts on ``network`` join the pod. Does nothing unless pod
+        mode is enabled.
+        """
+        if self.pod is not True:
+            return None
+        self._pods[network or name] = name
+
+        portmappings = []
+        for port, hostport in (ports or {}).items():
+            container_port, _, protocol = port.partition('/')
+            mapping = {'container_port': int(container_port), 'protocol': protocol or 'tcp'}
+            if hostport:
+                mapping['host_port'] = int(hostport)
+            portmappings.append(mapping)
+        ports_hash = config_hash(sorted(portmappings, key=lambda mapping: json.dumps(mapping, sort_keys=True)))
+
+        try:
+            pod = self.client.pods.get(name)
+        except podman.errors.NotFound:
+            pod = None
+
+        if pod is not None and (pod.attrs.get('Labels') or {}).get(CONFIG_LABEL) == ports_hash:
+            try:
+                pod.start()
+            except podman.errors.APIError:
+                pass
+            return pod.id
+        if pod is not None:
+            self.pod_remove(name)
+
+        return self.client.pods.create(name, labels={CONFIG_LABEL: ports_hash}, portmappings=portmappings).id
+
+    def pod_remove(self, name):
+        """
+        Stop and remove the pod for a project along with all of its containers.
+        """
+        if self.pod is not True:
+            return
+        try:
+            pod = self.client.pods.get(name)
+        except podman.errors.NotFound:
+            return
+        try:
+            pod.stop()
+        except podman.errors.APIError:
+            pass
+        finally:
+            pod.remove(force=True)
+
+    @staticmethod
+    def _tmpfs_mount(path, options):
+        """
+        Convert the options of a tmpfs to a mount, podman-py only passes ``size``, ``mode`` and ``ro`` on.
+        """
+        mount = {'type': 'tmpfs', 'source': 'tmpfs', 'target': path}
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            if key in ('size', 'mode') and value:
+                mount[key] = value
+            elif option == 'ro':
+                mount['read_only'] = True
+            else:
+                raise click.UsageError(f'The podman driver does not support the tmpfs option {option} for {path}')
+        return mount
+
     def run(
         self,
         name,
@@ -113,8 +378,13 @@ class Client:
         volumes=None,
         mount_cwd=False,
         network=None,
+        service='tests',
+        labels=None,
+        healthcheck=None,
+        archives=None,
+        tmpfs=None,
     ):
-        mounts = volumes or []
+        mounts = []
         if mount_cwd is True:
             mounts.append(
                 {
@@ -124,33 +394,51 @@ class Client:
                 }
             )
 
+        for path, options in (tmpfs or {}).items():
+            mounts.append(self._tmpfs_mount(path, options))
+
         if command is True:
             command = ['tail', '-f', '/dev/null']
 
         if ports:
-            for port, hostport in ports.items():
-                if not hostport:
-                    ports[port] = None
+            # a copy, since the caller's spec was already hashed
+            ports = {port: hostport or None for port, hostport in ports.items()}
 
         if not self.image_get(image):
-            self.client.images.pull(self._process_image_shortname(image))
+            self._pull(image)
+
+        kwargs = {'ports': ports or {}}
+        if self.pod is True and network is not None:
+            if network not in self._pods:
+                # started outside of ``teststack start``, which creates the pod up front
+                self.pod_create(network, ports=ports)
+            kwargs = {'pod': self._pods[network]}
+        if healthcheck:
+            kwargs['healthcheck'] = engine_healthcheck(healthcheck)
 
         container = self.client.containers.create(
             name=name,
             image=image,
             detach=True,
             stream=stream,
-            ports=ports or {},
             environment=environment or {},
             command=command,
             mounts=mounts,
+            volumes=volumes or {},
+            labels=labels or {},
+            **kwargs,
         )
+        for path, data in archives or []:
+            container.put_archive(path, data)
 
         container.start()
         container.wait(condition="running")
 
         return container.id
 
+    def events(self, filters=None, since=None, until=None):
+        return self.client.events(since=since, until=until, filters=filters, decode=True)
+
     def start(self, name):
         container = self.container_get(name)
         self.client.containers.get(container).start()
@@ -169,9 +457,79 @@ class Client:
         except podman.errors.ImageNotFound:
             return None
 
-    def run_command(self, container, command, user=None):
+    def image_list(self, repository):
+        repositories = (repository, self._process_image_shortname(repository), f'localhost/{repository}')
+        images = []
+        for image in self.client.images.list(filters={'reference': repository}):
+            images.append(
+                {
+                    'id': image.id,
+                    'tags': [tag for tag in image.tags if tag.rsplit(':', 1)[0] in repositories],
+                    'size': image.attrs.get('Size', 0),
+                    'last_used': parse_timestamp(image.attrs.get('Created', 0)),
+                }
+            )
+        return images
+
+    def image_remove(self, tag):
+        try:
+            self.client.images.remove(tag)
+        except podman.errors.APIError:
+            return False
+        return True
+
+    def image_prune(self):
+        return self.client.images.prune().get('SpaceReclaimed') or 0
+
+    def image_save(self, tag, output):
+        for chunk in self.client.images.get(self._process_image_shortname(tag)).save(named=True):
+            output.write(chunk)
+
+    def image_load(self, data):
+        list(self.client.images.load(data))
+
+    def volume_ensure(self, name, labels=None):
+        if not self.client.volumes.exists(name):
+            self.client.volumes.create(name, labels=labels or {})
+
+    def volume_list(self, label):
+        volumes = self.client.volumes.list(filters={'label': [label]})
+        if not volumes:
+            return []
+        sizes = {volume.get('VolumeName'): volume.get('Size') for volume in self.client.df().get('Volumes') or []}
+        return [{'name': volume.name, 'size': usage_size(sizes.get(volume.name))} for volume in volumes]
+
+    def volume_remove(self, name):
+        try:
+            self.client.volumes.remove(name)
+        except podman.errors.APIError:
+            return False
+        return True
+
+    def stop(self, name):
+        self.client.containers.get(name).stop()
+
+    def rename(self, name, new_name):
+        self.client.containers.get(name).rename(new_name)
+
+    def get_archive(self, name, path):
+        try:
+            data, _ = self.client.containers.get(name).get_archive(path)
+        except podman.errors.NotFound:
+            return None
+        return b''.join(data)
+
+    def put_archive(self, name, data, path=None):
+        container = self.client.containers.get(name)
+        container.put_archive(path or container.attrs['Config']['WorkingDir'] or '/', data)
+
+    def capacity(self):
+        return self.client.info()['host'].get('cpus', 1)
+
+    def run_command(self, container, command, user=None, echo=None):
         container = self.client.containers.get(container)
-        click.echo(click.style(f'Run Command: {command}', fg='green'))
+        echo = echo or click.echo
+        echo(click.style(f'Run Command: {command}', fg='green'))
         exit_code, socket = container.exec_run(
             cmd=command,
             tty=True,
@@ -180,19 +538,48 @@ class Client:
         )
 
         for line in socket.output:
-            click.echo(line, nl=False)
+            echo(line, nl=False)
         return exit_code
 
-    def build(self, dockerfile, tag, rebuild, directory='.', buildargs=None):
-        image, _ = self.client.images.build(
-            path=directory,
-            dockerfile=dockerfile,
-            tag=tag,
-            nocache=rebuild,
-            rm=True,
-            buildargs=buildargs or {},
+    def build(
+        self,
+        dockerfile,
+        tag,
+        rebuild,
+        directory='.',
+        buildargs=None,
+        secrets=None,
+        stage=None,
+        cache_from=None,
+        cache_to=None,
+    ):
+        # build on the engine the containers run on, which may not be the default connection
+        command = ['podman', *self._cli_connection()]
+        command.extend(
+            [
+                "build",
+                f"--file={directory}/{dockerfile}",
+                f"--tag={tag}",
+                "--layers",
+                "--rm",
+                directory,
+            ]
         )
-        return image.id
+        if stage is not None:
+            command.append(f"--target={stage}")
+        if buildargs is not None:
+            command.extend([f"--build-arg={key}={value}" for key, value in buildargs.items()])
+        if rebuild is True:
+            command.extend(["--no-cache", "--pull=always"])
+        if secrets is not None:
+            for key, value in secrets.items():
+                source = os.path.expanduser(value["source"])
+                command.append(f"--secret=id={key},src={source}")
+        for cache in [cache_from] if isinstance(cache_from, str) else cache_from or []:
+            command.append(f"--cache-from={cache}")
+        for cache in [cache_to] if isinstance(cache_to, str) else cache_to or []:
+            command.append(f"--cache-to={cache}")
+        subprocess.run(command)
 
     def get_container_data(self, name, network, inside=False):
         data = {}
@@ -200,8 +587,15 @@ class Client:
             container = self.client.containers.get(name)
         except podman.errors.NotFound:
             return None
-        data['HOST'] = container.attrs['NetworkSettings']['IPAddress'] if inside else 'localhost'
-        for port, port_data in container.attrs['NetworkSettings']['Ports'].items():
+        if self.pod is True and container.attrs.get('Pod'):
+            # everything in the pod shares the network namespace of its infra container
+            infra = self.client.pods.get(container.attrs['Pod']).attrs['InfraContainerID']
+            data['HOST'] = 'localhost'
+            ports = self.client.containers.get(infra).attrs['NetworkSettings']['Ports']
+        else:
+            data['HOST'] = container.attrs['NetworkSettings']['IPAddress'] if inside else 'localhost'
+            ports = container.attrs['NetworkSettings']['Ports']
+        for port, port_data in ports.items():
             if inside:
                 data[f'PORT;{port}'] = port.split('/')[0]
             elif port_data:
@@ -0,0 +1,79 @@
+"""
+Wait on container state changes through the engine event stream.
+
+Instead of polling ``status`` for every container, commands subscribe once to
+the events of the containers carrying their project label, and block until
+each container they care about reaches the state they want. Subscriptions
+replay from ``since``, so taking the timestamp before starting the containers
+means no event is missed between starting them and subscribing.
+"""
+
+import time
+
+from .containers.base import PROJECT_LABEL
+from .containers.base import SERVICE_LABEL
+
+HEALTHY = 'health_status: healthy'
+UNHEALTHY = 'health_status: unhealthy'
+
+
+def normalize(event):
+    """
+    Reduce docker and podman events to ``name``, ``id``, ``service`` and ``action``.
+
+    Docker reports health changes as the action ``health_status: healthy``,
+    while podman reports the action ``health_status`` and the state separately.
+    """
+    actor = event.get('Actor') or {}
+    attributes = actor.get('Attributes') or {}
+    action = event.get('Action') or event.get('status') or ''
+    if action == 'health_status':
+        health = event.get('HealthStatus') or attributes.get('health_status')
+        if health:
+            action = f'{action}: {health}'
+    return {
+        'name': attributes.get('name'),
+        'id': actor.get('ID') or event.get('id'),
+        'service': attributes.get(SERVICE_LABEL),
+        'action': action,
+    }
+
+
+def subscribe(client, project, actions=None, since=None, until=None):
+    """
+    Yield the normalized container events for a project.
+    """
+    filters = {'type': ['container'], 'label': [f'{PROJECT_LABEL}={project}']}
+    if actions:
+        filters['event'] = sorted({action.split(':')[0] for action in actions})
+    for event in client.events(filters=filters, since=since, until=until):
+        yield normalize(event)
+
+
+def wait_for(client, project, names, actions=('start',), failures=('die',), since=None, timeout=60):
+    """
+    Block until every container in ``names`` emits one of ``actions``.
+
+    Returns a dictionary mapping each name to the action that finished waiting
+    on it, which is one of ``failures`` if the container broke first, or
+    ``timeout`` if the stream ended before the container got there.
+    """
+    pending = set(names)
+    result = {}
+    if not pending:
+        return result
+    if since is None:
+        since = int(time.time())
+    until = int(time.time() + timeout)
+
+    for event in subscribe(client, project, actions=tuple(actions) + tuple(failures), since=since, until=until):
+        if event['name'] not in pending:
+            continue
+        if event['action'] in actions or event['action'] in failures:
+            result[event['name']] = event['action']
+            pending.discard(event['name'])
+            if not pending:
+                break
+
+    result.update({name: 'timeout' for name in pending})
+    return result
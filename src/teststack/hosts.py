@@ -0,0 +1,131 @@
+"""
+Spread test shards over several engine hosts.
+
+The shards of ``run --shards`` normally all run on the engine of the
+configured client. Other engines, like docker contexts or podman connections
+on other build machines, can be added to the pool, each as a table with the
+same settings as ``[client]``, and an optional ``capacity``.
+
+.. code-block:: toml
+
+    [tests.shards]
+    count = 12
+
+    [[tests.shards.hosts]]
+    context = "build1"
+
+    [[tests.shards.hosts]]
+    name = "podman"
+    machine_name = "build2"
+    capacity = 4
+
+Shards are placed on the hosts in proportion to their capacity, which
+defaults to the number of cpus the engine reports. Every other host that gets
+a shard runs a complete stack of its own. The images it is missing are copied
+from the local engine, and the working directory is copied into its tests
+containers, because it can not be mounted from another machine.
+"""
+
+import fnmatch
+import os
+import tarfile
+import tempfile
+
+from . import get_client
+
+IGNORE = ('.git', '.teststack')
+
+
+def _capacity(client):
+    if hasattr(client, 'capacity'):
+        return client.capacity() or 1
+    return 1
+
+
+def clients(ctx):
+    """
+    Get a ``(label, client, capacity)`` for the local engine and each configured host.
+    """
+    hosts = [('local', ctx.obj['client'], ctx.obj.get('tests.shards.capacity'))]
+    for index, config in enumerate(ctx.obj.get('tests.shards.hosts', []), 1):
+        config = dict(config)
+        capacity = config.pop('capacity', None)
+        label = config.get('context') or config.get('machine_name') or config.get('base_url') or f'host{index}'
+        hosts.append((label, get_client(config), capacity))
+    return [(label, client, capacity or _capacity(client)) for label, client, capacity in hosts]
+
+
+def place(count, capacities):
+    """
+    Get the number of shards for each host, filling the hosts in proportion to their capacity.
+
+    The first host is the local engine, which always gets the first shard,
+    since that runs in the tests container ``start`` already created.
+    """
+    counts = [0] * len(capacities)
+    if count and capacities:
+        counts[0] = 1
+    for _ in range(count - sum(counts)):
+        host = min(range(len(capacities)), key=lambda index: ((counts[index] + 1) / capacities[index], index))
+        counts[host] += 1
+    return counts
+
+
+def sync_images(source, target, tags):
+    """
+    Copy the images in ``tags`` that ``target`` is missing from ``source``.
+
+    Images that ``source`` does not have either are left for ``target`` to pull.
+    Each image is spooled through a temporary file, since it can be larger
+    than the memory available.
+    """
+    for tag in dict.fromkeys(tags):
+        if target.image_get(tag) is None and source.image_get(tag) is not None:
+            with tempfile.TemporaryFile() as archive:
+                source.image_save(tag, archive)
+                archive.seek(0)
+                target.image_load(archive)
+
+
+def ignored(path, patterns):
+    """
+    Check if a path relative to the build context is left out by any of ``patterns``.
+    """
+    return any(
+        fnmatch.fnmatch(path, pattern.rstrip('/')) or path.startswith(f'{pattern.rstrip("/")}/')
+        for pattern in patterns
+    )
+
+
+def ignore_patterns(directory='.'):
+    """
+    Get the patterns of paths to leave out of a build context, from ``.dockerignore``.
+    """
+    patterns = list(IGNORE)
+    try:
+        with open(os.path.join(directory, '.dockerignore')) as fh_:
+            patterns.extend(line.strip() for line in fh_ if line.strip() and not line.startswith(('#', '!')))
+    except FileNotFoundError:
+        pass
+    return patterns
+
+
+def context_archive(directory='.'):
+    """
+    Archive a directory to copy into a container, leaving out what ``.dockerignore`` lists.
+
+    The archive is returned as a temporary file, rewound to the start, for the
+    caller to close.
+    """
+    patterns = ignore_patterns(directory)
+    data = tempfile.TemporaryFile()
+    with tarfile.open(fileobj=data, mode='w') as archive:
+        for root, dirs, files in os.walk(directory):
+            relative = os.path.relpath(root, directory)
+            dirs[:] = [name for name in dirs if not ignored(os.path.normpath(os.path.join(relative, name)), patterns)]
+            for name in files:
+                path = os.path.normpath(os.path.join(relative, name))
+                if not ignored(path, patterns):
+                    archive.add(os.path.join(root, name), arcname=path, recursive=False)
+    data.seek(0)
+    return data
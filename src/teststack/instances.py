@@ -0,0 +1,107 @@
+"""
+Run several isolated instances of a project's stack on one host.
+
+``teststack --instance <name>`` (or ``$TESTSTACK_INSTANCE``) appends the
+instance name to the project name, so the containers, network, pod and labels
+of every instance are separate, and ``env`` resolves exports from the
+containers of that instance.
+
+Ports forwarded to a fixed host port would collide between instances, so in
+instance mode they are given a port from a pool shared by every teststack
+project on the host instead. Allocations are kept in the cache directory,
+under a lock, until the instance is stopped, so an instance keeps the same
+ports across invocations. Ports forwarded to a random host port are left to
+the engine.
+
+.. code-block:: toml
+
+    [instances]
+    ports = "20000-29999"
+"""
+
+import contextlib
+import fcntl
+import socket
+
+import click
+
+from .utils import cache_path
+from .utils import load_cache
+from .utils import save_cache
+
+CACHE = 'ports.json'
+DEFAULT_PORTS = '20000-29999'
+
+
+def project_name(name, instance=None):
+    return f'{name}-{instance}' if instance else name
+
+
+def options(ctx):
+    """
+    Get the global options that carry the instance to a nested invocation for an imported project.
+    """
+    instance = ctx.obj.get('instance')
+    return [f'--instance={instance}'] if instance else []
+
+
+@contextlib.contextmanager
+def _locked():
+    path = cache_path('ports.lock')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(('0.0.0.0', port))
+        except OSError:
+            return False
+    return True
+
+
+def allocate(owner, keys, pool=DEFAULT_PORTS):
+    """
+    Get a host port from the pool for each of ``keys``, keeping the ports ``owner`` already has.
+    """
+    low, high = (int(port) for port in pool.split('-'))
+    with _locked():
+        allocations = load_cache(CACHE)
+        owned = allocations.setdefault(owner, {})
+        used = {port for ports in allocations.values() for port in ports.values()}
+        candidates = (port for port in range(low, high + 1) if port not in used and _free(port))
+        for key in keys:
+            if key not in owned:
+                owned[key] = next(candidates, None)
+                if owned[key] is None:
+                    raise click.ClickException(f'No free ports left in {pool}')
+        save_cache(CACHE, allocations)
+    return {key: owned[key] for key in keys}
+
+
+def release(owner):
+    """
+    Return the ports of ``owner`` to the pool.
+    """
+    with _locked():
+        allocations = load_cache(CACHE)
+        if allocations.pop(owner, None) is not None:
+            save_cache(CACHE, allocations)
+
+
+def host_ports(ctx, owner, service, ports):
+    """
+    Replace the fixed host ports of a service with ports from the pool, when running as an instance.
+    """
+    ports = dict(ports)
+    if not ctx.obj.get('instance'):
+        return ports
+    keys = {port: f'{service}:{port}' for port, host in ports.items() if host}
+    allocated = allocate(owner, list(keys.values()), ctx.obj.get('instances.ports', DEFAULT_PORTS))
+    return {port: allocated[keys[port]] if port in keys else host for port, host in ports.items()}
@@ -0,0 +1,74 @@
+"""
+Give each parallel test worker its own namespace in a service.
+
+When tests run in parallel inside the tests container, every worker would
+otherwise share the same database, cache and broker. A service with an
+``isolation`` table gets ``workers`` namespaces, either made by ``setup``
+commands run in the service container, like creating a database per worker, or
+by running a replica of the service for each worker.
+
+.. code-block:: toml
+
+    [services.database.isolation]
+    workers = 4
+    setup = "createdb -U bebop bebop_{WORKER}"
+
+    [services.cache.isolation]
+    workers = 4
+    replicas = true
+
+Exports that use ``{WORKER}`` are rendered once per worker by ``env``, with a
+``_<worker>`` suffix on the variable name, and the ``HOST`` and ``PORT`` values
+of the container that serves that worker.
+"""
+
+WORKER = '{WORKER}'
+
+
+def workers(config):
+    return (config.get('isolation') or {}).get('workers', 1)
+
+
+def containers(name, config):
+    """
+    Get the name of the container that serves each worker of a service.
+    """
+    isolation = config.get('isolation') or {}
+    if isolation.get('replicas', False) is True:
+        return [name] + [f'{name}_{worker}' for worker in range(1, workers(config))]
+    return [name] * workers(config)
+
+
+def replicas(name, config):
+    """
+    Get the names of the containers a service runs besides its main one.
+    """
+    return [container for container in containers(name, config) if container != name]
+
+
+def setup(client, name, config, created):
+    """
+    Run the setup commands for the workers whose container was just created.
+
+    Returns the sum of the exit codes.
+    """
+    commands = (config.get('isolation') or {}).get('setup', [])
+    if isinstance(commands, str):
+        commands = [commands]
+    exit_code = 0
+    for worker, container in enumerate(containers(name, config)):
+        if container not in created:
+            continue
+        for command in commands:
+            exit_code += client.run_command(container, command.replace(WORKER, str(worker)))
+    return exit_code
+
+
+def render(key, value, values, no_export=False):
+    """
+    Render an export once for each worker, from the format values of each worker's container.
+    """
+    return [
+        f'{"" if no_export else "export "}{key}_{worker}={value}'.format_map({**data, 'WORKER': worker})
+        for worker, data in enumerate(values)
+    ]
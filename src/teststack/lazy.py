@@ -0,0 +1,278 @@
+"""
+Start services only when something connects to them.
+
+A service with ``lazy`` set is not started by ``start``. Instead a small TCP
+proxy runs in the background, listening on a host port for each of the ports
+the service forwards, and the exports of the service point at the proxy. The
+first connection starts the container, and waits until it is healthy and its
+ports accept connections, before the traffic is passed through. The container
+is stopped again after it has had no connections for ``idle`` seconds.
+
+.. code-block:: toml
+
+    [services.search]
+    image = "elasticsearch:7.17.0"
+    lazy = true
+
+    [services.search.ports]
+    "9200/tcp" = ""
+
+    [services.queue]
+    image = "rabbitmq:3"
+    lazy = {idle = 600}
+
+The proxy ports come from the same pool as the ports of instances, and the
+tests container reaches them through the gateway of the project network. The
+proxy only listens on ``127.0.0.1`` and that gateway, so the services are not
+reachable, or started, from other machines. The state of each proxy is kept
+in ``.teststack/lazy/<container>.json`` until ``stop``.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import pathlib
+import signal
+import socket
+import time
+
+from . import instances
+from .utils import spawn
+
+LAZY = pathlib.Path('.teststack/lazy')
+IDLE = 300
+HOST_ALIAS = 'host.docker.internal'
+
+
+def enabled(config):
+    return bool(config.get('lazy'))
+
+
+def idle(config):
+    lazy = config.get('lazy')
+    return lazy.get('idle', IDLE) if isinstance(lazy, dict) else IDLE
+
+
+def eager(services):
+    """
+    Get a copy of the services config where no service is lazy.
+    """
+    return {name: {key: value for key, value in data.items() if key != 'lazy'} for name, data in services.items()}
+
+
+def _state(name):
+    return LAZY / f'{name}.json'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def read(name):
+    """
+    Get the state of the proxy for a container, or None if it is not running.
+    """
+    try:
+        state = json.loads(_state(name).read_text())
+    except (OSError, ValueError):
+        return None
+    return state if _alive(state.get('pid')) else None
+
+
+def ports(ctx, name, config):
+    """
+    Get the port the proxy listens on for each tcp port of a service, kept the same until ``stop``.
+    """
+    keys = [port for port in config.get('ports', {}) if not port.endswith('/udp')]
+    return instances.allocate(f'lazy:{name}', keys, ctx.obj.get('instances.ports', instances.DEFAULT_PORTS))
+
+
+def ensure(ctx, name, service, config, prefix=''):
+    """
+    Start the proxy for a lazy service in the background, unless it is already running.
+    """
+    if read(name) is not None:
+        return
+    allocated = ports(ctx, name, config)
+    process = spawn(ctx, 'proxy', f'--prefix={prefix}', service)
+    path = _state(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'ports': allocated, 'pid': process.pid}))
+    try:
+        wait_ready([('localhost', port) for port in allocated.values()], timeout=10)
+    except OSError:
+        # connections are refused until the proxy listens, the service still starts on the next one
+        pass
+
+
+def stop(name):
+    """
+    Stop the proxy for a container, and return its ports to the pool.
+    """
+    state = read(name)
+    if state is not None:
+        os.kill(state['pid'], signal.SIGTERM)
+    _state(name).unlink(missing_ok=True)
+    instances.release(f'lazy:{name}')
+
+
+def container_data(client, name, network, inside=False):
+    """
+    Get the ``HOST`` and ``PORT;<port>`` values of the proxy for a container, like ``get_container_data``.
+    """
+    state = read(name)
+    if state is None:
+        return None
+    host = 'localhost'
+    if inside:
+        if hasattr(client, 'network_ensure'):
+            client.network_ensure(network)
+        host = (client.network_gateway(network) if hasattr(client, 'network_gateway') else None) or HOST_ALIAS
+    return {'HOST': host, **{f'PORT;{port}': str(listen) for port, listen in state['ports'].items()}}
+
+
+def listen_hosts(client, network):
+    """
+    Get the addresses for a proxy to listen on: the loopback, and the gateway the tests container reaches it on.
+    """
+    hosts = ['127.0.0.1']
+    if hasattr(client, 'network_gateway'):
+        if hasattr(client, 'network_ensure'):
+            client.network_ensure(network)
+        gateway = client.network_gateway(network)
+        if gateway:
+            hosts.append(gateway)
+    return hosts
+
+
+def targets(client, name, network, ports):
+    """
+    Get the ``(host, port)`` to reach each of ``ports`` of a running container on, from the host.
+
+    Ports forwarded to the host are used, and the address of the container on
+    the project network otherwise.
+    """
+    outside = client.get_container_data(name, network=network) or {}
+    inside = client.get_container_data(name, network=network, inside=True) or {}
+    return {
+        port: (
+            ('localhost', int(outside[f'PORT;{port}']))
+            if outside.get(f'PORT;{port}')
+            else (inside['HOST'], int(port.split('/')[0]))
+        )
+        for port in ports
+    }
+
+
+async def _pipe(reader, writer, touch):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            touch()
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+class Proxy:
+    """
+    Pass connections on ``ports``, a dictionary of container port to the port to listen on, through to a service.
+
+    ``wake`` starts the service and returns the ``(host, port)`` to connect to
+    for each container port, and ``sleep`` stops it after ``idle`` seconds
+    without connections. Both are blocking, and run in a thread.
+    """
+
+    def __init__(self, ports, wake, sleep, idle=IDLE):
+        self.ports = ports
+        self.wake = wake
+        self.sleep = sleep
+        self.idle = idle
+        self.targets = None
+        self.connections = 0
+        self.last = time.monotonic()
+        self.lock = None
+
+    def _touch(self):
+        self.last = time.monotonic()
+
+    async def _targets(self):
+        async with self.lock:
+            if self.targets is None:
+                self.targets = await asyncio.get_running_loop().run_in_executor(None, self.wake)
+            return self.targets
+
+    async def _handle(self, port, reader, writer):
+        self.connections += 1
+        try:
+            host, target = (await self._targets())[port]
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, target)
+        except Exception:
+            writer.close()
+            self.connections -= 1
+            return
+        try:
+            await asyncio.gather(
+                _pipe(reader, upstream_writer, self._touch),
+                _pipe(upstream_reader, writer, self._touch),
+            )
+        finally:
+            self.connections -= 1
+            self._touch()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(self.idle, 5))
+            if self.targets is None or self.connections or time.monotonic() - self.last < self.idle:
+                continue
+            async with self.lock:
+                await asyncio.get_running_loop().run_in_executor(None, self.sleep)
+                self.targets = None
+
+    async def serve(self, hosts=('127.0.0.1',)):
+        """
+        Listen on each of ``hosts`` until cancelled.
+
+        Only the first host is required, the others are skipped if they are not
+        addresses of this machine, like the gateway of a network inside a vm.
+        """
+        self.lock = asyncio.Lock()
+        servers = []
+        for index, host in enumerate(hosts):
+            try:
+                for port, listen in self.ports.items():
+                    servers.append(await asyncio.start_server(functools.partial(self._handle, port), host, listen))
+            except OSError:
+                if index == 0:
+                    raise
+        try:
+            await self._reap()
+        finally:
+            for server in servers:
+                server.close()
+
+
+def wait_ready(targets, timeout=60):
+    """
+    Wait until every ``(host, port)`` in ``targets`` accepts connections.
+    """
+    deadline = time.monotonic() + timeout
+    for host, port in targets:
+        while True:
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
@@ -0,0 +1,123 @@
+"""
+Reconcile the containers of a project with its config.
+
+The desired state is the set of ``run`` arguments for every container, each
+labeled with a hash of the settings it is created from. :func:`plan` compares
+that with one bulk snapshot of the containers that exist, and decides the
+smallest change for each container.
+
+create
+    the container does not exist
+
+recreate
+    the container was created from different settings, or another image
+
+start
+    the container is up to date, but not running
+
+keep
+    the container is up to date and running, and costs nothing more
+
+:func:`apply` then makes all of the changes concurrently. Containers created
+before teststack labeled them with a config hash are only compared by image.
+"""
+
+import asyncio
+import hashlib
+import json
+
+from .containers.aio import run_async
+from .containers.base import CONFIG_LABEL
+from .containers.base import PROJECT_LABEL
+from .containers.base import SERVICE_LABEL
+
+CREATE = 'create'
+RECREATE = 'recreate'
+START = 'start'
+KEEP = 'keep'
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def label(spec, project, service, **overrides):
+    """
+    Label a set of ``run`` arguments with the project, service and config hash.
+
+    ``overrides`` replace values in what is hashed without changing what is
+    run, for values like a commit specific image tag that should not on their
+    own cause a container to be recreated.
+    """
+    config = {key: value for key, value in {**spec, **overrides}.items() if key != 'labels'}
+    spec['labels'] = {
+        PROJECT_LABEL: project,
+        SERVICE_LABEL: service,
+        CONFIG_LABEL: config_hash(config),
+    }
+    return spec
+
+
+def plan(client, specs, images=None):
+    """
+    Decide what to do with each container in ``specs``, a dictionary of name to ``run`` arguments.
+
+    ``images`` maps names to the image id the container should be running,
+    when it is known.
+    """
+    images = images or {}
+    found = client.inspect_many(list(specs))
+    changes = []
+    for name, spec in specs.items():
+        actual = found[name]
+        if actual is None:
+            action, reason = CREATE, 'missing'
+        elif (actual.get('labels') or {}).get(CONFIG_LABEL, spec['labels'][CONFIG_LABEL]) != spec['labels'][
+            CONFIG_LABEL
+        ]:
+            action, reason = RECREATE, 'config changed'
+        elif images.get(name) and actual.get('image') and images[name] != actual['image']:
+            action, reason = RECREATE, 'image changed'
+        elif actual.get('status') != 'running':
+            action, reason = START, actual.get('status')
+        else:
+            action, reason = KEEP, 'up to date'
+        changes.append(
+            {
+                'name': name,
+                'service': spec['labels'][SERVICE_LABEL],
+                'action': action,
+                'reason': reason,
+                'id': None if actual is None else actual['id'],
+                'spec': spec,
+            }
+        )
+    return changes
+
+
+async def _apply_change(aio, change):
+    if change['action'] == RECREATE:
+        await aio.end_container(change['name'])
+    if change['action'] in (CREATE, RECREATE):
+        change['id'] = await aio.run(**change['spec'])
+    elif change['action'] == START:
+        await aio.start(change['name'])
+
+
+def apply(client, changes):
+    """
+    Make every change in a plan concurrently, and return the plan with the ids of new containers.
+    """
+    pending = [change for change in changes if change['action'] != KEEP]
+    if not pending:
+        return changes
+    if hasattr(client, 'network_ensure'):
+        # create shared networks up front, instead of racing to create them from each container
+        for network in {change['spec'].get('network') for change in pending} - {None}:
+            client.network_ensure(network)
+
+    async def _apply(aio):
+        await asyncio.gather(*(_apply_change(aio, change) for change in pending))
+
+    run_async(client, _apply)
+    return changes
@@ -0,0 +1,49 @@
+"""
+Select the services that a command works on.
+
+Steps declare the services they need, so that ``run`` only starts and exports
+the environment of those, and quick steps like unit tests skip booting the
+rest. Steps that do not declare any need ``all`` of them.
+
+.. code-block:: toml
+
+    [tests.steps.unit]
+    command = "pytest tests/unit"
+    services = []
+
+    [tests.steps.integration]
+    command = "pytest tests/integration"
+    services = ["database", "cache"]
+"""
+
+import click
+
+ALL = 'all'
+
+
+def select(ctx, names=(ALL,)):
+    """
+    Get the config of the services in ``names``, or of every service if it includes ``all``.
+    """
+    services = ctx.obj.get('services')
+    if ALL in names:
+        return services
+    unknown = set(names) - set(services)
+    if unknown:
+        raise click.UsageError(f'Unknown services: {", ".join(sorted(unknown))}')
+    return {name: data for name, data in services.items() if name in names}
+
+
+def needed(steps):
+    """
+    Get the services that any of ``steps`` need.
+    """
+    names = set()
+    for command in steps.values():
+        services = command.get('services', ALL) if isinstance(command, dict) else ALL
+        if isinstance(services, str):
+            services = [services]
+        if ALL in services:
+            return (ALL,)
+        names.update(services)
+    return tuple(sorted(names))
@@ -0,0 +1,92 @@
+"""
+Split test files across tests containers, balanced by how long they took before.
+
+Timings are kept in ``.teststack/shards.json``, as the estimated seconds for
+each test file. A shard only measures how long all of its files took, so after
+every run that time is divided between the files in proportion to their old
+estimates. Files without an estimate are assumed to take the average.
+"""
+
+import json
+import pathlib
+import threading
+
+import click
+
+TIMINGS = pathlib.Path('.teststack/shards.json')
+
+
+def load_timings(path=None):
+    try:
+        with (path or TIMINGS).open('r') as fh_:
+            return json.load(fh_)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_timings(timings, path=None):
+    path = path or TIMINGS
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w') as fh_:
+        json.dump(timings, fh_, indent=2, sort_keys=True)
+
+
+def _estimates(items, timings):
+    known = [timings[item] for item in items if item in timings]
+    default = sum(known) / len(known) if known else 1.0
+    return {item: timings.get(item, default) for item in items}
+
+
+def split(items, shards, timings=None):
+    """
+    Assign ``items`` to ``shards`` lists, longest first to the least loaded shard.
+    """
+    estimates = _estimates(items, timings or {})
+    result = [[] for _ in range(shards)]
+    loads = [0.0] * shards
+    for item in sorted(items, key=lambda item: (-estimates[item], item)):
+        shard = loads.index(min(loads))
+        result[shard].append(item)
+        loads[shard] += estimates[item]
+    return result
+
+
+def update_timings(timings, assignments, durations):
+    """
+    Spread the duration of each shard over its items, and return the new timings.
+    """
+    timings = dict(timings)
+    for items, duration in zip(assignments, durations):
+        estimates = _estimates(items, timings)
+        total = sum(estimates.values())
+        for item in items:
+            timings[item] = round(duration * estimates[item] / total, 3)
+    return timings
+
+
+class PrefixedEcho:
+    """
+    An ``echo`` for ``run_command`` that writes whole lines with a prefix.
+
+    Output arrives in arbitrary chunks, so partial lines are held until they
+    are finished, and lines from shards running at once are not interleaved.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.buffer = ''
+
+    def __call__(self, message='', nl=True):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        self.buffer += message.replace('\r\n', '\n') + ('\n' if nl else '')
+        *lines, self.buffer = self.buffer.split('\n')
+        with self.lock:
+            for line in lines:
+                click.echo(f'{self.prefix}{line}')
+
+    def flush(self):
+        if self.buffer:
+            self('', nl=True)
@@ -0,0 +1,55 @@
+"""
+Save the data of service containers, to restore them to that state quickly.
+
+A service lists the directories that hold its data, and ``teststack snapshot``
+saves a tar archive of each of them, with the container stopped so the data is
+consistent. ``teststack reset`` recreates the container, and extracts the
+archives into it before it starts, so a database comes back seeded without
+running migrations again.
+
+.. code-block:: toml
+
+    [services.database]
+    image = "postgres:12"
+    snapshot = ["/var/lib/postgresql/data"]
+
+Snapshots are kept in ``.teststack/snapshots/<container>/<name>/``.
+"""
+
+import pathlib
+
+SNAPSHOTS = pathlib.Path('.teststack/snapshots')
+
+
+def _archive(container, name, path):
+    return SNAPSHOTS / container / name / f'{path.strip("/").replace("/", "_")}.tar'
+
+
+def save(client, container, name, paths):
+    """
+    Save an archive of each of ``paths`` in a container, and return the paths that do not exist.
+    """
+    missing = []
+    for path in paths:
+        data = client.get_archive(container, path)
+        if data is None:
+            missing.append(path)
+            continue
+        archive = _archive(container, name, path)
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        archive.write_bytes(data)
+    return missing
+
+
+def load(container, name, paths):
+    """
+    Get the ``archives`` to pass to ``run`` to restore a snapshot, or None if it was never taken.
+    """
+    archives = []
+    for path in paths:
+        archive = _archive(container, name, path)
+        if not archive.exists():
+            return None
+        # the archive holds the directory itself, so it is extracted into its parent
+        archives.append((str(pathlib.PurePosixPath(path).parent), archive.read_bytes()))
+    return archives
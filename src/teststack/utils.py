@@ -1,11 +1,20 @@
+import datetime
+import json
+import os
+import pathlib
+import re
+import subprocess
 import sys
 import termios
 import tty
 
 
 class read_from_stdin:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
     def __enter__(self):
-        if sys.stdin.isatty():  # pragma: no cover
+        if self.enabled and sys.stdin.isatty():  # pragma: no cover
             fd = sys.stdin.fileno()
             self.orig_fl = termios.tcgetattr(fd)
             tty.setcbreak(fd)  # use tty.setraw() instead to catch ^C also
@@ -22,3 +31,129 @@ class read_from_stdin:
     def __exit__(self, exc_type, exc_val, traceback):
         if getattr(self, 'orig_fl', None) is not None:  # pragma: no cover
             termios.tcsetattr(sys.stdin.fileno(), termios.TCSANOW, self.orig_fl)
+
+
+ROOT_OPTIONS = ('config', 'local_config', 'project_name', 'instance')
+
+
+def spawn(ctx, *args):
+    """
+    Run a teststack command for the current project in the background, detached from this process.
+    """
+    params = ctx.find_root().params
+    options = [f'--{key.replace("_", "-")}={params[key]}' for key in ROOT_OPTIONS if params.get(key) is not None]
+    return subprocess.Popen(
+        [sys.executable, '-m', 'teststack', f'--path={os.getcwd()}', *options, *args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def cache_path(name):
+    """
+    Path to a file in the per user teststack cache directory.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return pathlib.Path(base) / 'teststack' / name
+
+
+def load_cache(name):
+    """
+    Load a json cache file, returning an empty dict if it is missing or corrupt.
+    """
+    try:
+        with cache_path(name).open('r') as fh_:
+            return json.load(fh_)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(name, data):
+    """
+    Write a json cache file. Failures are ignored since the cache is only an optimization.
+    """
+    path = cache_path(name)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}')
+        with tmp.open('w') as fh_:
+            json.dump(data, fh_)
+        tmp.replace(path)
+    except OSError:
+        pass
+
+
+def parse_timestamp(value):
+    """
+    Convert a timestamp returned by the container engine to seconds since the epoch.
+
+    Docker returns RFC 3339 strings with nanosecond precision, podman returns
+    integers.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.match(
+        r'(?P<time>\d+-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(?P<fraction>\d+))?(?P<zone>Z|[+-]\d{2}:\d{2})?$',
+        value,
+    )
+    if match is None:
+        return 0.0
+    timestamp = datetime.datetime.fromisoformat(match['time'])
+    if match['fraction']:
+        timestamp = timestamp.replace(microsecond=int(match['fraction'][:6].ljust(6, '0')))
+    offset = datetime.timedelta()
+    if match['zone'] not in (None, 'Z'):
+        hours, minutes = match['zone'][1:].split(':')
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        if match['zone'].startswith('-'):
+            offset = -offset
+    timestamp = timestamp.replace(tzinfo=datetime.timezone(offset))
+    try:
+        return timestamp.timestamp()
+    except (OverflowError, ValueError):
+        return 0.0
+
+
+def human_size(size):
+    """
+    Format a number of bytes for humans.
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f'{size:.1f}{unit}' if unit != 'B' else f'{size}{unit}'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+
+def parse_size(size):
+    """
+    Parse a number of bytes with an optional unit, like ``512m`` or ``10G``.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def session_pool_stats(session):
+    """
+    Connection pool statistics for a requests session, like the ones the docker and podman sdks use.
+    """
+    stats = {'pools': 0, 'connections': 0, 'requests': 0}
+    for adapter in session.adapters.values():
+        pools = getattr(adapter, 'pools', None)
+        if pools is None:
+            pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools[key]
+            stats['pools'] += 1
+            stats['connections'] += getattr(pool, 'num_connections', 0)
+            stats['requests'] += getattr(pool, 'num_requests', 0)
+    return stats
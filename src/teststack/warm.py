@@ -0,0 +1,93 @@
+"""
+Keep a pool of tests containers created ahead of time.
+
+A ``start`` that has to recreate the tests container, after a build or a
+config change, waits for the engine to create it. With a warm pool, ``teststack
+warm`` creates the next tests containers in the background, with their
+environment, mounts and network ready, and ``start`` renames one of them into
+place instead of creating its own.
+
+.. code-block:: toml
+
+    [tests.warm]
+    size = 1
+
+Each tests container, and each shard for ``tests.shards.count``, gets ``size``
+warm containers named ``<name>_warm_<n>`` for each set of services it can be
+started with. They are labeled with the config
+hash of the container they stand in for, so a warm container is only used if
+it is running and was created from the same settings and image. The pool is
+refilled in the background after the tests image is built, and after a warm
+container is used.
+"""
+
+import contextlib
+import fcntl
+
+from .containers.base import CONFIG_LABEL
+from .containers.base import WARM_LABEL
+from .utils import cache_path
+from .utils import spawn
+
+
+def size(ctx):
+    return ctx.obj.get('tests.warm.size', 1) if ctx.obj.get('tests.warm') is not None else 0
+
+
+def name(target, index):
+    return f'{target}_warm_{index}'
+
+
+def specs(spec, count, first=0):
+    """
+    Get the ``run`` arguments for the warm containers that stand in for the container in ``spec``.
+
+    They are numbered from ``first + 1``, so the pools for different services of the same container don't collide.
+    """
+    warm = {}
+    for index in range(first + 1, first + count + 1):
+        warm_spec = dict(spec, name=name(spec['name'], index))
+        warm_spec['labels'] = {**spec['labels'], WARM_LABEL: spec['name']}
+        warm[warm_spec['name']] = warm_spec
+    return warm
+
+
+def find(client, names, spec, image):
+    """
+    Get the name and id of the first of ``names`` that is running, and was created from the same settings and
+    image as ``spec``.
+    """
+    for warm_name, found in client.inspect_many(names).items():
+        if found is None or found.get('status') != 'running':
+            continue
+        if (found.get('labels') or {}).get(CONFIG_LABEL) != spec['labels'][CONFIG_LABEL]:
+            continue
+        if image and found.get('image') and found['image'] != image:
+            continue
+        return warm_name, found['id']
+
+
+@contextlib.contextmanager
+def locked(project):
+    """
+    Hold the lock for filling the pool of a project, yielding False if another process already holds it.
+    """
+    path = cache_path(f'warm-{project}.lock')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def refill(ctx):
+    """
+    Run ``teststack warm`` for this project in the background.
+    """
+    spawn(ctx, 'warm')
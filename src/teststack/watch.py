@@ -0,0 +1,228 @@
+"""
+Watch the working directory, and rerun the steps that the changes affect.
+
+Each step lists the files it depends on in ``watch``, and ``teststack watch``
+reruns only the steps with a pattern that matches a changed file. Patterns are
+relative to the project directory, and ``**/`` matches any number of
+directories.
+
+.. code-block:: toml
+
+    [tests.steps.lint]
+    command = "flake8"
+    watch = ["**/*.py", "setup.cfg"]
+
+    [tests.steps.tests]
+    command = "pytest {posargs}"
+    requires = ["install"]
+    watch = ["src/**/*.py", "tests/**/*.py"]
+
+Changes are read from inotify on linux, and found by scanning the directory
+every second otherwise. Paths that ``.dockerignore`` leaves out of the build
+context, and ``.git`` and ``.teststack``, are not watched. Changes are
+collected until none have come in for ``debounce`` seconds, so saving many
+files at once runs the steps once.
+
+.. code-block:: toml
+
+    [tests.watch]
+    debounce = 0.2
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import time
+
+from .hosts import ignore_patterns
+from .hosts import ignored
+
+DEBOUNCE = 0.2
+INTERVAL = 1.0
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')
+
+
+def _matches(path, pattern):
+    return fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path, pattern.replace('**/', ''))
+
+
+def affected(paths, patterns):
+    """
+    Check if any of ``paths`` matches any of ``patterns``.
+    """
+    return any(_matches(path, pattern) for path in paths for pattern in patterns)
+
+
+def steps(config, names=()):
+    """
+    Get the patterns that each watched step reruns on, from the ``tests.steps`` config.
+
+    Without ``names``, the steps with ``watch`` patterns are watched, or every
+    step if none have them. Steps without patterns rerun on any change.
+    """
+    patterns = {name: (step.get('watch', ['*']) if isinstance(step, dict) else ['*']) for name, step in config.items()}
+    if names:
+        return {name: patterns[name] for name in names}
+    watched = {
+        name: pattern
+        for name, pattern in patterns.items()
+        if isinstance(config[name], dict) and 'watch' in config[name]
+    }
+    return watched or patterns
+
+
+def _walk(directory, patterns):
+    for root, dirs, files in os.walk(directory):
+        relative = os.path.relpath(root, directory)
+        dirs[:] = [name for name in dirs if not ignored(os.path.normpath(os.path.join(relative, name)), patterns)]
+        yield relative, files
+
+
+class Poller:
+    """
+    Find changes by comparing the size and modification time of every file, every ``interval`` seconds.
+    """
+
+    def __init__(self, directory, patterns, interval=INTERVAL):
+        self.directory = directory
+        self.patterns = patterns
+        self.interval = interval
+        self.files = self._scan()
+
+    def _scan(self):
+        files = {}
+        for relative, names in _walk(self.directory, self.patterns):
+            for name in names:
+                path = os.path.normpath(os.path.join(relative, name))
+                if ignored(path, self.patterns):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, path))
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def wait(self, timeout=None):
+        """
+        Get the paths that changed, waiting up to ``timeout`` seconds for any, or forever if it is None.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            files = self._scan()
+            changed = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+            self.files = files
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+
+class Inotify:
+    """
+    Read changes from inotify, with a watch on every directory that is not ignored.
+    """
+
+    def __init__(self, directory, patterns):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.directory = directory
+        self.patterns = patterns
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        for relative, _ in _walk(directory, patterns):
+            self._add(relative)
+
+    def _add(self, relative):
+        path = os.path.join(self.directory, relative)
+        descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(path), MASK)
+        if descriptor >= 0:
+            self.watches[descriptor] = relative
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT.unpack_from(data, offset)
+            start, offset = offset + EVENT.size, offset + EVENT.size + length
+            name = data[start:offset].rstrip(b'\0')
+            if descriptor not in self.watches or not name:
+                continue
+            path = os.path.normpath(os.path.join(self.watches[descriptor], os.fsdecode(name)))
+            if ignored(path, self.patterns):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for relative, _ in _walk(os.path.join(self.directory, path), self.patterns):
+                        self._add(os.path.normpath(os.path.join(path, relative)))
+                continue
+            changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Get the paths that changed, waiting up to ``timeout`` seconds for any, or forever if it is None.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+            changed = self._read()
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watcher(directory='.', patterns=None):
+    """
+    Get an inotify watcher for ``directory``, or a poller where inotify is not available.
+    """
+    if patterns is None:
+        patterns = ignore_patterns(directory)
+    try:
+        return Inotify(directory, patterns)
+    except (AttributeError, OSError, TypeError):
+        return Poller(directory, patterns)
+
+
+def changes(directory='.', debounce=DEBOUNCE):
+    """
+    Yield the sorted paths that changed each time changes stop coming in for ``debounce`` seconds.
+    """
+    watch = watcher(directory)
+    try:
+        while True:
+            changed = watch.wait()
+            while True:
+                more = watch.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            yield sorted(changed)
+    finally:
+        watch.close()
@@ -0,0 +1,87 @@
+"""
+Forward ``teststack`` calls to a running ``teststack agent``.
+
+This is the ``teststack`` console script. It lives outside of the
+``teststack`` package, and only imports the standard library, so that handing
+a command to the agent does not first import click, toml, GitPython and the
+rest of what ``teststack/__init__.py`` loads. Without an agent, it runs the
+command locally with :func:`teststack.main`.
+"""
+
+import json
+import os
+import pathlib
+import socket
+import sys
+
+SOCKET = pathlib.Path('.teststack/agent.sock')
+
+
+def _connect():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(SOCKET))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def running():
+    sock = _connect()
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def forward(args):
+    """
+    Run a command through the agent for the current directory, and return its exit code.
+
+    Returns None if no agent is running, or the command has to run locally,
+    which only the agent can tell, since it knows which arguments are commands.
+    """
+    if not SOCKET.exists():
+        return None
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile('rwb') as stream:
+        # the agent started somewhere else, so the directory is passed on explicitly
+        request = {'args': [f'--path={os.getcwd()}', *args], 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if 'local' in message:
+                return None
+            if 'exit' in message:
+                return message['exit']
+            output = sys.stderr if 'stderr' in message else sys.stdout
+            output.write(message.get('stdout', message.get('stderr', '')))
+            output.flush()
+    return 1
+
+
+def stop():
+    """
+    Stop the agent for the current directory, returning False if none is running.
+    """
+    sock = _connect()
+    if sock is None:
+        return False
+    with sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps({'stop': True}).encode('utf-8') + b'\n')
+        stream.flush()
+        stream.readline()
+    return True
+
+
+def main():  # pragma: no cover
+    exit_code = forward(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+    from teststack import main
+
+    main()
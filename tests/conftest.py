@@ -1,5 +1,9 @@
+import http.server
 import json
 import pathlib
+import socketserver
+import threading
+import time
 from unittest.mock import patch
 
 import click.testing
@@ -92,3 +96,42 @@ def test_no_leftover_docker_containers(docker):
     assert not any(
         container.name.startswith('teststack') for container in docker.containers.list()
     ), '`teststack` containers were left behind, please clean them up in this test'
+
+
+class _EngineHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # slow enough that concurrent requests overlap
+        time.sleep(0.01)
+        if self.path == '/version':
+            body = json.dumps({'ApiVersion': '1.43'}).encode('utf-8')
+        else:
+            body = json.dumps({'Id': self.path.split('/')[3]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return 'engine'
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def engine_url(tmp_path):
+    """
+    Serve a minimal engine api on a unix socket, answering every GET with the Id from the path, and api version 1.43.
+    """
+    path = str(tmp_path / 'engine.sock')
+    server = socketserver.ThreadingUnixStreamServer(path, _EngineHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'unix://{path}'
+    finally:
+        server.shutdown()
+        server.server_close()
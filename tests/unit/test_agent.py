@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import pytest
+import teststack_agent
+from teststack import agent
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_forward_without_agent(workdir):
+    assert teststack_agent.forward(['env']) is None
+    assert teststack_agent.stop() is False
+
+    teststack_agent.SOCKET.parent.mkdir()
+    teststack_agent.SOCKET.touch()
+    assert teststack_agent.forward(['env']) is None
+
+
+def test_commands(runner):
+    assert agent.commands(['--path=/srv', 'start', 'exec']) == ['start', 'exec']
+    assert agent.commands(['run', '--step', 'watch', '--', 'tests/proxy']) == ['run']
+    assert agent.commands(['unknown']) == []
+
+
+def test_config_cache(workdir):
+    path = workdir / 'teststack.toml'
+    path.write_text('[tests]\nmount = false\n')
+    server = agent.Agent()
+
+    config = server.config(path)
+    config['tests']['mount'] = True
+    assert server.config(path) == {'tests': {'mount': False}}
+
+    path.write_text('[tests]\nmount = true\n')
+    os.utime(path, ns=(0, 10**9))
+    assert server.config(path) == {'tests': {'mount': True}}
+    assert server.config(workdir / 'teststack.local.toml') is None
+
+
+def test_agent_forwards_commands(workdir, capsys):
+    (workdir / 'teststack.toml').write_text('[tests.environment]\nGREETING = "hello"\n')
+    process = subprocess.Popen([sys.executable, '-m', 'teststack', 'agent'])
+    try:
+        deadline = time.monotonic() + 30
+        while not teststack_agent.running():
+            assert time.monotonic() < deadline
+            assert process.poll() is None
+            time.sleep(0.1)
+
+        assert teststack_agent.forward(['env']) == 0
+        assert capsys.readouterr().out == 'export GREETING=hello\n'
+        assert teststack_agent.forward(['start', '--service=missing']) == 2
+        assert 'Unknown services: missing' in capsys.readouterr().err
+        assert teststack_agent.forward(['exec']) is None
+
+        script = (
+            'import sys, teststack_agent;'
+            'code = teststack_agent.forward(["env"]);'
+            'print(code, sorted({"click", "git", "teststack", "toml"} & set(sys.modules)))'
+        )
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        assert output.splitlines()[-1] == '0 []'
+
+        assert teststack_agent.stop() is True
+        assert process.wait(timeout=10) == 0
+        assert not teststack_agent.SOCKET.exists()
+    finally:
+        process.kill()
+
+
+def test_agent_reuses_clients(workdir, runner, client):
+    import teststack
+
+    (workdir / 'teststack.toml').write_text('[tests.environment]\nGREETING = "hello"\n')
+    server = agent.Agent()
+    teststack._agent = server
+    try:
+        with mock.patch.object(agent.Agent, '_clear_on_events') as clear_on_events:
+            for _ in range(3):
+                request = {'args': [f'--path={workdir}', 'env'], 'cwd': str(workdir), 'env': dict(os.environ)}
+                assert server._run(request, lambda message: None) == 0
+        assert len(teststack._clients) == 1
+        assert clear_on_events.call_count == 1
+        assert len(server.watched) == 1
+    finally:
+        teststack._agent = None
+        teststack._clients.clear()
@@ -0,0 +1,51 @@
+import threading
+import time
+from unittest import mock
+
+from teststack.containers import aio
+from teststack.containers import engine
+
+
+class NativeClient(aio.AsyncClient):
+    async def start(self, name):
+        return f'started {name}'
+
+
+def test_threaded_async_client_gather():
+    client = mock.MagicMock()
+    client.end_container.side_effect = lambda name: name
+    assert aio.gather(client, 'end_container', ('one',), ('two',)) == ['one', 'two']
+    assert client.end_container.call_count == 2
+
+
+def test_threaded_async_client_serializes_unsafe_clients():
+    running = []
+    overlapped = threading.Event()
+
+    class UnsafeClient:
+        def end_container(self, name):
+            running.append(name)
+            if len(running) > 1:
+                overlapped.set()
+            time.sleep(0.01)
+            running.remove(name)
+            return name
+
+    assert aio.gather(UnsafeClient(), 'end_container', *((str(index),) for index in range(10))) == [
+        str(index) for index in range(10)
+    ]
+    assert not overlapped.is_set()
+
+
+def test_gather_engine_client(engine_url):
+    client = engine.Client(base_url=engine_url)
+    names = [(f'container{index}',) for index in range(40)]
+    assert aio.gather(client, 'container_get', *names) == [name for name, in names]
+    assert client.pool_stats()['connections'] > 1
+
+
+def test_sync_client_wraps_native_async_client():
+    client = aio.SyncClient(NativeClient())
+    assert client.start('tests') == 'started tests'
+    assert aio.get_async_client(client) is client.aio
+    assert hasattr(client, 'network_prune') is False
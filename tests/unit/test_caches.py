@@ -0,0 +1,53 @@
+from unittest import mock
+
+import pytest
+from teststack import caches
+from teststack.utils import parse_size
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+
+
+def test_mounts():
+    assert caches.mounts({'pip': '/root/.cache/pip'}) == {
+        'teststack-cache-pip': {'bind': '/root/.cache/pip', 'mode': 'rw'}
+    }
+    assert caches.mounts(None) == {}
+
+
+def test_prune_least_recently_used():
+    client = mock.MagicMock()
+    client.volume_list.return_value = [
+        {'name': 'teststack-cache-npm', 'size': 300},
+        {'name': 'teststack-cache-pip', 'size': 200},
+        {'name': 'teststack-cache-old', 'size': None},
+    ]
+    with mock.patch('time.time', return_value=100):
+        caches.ensure(client, {'npm': '/root/.npm'})
+    with mock.patch('time.time', return_value=200):
+        caches.ensure(client, {'pip': '/root/.cache/pip'})
+    client.volume_ensure.assert_called_with('teststack-cache-pip', labels={'teststack.cache': 'pip'})
+
+    assert [cache['name'] for cache in caches.list_(client)] == [
+        'teststack-cache-old',
+        'teststack-cache-npm',
+        'teststack-cache-pip',
+    ]
+    assert [cache['name'] for cache in caches.prune(client, 250, dry_run=True)] == [
+        'teststack-cache-old',
+        'teststack-cache-npm',
+    ]
+    assert client.volume_remove.called is False
+
+    client.volume_remove.side_effect = lambda name: name != 'teststack-cache-npm'
+    assert [cache['name'] for cache in caches.prune(client, 250)] == ['teststack-cache-old', 'teststack-cache-pip']
+
+
+def test_parse_size():
+    assert parse_size('10G') == 10 * 1024**3
+    assert parse_size('512m') == 512 * 1024**2
+    assert parse_size('1.5kb') == 1536
+    assert parse_size(100) == 100
+    assert parse_size('100') == 100
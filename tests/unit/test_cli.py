@@ -17,3 +17,19 @@ def test_min_version(runner):
             toml.dump({'tests': {'min_version': 'v999.999.999'}}, fh_)
         result = runner.invoke(cli, [f'--path={th_}', 'env'])
         assert result.exit_code == 10
+
+
+def test_client_shared_with_imports(runner, attrs, client):
+    import docker
+
+    client.containers.get.return_value.attrs = attrs
+    result = runner.invoke(cli, ['env'])
+    assert result.exit_code == 0
+    assert docker.from_env.call_count == 1
+
+
+def test_profile(runner, client):
+    result = runner.invoke(cli, ['--profile', 'tag'])
+    assert result.exit_code == 0
+    assert 'teststack: finished in' in result.output
+    assert 'teststack: client docker:' in result.output
@@ -1,12 +1,16 @@
+import json
 import os
+import signal
 import tempfile
 from unittest import mock
 from xml.etree.ElementTree import ElementTree
 
+import pytest
 from docker.errors import ImageNotFound
 from docker.errors import NotFound
 from teststack import cli
 from teststack.commands import containers
+from teststack.containers.docker import Client as DockerClient
 
 
 def test_render(runner, tag):
@@ -42,60 +46,127 @@ def test_render_isolated(runner):
             assert not fh_.readline()
 
 
-def test_container_start_no_tests(runner, attrs, client):
+SERVICES = ['teststack_database', 'teststack_rabbit', 'teststack_cache']
+IMPORTED = ['teststack.testapp_database', 'teststack.testapp_cache', 'teststack.testapp_tests']
+
+
+def _containers(attrs, names, **kwargs):
+    containers = []
+    for name in names:
+        container = mock.MagicMock()
+        container.attrs = {'Id': name, 'Names': [f'/{name}'], 'State': 'running', **attrs, **kwargs}
+        containers.append(container)
+    return containers
+
+
+def _engine(client, attrs, containers):
+    """
+    Serve ``containers.list`` from ``containers``, which ``containers.run`` and ``start`` update.
+    """
+
+    def list_(all=False, sparse=False, filters=None):
+        if 'label' in filters:
+            labels = set(filters['label'])
+            return [
+                container
+                for container in containers
+                if labels <= {f'{key}={value}' for key, value in (container.attrs.get('Labels') or {}).items()}
+            ]
+        names = set(filters['name'])
+        return [container for container in containers if container.attrs['Names'][0][1:] in names]
+
+    def run(name, labels=None, **kwargs):
+        containers[:] = [container for container in containers if container.attrs['Names'][0][1:] != name]
+        containers.extend(_containers(attrs, [name], Labels=labels))
+        return mock.MagicMock(id=name)
+
+    def start():
+        for container in containers:
+            container.attrs['State'] = 'running'
+
+    client.containers.list.side_effect = list_
+    client.containers.run.side_effect = run
     client.containers.get.return_value.attrs = attrs
-    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.start.side_effect = start
+
+
+def test_container_start_no_tests(runner, attrs, client):
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED))
 
     result = runner.invoke(cli, ['start', '-n'])
-    assert client.containers.get.call_count == 17
     assert client.containers.run.called is False
+    assert 'Starting container' not in result.output
     assert result.exit_code == 0
 
 
 def test_container_start_no_tests_not_started(runner, attrs, client):
-    container = mock.MagicMock()
-    container.status = "running"
-    container.attrs = attrs
-    client.containers.get.side_effect = [
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-    ] + [container] * 11
+    _engine(client, attrs, _containers(attrs, ['teststack_rabbit'] + IMPORTED))
 
     result = runner.invoke(cli, ['start', '-n'])
-    assert client.containers.get.call_count == 16
     assert client.containers.run.call_count == 2
+    assert 'Starting container: teststack_database' in result.output
+    assert 'Starting container: teststack_cache' in result.output
+    assert result.exit_code == 0
+
+
+def test_container_start_stopped(runner, attrs, client):
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED, State='exited'))
+
+    result = runner.invoke(cli, ['start', '-n'])
+    assert client.containers.run.called is False
+    assert client.containers.get.return_value.start.call_count == 3
+    assert result.exit_code == 0
+
+
+def test_container_start_config_changed(runner, attrs, client):
+    labels = {'teststack.project': 'teststack', 'teststack.config-hash': 'outdated'}
+    _engine(client, attrs, _containers(attrs, SERVICES, Labels=labels) + _containers(attrs, IMPORTED))
+
+    result = runner.invoke(cli, ['start', '-n'])
+    assert client.containers.run.call_count == 3
+    assert client.containers.get.return_value.remove.call_count == 3
+    assert 'Recreating container: teststack_database (config changed)' in result.output
+    assert result.exit_code == 0
+
+
+def test_container_start_instance(runner, attrs, client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    _engine(client, attrs, [])
+
+    result = runner.invoke(cli, ['--instance=ci1', 'start', '-n'])
+    names = {call.kwargs['name'] for call in client.containers.run.call_args_list}
+    assert {'teststack-ci1_database', 'teststack-ci1_rabbit', 'teststack-ci1_cache'} <= names
+    # the instance is passed on to imported projects
+    assert 'teststack-ci1.testapp-ci1_database' in names
+    assert {call.kwargs['network'] for call in client.containers.run.call_args_list} == {
+        'teststack-ci1',
+        'testapp-ci1',
+    }
     assert result.exit_code == 0
 
 
 def test_container_start_with_tests(runner, attrs, client):
-    client.images.get.return_value.id = client.containers.get.return_value.image.id
-    client.containers.get.return_value.attrs = attrs
-    client.containers.get.return_value.status = "running"
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
 
     result = runner.invoke(cli, ['start'])
-    assert client.containers.get.call_count == 30
     assert client.containers.run.called is False
     assert result.exit_code == 0
 
 
 def test_container_start_with_tests_old_image(runner, attrs, client):
-    container = mock.MagicMock()
-    container.attrs = attrs
-    container.status = "running"
-    client.containers.get.side_effect = [
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-    ] + [container] * 24
+    client.images.get.return_value.id = 'image'
+    _engine(
+        client,
+        attrs,
+        _containers(attrs, SERVICES + IMPORTED, ImageID='image')
+        + _containers(attrs, ['teststack_tests'], ImageID='old'),
+    )
+    container = client.containers.get.return_value
 
     result = runner.invoke(cli, ['start'])
-    assert client.containers.get.call_count == 29
-    assert client.containers.run.called is True
+    assert client.containers.run.call_count == 1
+    assert 'Recreating container: teststack_tests (image changed)' in result.output
     assert container.stop.called is True
     assert container.wait.called is True
     container.remove.assert_called_with(v=True)
@@ -103,40 +174,62 @@ def test_container_start_with_tests_old_image(runner, attrs, client):
 
 
 def test_container_start_with_tests_not_started(runner, attrs, client):
-    container = mock.MagicMock()
-    container.attrs = attrs
-    container.status = "running"
-    client.containers.get.side_effect = [
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-    ] + [container] * 30
+    _engine(client, attrs, [])
 
     result = runner.invoke(cli, ['start'])
-    assert client.containers.get.call_count == 29
-    assert client.containers.run.call_count == 3
+    assert client.containers.run.call_count == 6
     assert result.exit_code == 0
 
 
+def test_container_plan(runner, attrs, client):
+    client.images.get.return_value.id = 'image'
+    _engine(
+        client,
+        attrs,
+        _containers(attrs, ['teststack_database'], State='exited')
+        + _containers(attrs, ['teststack_rabbit', 'teststack_tests'], ImageID='image'),
+    )
+
+    result = runner.invoke(cli, ['plan'])
+    assert result.exit_code == 0
+    assert client.containers.list.call_count == 1
+    assert client.containers.run.called is False
+    assert 'teststack_database: start (exited)' in result.output
+    assert 'teststack_rabbit: keep (up to date)' in result.output
+    assert 'teststack_cache: create (missing)' in result.output
+    assert 'teststack_tests: keep (up to date)' in result.output
+
+
 def test_container_stop(runner, attrs, client):
-    client.containers.get.return_value.attrs = attrs
+    containers = []
+    for name in [
+        'teststack_database',
+        'teststack_rabbit',
+        'teststack_cache',
+        'teststack_tests',
+        'teststack.testapp_database',
+        'teststack.testapp_cache',
+        'teststack.testapp_tests',
+    ]:
+        container = mock.MagicMock()
+        container.attrs = {'Id': name, 'Names': [f'/{name}'], 'State': 'running', **attrs}
+        containers.append(container)
+    client.containers.list.return_value = containers
 
     with mock.patch('teststack.containers.docker.Client.end_container') as end_container:
         result = runner.invoke(cli, ['stop'])
-    assert client.containers.get.call_count == 7
+    assert client.containers.list.call_count == 4
+    assert client.containers.get.called is False
     assert end_container.call_count == 7
     assert result.exit_code == 0
 
 
 def test_container_stop_without_containers(runner, attrs, client):
-    client.containers.get.return_value.attrs = attrs
-    client.containers.get.side_effect = NotFound('container not found')
+    client.containers.list.return_value = []
 
     with mock.patch('teststack.containers.docker.Client.end_container') as end_container:
         result = runner.invoke(cli, ['stop'])
-    assert client.containers.get.call_count == 7
+    assert client.containers.list.call_count == 4
     assert end_container.called is False
     assert result.exit_code == 0
 
@@ -189,31 +282,58 @@ def test_container_build_service_with_tag(runner, build_command, client):
     )
 
 
-def test_container_start_with_tests_without_image(runner, attrs, client):
-    container = mock.MagicMock()
-    container.status = "running"
-    container.attrs = attrs
-    client.containers.get.side_effect = [
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-        container,
-        NotFound('container not found'),
-    ] + [container] * 24
+def test_container_run_does_not_change_volumes(client):
+    client.images.get.return_value.attrs = {'Config': {'WorkingDir': '/srv'}}
+    volumes = {'cache': {'bind': '/root/.cache', 'mode': 'rw'}}
+    DockerClient().run('teststack_tests', 'teststack:abc', volumes=volumes, mount_cwd=True, network='teststack')
+    assert volumes == {'cache': {'bind': '/root/.cache', 'mode': 'rw'}}
+    assert len(client.containers.run.call_args.kwargs['volumes']) == 2
+
+
+def test_container_build_cache(client, build_command):
+    DockerClient().build(
+        'Dockerfile',
+        'blah',
+        False,
+        cache_from='type=local,src=.teststack/buildcache',
+        cache_to=['type=local,dest=.teststack/buildcache'],
+    )
+    build_command.assert_called_with(
+        [
+            "docker",
+            "build",
+            "--file=./Dockerfile",
+            "--tag=blah",
+            "--rm",
+            ".",
+            "--cache-from=type=local,src=.teststack/buildcache",
+            "--cache-to=type=local,dest=.teststack/buildcache",
+        ]
+    )
+
+
+def test_container_start_with_tests_without_image(runner, attrs, client, tag, build_command):
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED))
     image = mock.MagicMock()
-    client.images.get.side_effect = [image, ImageNotFound('image not found'), image, image, image]
+    missing = [ImageNotFound('image not found')]
+
+    def get(name):
+        if name == tag['tag'] and missing:
+            raise missing.pop()
+        return image
+
+    client.images.get.side_effect = get
 
     result = runner.invoke(cli, ['start'])
-    assert client.containers.get.call_count == 29
-    assert client.containers.run.called is True
-    assert client.images.get.call_count == 5
+    assert build_command.called is True
+    assert client.containers.run.call_count == 1
     assert result.exit_code == 0
 
 
 def test_container_run(runner, attrs, client):
-    client.containers.get.return_value.attrs = attrs
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
     client.containers.get.return_value.status = "running"
-    client.images.get.return_value.id = client.containers.get.return_value.image.id
     client.containers.get.return_value.client.api.exec_start.return_value = [
         'foo',
         'bar',
@@ -224,7 +344,7 @@ def test_container_run(runner, attrs, client):
     }
 
     result = runner.invoke(cli, ['run'])
-    assert client.containers.get.call_count == 33
+    assert client.containers.get.call_count == 9
     assert client.containers.run.called is False
     assert result.exit_code == 0
     assert 'foobarbaz' in result.output
@@ -233,9 +353,9 @@ def test_container_run(runner, attrs, client):
 
 
 def test_container_run_step(runner, attrs, client):
-    client.containers.get.return_value.attrs = attrs
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
     client.containers.get.return_value.status = "running"
-    client.images.get.return_value.id = client.containers.get.return_value.image.id
     client.containers.get.return_value.client.api.exec_start.return_value = [
         'foo',
         'bar',
@@ -247,7 +367,7 @@ def test_container_run_step(runner, attrs, client):
     }
 
     result = runner.invoke(cli, ['run', '--step=install'])
-    assert client.containers.get.call_count == 31
+    assert client.containers.get.call_count == 7
     assert client.containers.run.called is False
     assert result.exit_code == 0
     assert 'foobarbaz' in result.output
@@ -256,6 +376,430 @@ def test_container_run_step(runner, attrs, client):
     assert 'Run Command: python -m pip install' in result.output
 
 
+def test_container_start_run_chained(runner, attrs, client):
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = ['foo']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+
+    result = runner.invoke(cli, ['run', '--step=install'])
+    calls = client.containers.list.call_count, client.images.get.call_count
+    result = runner.invoke(cli, ['start', 'run', '--step=install', 'run', '--step=install'])
+    assert result.exit_code == 0
+    assert (client.containers.list.call_count, client.images.get.call_count) == tuple(2 * count for count in calls)
+
+
+def test_container_run_shards(runner, attrs, client, tmp_path):
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+    timings = tmp_path / 'shards.json'
+
+    with mock.patch('teststack.sharding.TIMINGS', timings):
+        result = runner.invoke(
+            cli,
+            ['run', '--step=install', '--shards=2', '--', '-x', 'tests/unit/test_git.py', 'tests/unit/test_aio.py'],
+        )
+    assert result.exit_code == 0
+    assert client.containers.run.call_count == 1
+    assert client.containers.run.call_args.kwargs['name'] == 'teststack_tests_1'
+    assert client.containers.run.call_args.kwargs['labels']['teststack.shard'] == '1'
+    assert '[0] ok' in result.output
+    assert '[1] ok' in result.output
+    assert 'Shard 1: 1 files, exit code 0' in result.output
+    assert set(json.loads(timings.read_text())) == {'tests/unit/test_git.py', 'tests/unit/test_aio.py'}
+
+    with mock.patch('teststack.containers.docker.Client.end_container') as end_container:
+        result = runner.invoke(cli, ['stop'])
+    assert mock.call('teststack_tests_1') in end_container.call_args_list
+
+
+def test_container_run_shards_copy(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[tests]\ncopy = ["junit.xml"]\n[tests.steps]\ninstall = "pytest {posargs}"\n'
+    )
+    (tmp_path / 'test_a.py').write_text('')
+    (tmp_path / 'test_b.py').write_text('')
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    attrs['Config'] = {'WorkingDir': '/srv'}
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, [f'{project}_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 128}
+    copied = []
+
+    def cp(name, src):
+        copied.append((name, os.path.relpath(os.getcwd(), tmp_path)))
+        return True
+
+    with mock.patch('teststack.containers.docker.Client.cp', side_effect=cp), mock.patch(
+        'teststack.sharding.TIMINGS', tmp_path / 'shards.json'
+    ):
+        result = runner.invoke(
+            cli,
+            [f'--path={tmp_path}', 'run', '--step=install', '--shards=2', '--copy', '--', 'test_a.py', 'test_b.py'],
+        )
+    assert result.exit_code == 128
+    assert copied[0][1] == os.path.join('.teststack', 'shards', '1')
+    assert copied[1] == (f'{project}_tests', '.')
+
+
+def test_container_run_shards_on_hosts(runner, attrs, client, tmp_path):
+    from teststack.containers.docker import Client
+
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\n[tests.steps]\ninstall = "pytest {posargs}"\n'
+    )
+    (tmp_path / 'test_a.py').write_text('')
+    (tmp_path / 'test_b.py').write_text('')
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    attrs['Config'] = {'WorkingDir': '/srv'}
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, [f'{project}_database', f'{project}_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+    local, remote = Client(), Client()
+
+    with mock.patch('teststack.hosts.clients', return_value=[('local', local, 1), ('build1', remote, 1)]):
+        result = runner.invoke(
+            cli, [f'--path={tmp_path}', 'run', '--step=install', '--shards=2', '--', 'test_a.py', 'test_b.py']
+        )
+    assert 'Starting 1 shards on build1' in result.output
+    assert client.containers.get.return_value.put_archive.call_args.args[0] == '/srv'
+    assert '[0@local] ok' in result.output
+    assert '[1@build1] ok' in result.output
+    assert result.exit_code == 0
+
+
+@pytest.mark.parametrize('capacity,shards', [(2, 3), (32, 2)])
+def test_container_run_shards_on_hosts_copy(runner, attrs, client, tmp_path, capacity, shards):
+    from teststack.containers.docker import Client
+
+    (tmp_path / 'teststack.toml').write_text(
+        '[tests]\ncopy = ["junit.xml"]\n[tests.steps]\ninstall = "pytest {posargs}"\n'
+    )
+    for name in ('test_a.py', 'test_b.py', 'test_c.py'):
+        (tmp_path / name).write_text('')
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    attrs['Config'] = {'WorkingDir': '/srv'}
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, [f'{project}_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+    local, remote = Client(), Client()
+    copied = []
+
+    def cp(self, name, src):
+        copied.append(('remote' if self is remote else 'local', os.path.relpath(os.getcwd(), tmp_path)))
+        return True
+
+    with mock.patch(
+        'teststack.hosts.clients', return_value=[('local', local, 1), ('build1', remote, capacity)]
+    ), mock.patch('teststack.containers.docker.Client.cp', autospec=True, side_effect=cp), mock.patch(
+        'teststack.sharding.TIMINGS', tmp_path / 'shards.json'
+    ):
+        result = runner.invoke(
+            cli,
+            [
+                f'--path={tmp_path}',
+                'run',
+                '--step=install',
+                f'--shards={shards}',
+                '--copy',
+                '--',
+                'test_a.py',
+                'test_b.py',
+                'test_c.py',
+            ],
+        )
+    assert result.exit_code == 0
+    # the local tests container always runs the first shard, even when the remote host has far more capacity
+    assert copied == [
+        *(('remote', os.path.join('.teststack', 'shards', str(index))) for index in range(1, shards)),
+        ('local', '.'),
+    ]
+
+
+def test_container_run_shards_on_hosts_with_imports(runner, attrs, client):
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, _containers(attrs, SERVICES + IMPORTED + ['teststack_tests'], ImageID='image'))
+    client.containers.get.return_value.status = "running"
+    hosts = [('local', mock.MagicMock(), 1), ('build1', mock.MagicMock(), 1)]
+
+    with mock.patch('teststack.hosts.clients', return_value=hosts):
+        result = runner.invoke(cli, ['run', '--shards=2', '--', 'tests/unit/test_git.py', 'tests/unit/test_aio.py'])
+    assert result.exit_code == 2
+    assert 'can only run on the local host' in result.output
+
+
+def test_container_run_step_services(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\n[services.cache]\nimage = "redis:6"\n'
+        '[tests.steps.unit]\ncommand = "pytest"\nservices = []\n'
+        '[tests.steps.integration]\ncommand = "pytest"\nservices = ["cache"]\n'
+    )
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, [])
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'run', '--step=unit'])
+    assert result.exit_code == 0
+    assert [call.kwargs['name'] for call in client.containers.run.call_args_list] == [f'{project}_tests']
+
+    client.containers.run.reset_mock()
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'run', '--step=integration'])
+    assert result.exit_code == 0
+    assert [call.kwargs['name'] for call in client.containers.run.call_args_list] == [
+        f'{project}_cache',
+        f'{project}_tests',
+    ]
+
+
+def test_setup_waits_for_connections(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\n'
+        '[services.database.isolation]\nworkers = 2\nsetup = "createdb db_{WORKER}"\n'
+    )
+    attrs['NetworkSettings']['Networks'][tmp_path.name] = {'IPAddress': '172.18.0.2'}
+    _engine(client, attrs, [])
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+    calls = mock.MagicMock()
+    client.containers.get.return_value.client.api.exec_create.side_effect = calls.exec_create
+    with mock.patch('teststack.lazy.wait_ready', calls.wait_ready):
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'start', '-n'])
+    assert result.exit_code == 0
+    # the server has no healthcheck, so its port is waited on before creating the databases
+    assert [call[0] for call in calls.mock_calls if '.' not in call[0]] == ['wait_ready', 'exec_create', 'exec_create']
+    assert ('localhost', 12345) in list(calls.wait_ready.call_args.args[0])
+
+
+def test_container_snapshot_reset(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\nsnapshot = ["/var/lib/postgresql/data"]\n'
+        '[services.database.ports]\n"5432/tcp" = ""\n'
+    )
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    _engine(client, attrs, _containers(attrs, [f'{project}_database']))
+    container = client.containers.get.return_value
+    container.status = 'running'
+    container.get_archive.return_value = ([b'da', b'ta'], {})
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'reset'])
+    assert result.exit_code == 1
+    assert 'There is no snapshot default' in result.output
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'snapshot', 'database'])
+    assert result.exit_code == 0
+    assert container.stop.call_count == 1
+    container.get_archive.assert_called_with('/var/lib/postgresql/data')
+    assert (tmp_path / '.teststack' / 'snapshots' / f'{project}_database' / 'default').is_dir()
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'reset', 'database'])
+    assert result.exit_code == 0
+    created = client.containers.create.return_value
+    created.put_archive.assert_called_once_with('/var/lib/postgresql', b'data')
+    assert created.start.call_count == 1
+    assert client.containers.create.call_args.kwargs['ports'] == {'5432/tcp': '12345'}
+    assert 'Removing' not in result.output
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'snapshot', 'cache'])
+    assert result.exit_code == 2
+
+
+def test_container_start_tmpfs(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\nsnapshot = ["/var/lib/postgresql/data"]\n'
+        '[services.database.tmpfs]\n"/var/lib/postgresql/data" = "512m"\n'
+        '[services.cache]\nimage = "redis:6"\n'
+        '[services.cache.tmpfs]\n"/data" = {size = "64m", mode = "1777", noexec = true, ro = false}\n"/tmp" = ""\n'
+    )
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    _engine(client, attrs, [])
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'start', '-n'])
+    assert result.exit_code == 0
+    tmpfs = {call.kwargs['name']: call.kwargs['tmpfs'] for call in client.containers.run.call_args_list}
+    assert tmpfs == {
+        f'{project}_database': {'/var/lib/postgresql/data': 'size=512m'},
+        f'{project}_cache': {'/data': 'size=64m,mode=1777,noexec', '/tmp': ''},
+    }
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'snapshot'])
+    assert result.exit_code == 2
+    assert 'it is on a tmpfs' in result.output
+
+
+def test_container_start_caches(runner, attrs, client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'teststack.toml').write_text('[tests.caches]\npip = "/root/.cache/pip"\n')
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    client.images.get.return_value.id = 'image'
+    client.volumes.get.side_effect = NotFound('volume')
+    _engine(client, attrs, [])
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'start'])
+    assert result.exit_code == 0
+    client.volumes.create.assert_called_once_with('teststack-cache-pip', labels={'teststack.cache': 'pip'})
+    assert client.containers.run.call_args.kwargs['volumes']['teststack-cache-pip'] == {
+        'bind': '/root/.cache/pip',
+        'mode': 'rw',
+    }
+
+    volume = mock.MagicMock()
+    volume.name = 'teststack-cache-pip'
+    client.volumes.list.return_value = [volume]
+    client.volumes.get.side_effect = None
+    client.df.return_value = {'Volumes': [{'Name': 'teststack-cache-pip', 'UsageData': {'Size': 2048}}]}
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'caches'])
+    assert result.exit_code == 0
+    assert 'teststack-cache-pip: 2.0KB, last used' in result.output
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'caches', '--prune', '--max-size=1k'])
+    assert result.exit_code == 0
+    assert client.volumes.get.return_value.remove.call_count == 1
+    assert 'Space reclaimed: 2.0KB' in result.output
+
+
+def test_container_start_lazy(runner, attrs, client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\n'
+        '[services.cache]\nimage = "redis:6"\nlazy = true\n'
+        '[services.cache.ports]\n"6379/tcp" = ""\n'
+        '[services.cache.export]\nREDIS_URL = "redis://{HOST}:{PORT;6379/tcp}/0"\n'
+    )
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    _engine(client, attrs, [])
+
+    with mock.patch('teststack.utils.subprocess.Popen') as popen, mock.patch('teststack.lazy.wait_ready'):
+        popen.return_value.pid = os.getpid()
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'start', '-n'])
+    assert result.exit_code == 0
+    assert [call.kwargs['name'] for call in client.containers.run.call_args_list] == [f'{project}_database']
+    assert popen.call_args.args[0][-3:] == ['proxy', '--prefix=', 'cache']
+
+    state = json.loads((tmp_path / '.teststack' / 'lazy' / f'{project}_cache.json').read_text())
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'env', '-s', 'cache'])
+    assert result.exit_code == 0
+    assert result.output == f'export REDIS_URL=redis://localhost:{state["ports"]["6379/tcp"]}/0\n'
+
+    with mock.patch('teststack.lazy.os.kill') as kill:
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'stop'])
+    assert result.exit_code == 0
+    assert mock.call(os.getpid(), signal.SIGTERM) in kill.call_args_list
+    assert not (tmp_path / '.teststack' / 'lazy' / f'{project}_cache.json').exists()
+
+
+def test_container_warm(runner, attrs, client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'teststack.toml').write_text('[tests.warm]\nsize = 1\n')
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    attrs['ImageID'] = 'image'
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, [])
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'warm'])
+    assert result.exit_code == 0
+    assert client.containers.run.call_args.kwargs['name'] == f'{project}_tests_warm_1'
+    assert client.containers.run.call_args.kwargs['labels']['teststack.warm'] == f'{project}_tests'
+
+    with mock.patch('teststack.utils.subprocess.Popen') as popen:
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'start'])
+    assert result.exit_code == 0
+    assert f'Using warm container: {project}_tests' in result.output
+    assert client.containers.run.call_count == 1
+    client.containers.get.return_value.rename.assert_called_once_with(f'{project}_tests')
+    assert popen.call_args.args[0][-1] == 'warm'
+    assert f'--path={tmp_path}' in popen.call_args.args[0]
+
+
+def test_container_warm_step_services(runner, attrs, client, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'teststack.toml').write_text(
+        '[services.database]\nimage = "postgres:12"\n[services.cache]\nimage = "redis:6"\n'
+        '[tests.warm]\nsize = 1\n'
+        '[tests.steps.unit]\ncommand = "pytest"\nservices = []\n'
+        '[tests.steps.integration]\ncommand = "pytest"\nservices = ["cache"]\n'
+    )
+    project = tmp_path.name
+    attrs['NetworkSettings']['Networks'][project] = {'IPAddress': 'fakeaddress'}
+    attrs['ImageID'] = 'image'
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, [])
+    client.containers.get.return_value.client.api.exec_start.return_value = [b'ok\n']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'start', '-n'])
+    assert result.exit_code == 0
+    client.containers.run.reset_mock()
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'warm'])
+    assert result.exit_code == 0
+    # all services, only cache, and none
+    assert sorted(call.kwargs['name'] for call in client.containers.run.call_args_list) == [
+        f'{project}_tests_warm_1',
+        f'{project}_tests_warm_2',
+        f'{project}_tests_warm_3',
+    ]
+    environments = {call.kwargs['name']: call.kwargs['environment'] for call in client.containers.run.call_args_list}
+
+    client.containers.run.reset_mock()
+    with mock.patch('teststack.utils.subprocess.Popen'):
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'run', '--step=unit'])
+    assert result.exit_code == 0
+    assert f'Using warm container: {project}_tests' in result.output
+    assert client.containers.run.called is False
+    client.containers.get.return_value.rename.assert_called_once_with(f'{project}_tests')
+    assert mock.call(f'{project}_tests_warm_3') in client.containers.get.call_args_list
+    assert environments[f'{project}_tests_warm_3'] == {}
+
+
+def test_container_watch(runner, attrs, client, tmp_path):
+    (tmp_path / 'teststack.toml').write_text(
+        '[tests.steps]\ninstall = "pip install ."\n'
+        '[tests.steps.lint]\ncommand = "flake8"\nwatch = ["**/*.py", "setup.cfg"]\n'
+        '[tests.steps.tests]\ncommand = "pytest {posargs}"\nrequires = ["install"]\nwatch = ["src/**/*.py"]\n'
+    )
+    attrs['NetworkSettings']['Networks'][tmp_path.name] = {'IPAddress': 'fakeaddress'}
+    attrs['Config'] = {'WorkingDir': '/srv'}
+    client.images.get.return_value.id = 'image'
+    _engine(client, attrs, [])
+    client.containers.get.return_value.status = "running"
+    client.containers.get.return_value.client.api.exec_start.return_value = ['ok']
+    client.containers.get.return_value.client.api.exec_inspect.return_value = {'ExitCode': 0}
+
+    changes = [['src/app/models.py'], ['docs/index.rst'], ['setup.cfg']]
+    with mock.patch('teststack.watch.changes', return_value=iter(changes)):
+        result = runner.invoke(cli, [f'--path={tmp_path}', 'watch', '--', '-x'])
+    assert result.exit_code == 0
+    assert result.output.count('Run Command: flake8') == 3
+    assert result.output.count('Run Command: pytest -x') == 2
+    assert result.output.count('Run Command: pip install .') == 1
+    assert 'Changed: docs/index.rst' not in result.output
+    assert 'Ran lint: exit code 0' in result.output
+
+    result = runner.invoke(cli, [f'--path={tmp_path}', 'watch', '--step=missing'])
+    assert result.exit_code == 2
+    assert 'Unknown steps: missing' in result.output
+
+
 def test_container_tag(runner):
     with runner.isolated_filesystem():
         result = runner.invoke(cli, ['tag'])
@@ -268,6 +812,24 @@ def test_container_status_notfound(runner):
     assert 'notfound' in result.stdout
 
 
+def test_container_status(runner, attrs, client):
+    container = mock.MagicMock()
+    container.attrs = {
+        'Id': 'database',
+        'Names': ['/teststack_database'],
+        'State': 'running',
+        'Ports': [{'PrivatePort': 5432, 'PublicPort': 12345, 'Type': 'tcp'}],
+    }
+    client.containers.list.return_value = [container]
+
+    result = runner.invoke(cli, ['status'])
+    assert result.exit_code == 0
+    assert client.containers.list.call_count == 2
+    assert client.containers.get.called is False
+    assert "{'PORT;5432/tcp': '12345'}" in result.output
+    assert 'notfound' in result.output
+
+
 def test_container_copy_raises(runner, client):
     client.containers.get.return_value.get_archive.side_effect = NotFound(message='notfound')
     client.containers.get.return_value.attrs = {'Config': {'WorkingDir': '/srv'}}
@@ -345,3 +907,36 @@ def test_container_command__run_command_required_by(client):
         )
         == exit_code
     )
+
+
+def test_container_gc(runner, client, tag):
+    repository = tag['tag'].rsplit(':', 1)[0]
+    images = []
+    for idx in range(4):
+        image = mock.MagicMock()
+        image.id = f'sha256:{idx}'
+        image.tags = [f'{repository}:{idx}']
+        image.attrs = {'Created': f'2021-01-0{idx + 1}T00:00:00Z', 'Size': 1024}
+        images.append(image)
+    client.images.list.return_value = images
+    client.images.prune.return_value = {'SpaceReclaimed': 1024}
+
+    result = runner.invoke(cli, ['gc', '--keep=2'])
+    assert result.exit_code == 0
+    removed = [call.args[0] for call in client.images.remove.call_args_list]
+    assert removed == [f'{repository}:1', f'{repository}:0']
+    assert 'Space reclaimed: 3.0KB' in result.output
+
+
+def test_container_gc_dry_run(runner, client, tag):
+    repository = tag['tag'].rsplit(':', 1)[0]
+    image = mock.MagicMock()
+    image.tags = [f'{repository}:old']
+    image.attrs = {'Created': '2021-01-01T00:00:00Z', 'Size': 1024}
+    client.images.list.return_value = [image]
+
+    result = runner.invoke(cli, ['gc', '--keep=0', '--dry-run'])
+    assert result.exit_code == 0
+    assert f'Would remove image: {repository}:old' in result.output
+    assert client.images.remove.called is False
+    assert client.images.prune.called is False
@@ -0,0 +1,219 @@
+import http.client
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from teststack.containers import engine
+
+
+@pytest.fixture
+def connection():
+    with mock.patch('teststack.containers.engine.UnixHTTPConnection') as connection:
+        yield connection.return_value
+
+
+def response(status, body=None):
+    resp = mock.MagicMock()
+    resp.status = status
+    resp.read.return_value = b'' if body is None else json.dumps(body).encode('utf-8')
+    return resp
+
+
+def test_engine_container_get(connection):
+    connection.getresponse.return_value = response(200, {'Id': 'abc'})
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    assert client.container_get('foo') == 'abc'
+    connection.request.assert_called_with('GET', '/v1.41/containers/foo/json', body=None, headers={})
+
+
+@pytest.mark.parametrize('server,version', [('1.47', '1.44'), ('1.41', '1.41'), (None, '1.44')])
+def test_engine_negotiates_version(connection, server, version):
+    connection.getresponse.side_effect = [
+        response(200, {'ApiVersion': server}) if server else response(404, {'message': 'page not found'}),
+        response(200, {'Id': 'abc'}),
+        response(200, {'Id': 'abc'}),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock')
+    assert client.container_get('foo') == 'abc'
+    assert client.container_get('foo') == 'abc'
+    assert [call.args[1] for call in connection.request.call_args_list] == [
+        '/version',
+        f'/v{version}/containers/foo/json',
+        f'/v{version}/containers/foo/json',
+    ]
+
+
+def test_engine_container_get_notfound(connection):
+    connection.getresponse.return_value = response(404, {'message': 'No such container: foo'})
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    assert client.container_get('foo') is None
+    assert client.status('foo') == 'notfound'
+
+
+def test_engine_reconnects_closed_connection(connection):
+    connection.getresponse.side_effect = [http.client.RemoteDisconnected(), response(200, {'Id': 'sha256:abc'})]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    assert client.image_get('foo:latest') == 'sha256:abc'
+    assert connection.close.call_count == 1
+    assert connection.request.call_count == 2
+
+
+def test_engine_does_not_resend_posts(connection):
+    connection.getresponse.side_effect = http.client.RemoteDisconnected()
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    with pytest.raises(http.client.RemoteDisconnected):
+        client._request('POST', '/containers/foo/start')
+    assert connection.request.call_count == 1
+
+
+def test_engine_resends_posts_that_were_not_sent(connection):
+    connection.request.side_effect = [BrokenPipeError(), None]
+    connection.getresponse.return_value = response(204)
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    client._request('POST', '/containers/foo/start')
+    assert connection.request.call_count == 2
+
+
+def test_engine_concurrent_requests(engine_url):
+    client = engine.Client(base_url=engine_url)
+    names = [f'container{index}' for index in range(40)]
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        assert list(pool.map(client.container_get, names)) == names
+    stats = client.pool_stats()
+    assert stats['requests'] == 41
+    assert 1 < stats['connections'] <= 40
+    assert stats['idle'] == stats['connections']
+
+
+def test_engine_exec_start_checks_status():
+    sock = mock.MagicMock()
+    sock.recv.side_effect = [bytes([char]) for char in b'HTTP/1.1 409 Conflict\r\n\r\n']
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    with mock.patch('socket.socket', return_value=sock):
+        with pytest.raises(engine.APIError) as exc:
+            client._exec_start('abc')
+    assert exc.value.status == 409
+    sock.close.assert_called_once_with()
+
+
+def test_engine_run_pulls_missing_image(connection):
+    connection.getresponse.side_effect = [
+        response(200, [{'Name': 'teststack', 'Id': 'net'}]),
+        response(404, {'message': 'No such image: postgres:12'}),
+        response(200),
+        response(201, {'Id': 'container'}),
+        response(204),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    container = client.run(
+        name='teststack_database',
+        image='postgres:12',
+        ports={'5432/tcp': ''},
+        environment={'POSTGRES_USER': 'bebop'},
+        network='teststack',
+        service='database',
+    )
+    assert container == 'container'
+    methods = [call.args[:2] for call in connection.request.call_args_list]
+    assert methods[2] == ('POST', '/v1.41/images/create?fromImage=postgres&tag=12')
+    assert methods[4] == ('POST', '/v1.41/containers/container/start')
+    body = json.loads(connection.request.call_args_list[3].kwargs['body'])
+    assert body['Env'] == ['POSTGRES_USER=bebop']
+    assert body['HostConfig']['PortBindings'] == {'5432/tcp': [{'HostPort': ''}]}
+    assert body['HostConfig']['NetworkMode'] == 'teststack'
+
+
+def test_engine_run_does_not_change_volumes(connection):
+    connection.getresponse.side_effect = [
+        response(200, [{'Name': 'teststack', 'Id': 'net'}]),
+        response(200, {'Config': {'WorkingDir': '/srv'}}),
+        response(201, {'Id': 'container'}),
+        response(204),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    volumes = {'cache': {'bind': '/root/.cache', 'mode': 'rw'}}
+    client.run(name='teststack_tests', image='teststack:abc', volumes=volumes, mount_cwd=True, network='teststack')
+    assert volumes == {'cache': {'bind': '/root/.cache', 'mode': 'rw'}}
+    body = json.loads(connection.request.call_args_list[2].kwargs['body'])
+    assert len(body['HostConfig']['Binds']) == 2
+
+
+def test_engine_get_container_data(connection, attrs):
+    connection.getresponse.side_effect = [
+        response(200, {'Id': 'container', 'State': {'Status': 'exited'}, 'NetworkSettings': {'Networks': {}}}),
+        response(200, {'Id': 'container', 'NetworkSettings': {'Networks': {}}}),
+        response(204),
+        response(200, attrs),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    data = client.get_container_data('teststack_database', network='teststack', inside=True)
+    assert data['HOST'] == 'fakeaddress'
+    assert data['PORT;5432/tcp'] == '5432'
+
+
+def test_engine_network_ensure_cached(connection):
+    connection.getresponse.side_effect = [
+        response(200, []),
+        response(201, {'Id': 'net'}),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    assert client.network_ensure('teststack') == 'net'
+    assert client.network_ensure('teststack') == 'net'
+    assert connection.request.call_count == 2
+    body = json.loads(connection.request.call_args_list[1].kwargs['body'])
+    assert body['Labels'] == {'teststack.project': 'teststack'}
+
+
+def test_engine_network_remove_only_labeled(connection):
+    connection.getresponse.side_effect = [
+        response(200, [{'Name': 'teststack', 'Id': 'net', 'Labels': {}}]),
+        response(200, [{'Name': 'teststack', 'Id': 'net', 'Labels': {'teststack.project': 'teststack'}}]),
+        response(204),
+    ]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    assert client.network_remove('teststack') is False
+    assert client.network_remove('teststack') is True
+    assert connection.request.call_args_list[2].args[:2] == ('DELETE', '/v1.41/networks/net')
+
+
+def test_engine_get_container_data_running(connection, attrs):
+    connection.getresponse.return_value = response(200, {'State': {'Status': 'running'}, **attrs})
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    data = client.get_container_data('teststack_database', network='teststack')
+    assert data['PORT;5432/tcp'] == '12345'
+    assert connection.request.call_count == 1
+
+
+def test_engine_image_save_streams_to_file(connection, tmp_path):
+    resp = response(200)
+    resp.read.side_effect = io.BytesIO(b'tar' * 100000).read
+    connection.getresponse.return_value = resp
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    with open(tmp_path / 'image.tar', 'w+b') as output:
+        client.image_save('teststack:abc', output)
+    assert (tmp_path / 'image.tar').read_bytes() == b'tar' * 100000
+
+    connection.getresponse.return_value = response(200)
+    with open(tmp_path / 'image.tar', 'rb') as data:
+        data.seek(3)
+        client.image_load(data)
+        # the file is sent as it is read, from where it was
+        assert connection.request.call_args.kwargs['body'] is data
+    assert connection.request.call_args.kwargs['headers'] == {
+        'Content-Type': 'application/x-tar',
+        'Content-Length': str(3 * 100000 - 3),
+    }
+
+
+def test_engine_put_archive(connection):
+    connection.getresponse.side_effect = [response(200, {'Config': {'WorkingDir': '/srv'}}), response(200)]
+    client = engine.Client(base_url='unix:///tmp/docker.sock', version='1.41')
+    client.put_archive('teststack_tests', b'tar')
+    connection.request.assert_called_with(
+        'PUT',
+        '/v1.41/containers/teststack_tests/archive?path=%2Fsrv',
+        body=b'tar',
+        headers={'Content-Type': 'application/x-tar'},
+    )
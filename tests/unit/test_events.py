@@ -0,0 +1,62 @@
+from unittest import mock
+
+from teststack import events
+from teststack.commands.containers import _healthcheck
+
+
+def _event(name, action, **kwargs):
+    return {
+        'Type': 'container',
+        'Action': action,
+        'Actor': {'ID': f'{name}-id', 'Attributes': {'name': name, 'teststack.service': name}},
+        **kwargs,
+    }
+
+
+def test_wait_for_healthy():
+    client = mock.MagicMock()
+    client.events.return_value = iter(
+        [
+            _event('other', 'health_status: healthy'),
+            _event('database', 'start'),
+            _event('database', 'health_status: healthy'),
+            _event('cache', 'health_status', HealthStatus='healthy'),
+            _event('never', 'start'),
+        ]
+    )
+    result = events.wait_for(
+        client,
+        'teststack',
+        ['database', 'cache'],
+        actions=(events.HEALTHY,),
+        since=10,
+    )
+    assert result == {'database': events.HEALTHY, 'cache': events.HEALTHY}
+    assert client.events.call_count == 1
+    filters = client.events.call_args.kwargs['filters']
+    assert filters['label'] == ['teststack.project=teststack']
+    assert filters['event'] == ['die', 'health_status']
+    assert client.events.call_args.kwargs['since'] == 10
+
+
+def test_wait_for_failures_and_timeout():
+    client = mock.MagicMock()
+    client.events.return_value = iter([_event('database', 'die')])
+    result = events.wait_for(client, 'teststack', ['database', 'cache'], since=10)
+    assert result == {'database': 'die', 'cache': 'timeout'}
+
+
+def test_wait_for_nothing():
+    client = mock.MagicMock()
+    assert events.wait_for(client, 'teststack', []) == {}
+    assert client.events.called is False
+
+
+def test_healthcheck_config():
+    assert _healthcheck({}) is None
+    assert _healthcheck({'test': 'pg_isready', 'interval': 0.5, 'retries': 3}) == {
+        'test': ['CMD-SHELL', 'pg_isready'],
+        'interval': 500_000_000,
+        'retries': 3,
+    }
+    assert _healthcheck({'test': ['redis-cli', 'ping']})['test'] == ['CMD', 'redis-cli', 'ping']
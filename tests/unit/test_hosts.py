@@ -0,0 +1,40 @@
+import tarfile
+from unittest import mock
+
+from teststack import hosts
+
+
+def test_place_by_capacity():
+    assert hosts.place(6, [1, 2]) == [2, 4]
+    assert hosts.place(1, [1, 4]) == [1, 0]
+    assert hosts.place(2, [4, 32]) == [1, 1]
+    assert hosts.place(4, [2, 16]) == [1, 3]
+    assert hosts.place(3, [1]) == [3]
+
+
+def test_sync_images():
+    source, target = mock.MagicMock(), mock.MagicMock()
+    source.image_get.side_effect = lambda tag: None if tag == 'postgres:12' else f'{tag}-id'
+    target.image_get.side_effect = lambda tag: 'id' if tag == 'cache:abc' else None
+    source.image_save.side_effect = lambda tag, output: output.write(b'tar')
+    target.image_load.side_effect = lambda data: loaded.append(data.read())
+    loaded = []
+
+    hosts.sync_images(source, target, ['tests:abc', 'cache:abc', 'postgres:12', 'tests:abc'])
+    source.image_save.assert_called_once_with('tests:abc', mock.ANY)
+    assert loaded == [b'tar']
+
+
+def test_context_archive(tmp_path):
+    (tmp_path / '.git').mkdir()
+    (tmp_path / '.git' / 'HEAD').write_text('ref')
+    (tmp_path / 'build').mkdir()
+    (tmp_path / 'build' / 'out.txt').write_text('out')
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'app.py').write_text('app')
+    (tmp_path / 'app.pyc').write_text('')
+    (tmp_path / '.dockerignore').write_text('# comment\nbuild/\n*.pyc\n')
+
+    with hosts.context_archive(str(tmp_path)) as data:
+        archive = tarfile.open(fileobj=data)
+        assert sorted(archive.getnames()) == ['.dockerignore', 'src/app.py']
@@ -0,0 +1,52 @@
+from unittest import mock
+
+import click
+import pytest
+from teststack import DictConfig
+from teststack import instances
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    return tmp_path
+
+
+def test_project_name():
+    assert instances.project_name('teststack') == 'teststack'
+    assert instances.project_name('teststack', 'ci1') == 'teststack-ci1'
+
+
+def test_allocate_and_release():
+    first = instances.allocate('teststack-ci1', ['tests:5000/tcp', 'database:5432/tcp'], '20000-20009')
+    assert sorted(first.values()) == [20000, 20001]
+    # allocations are kept per owner, and never handed out twice
+    assert instances.allocate('teststack-ci1', ['tests:5000/tcp'], '20000-20009') == {
+        'tests:5000/tcp': first['tests:5000/tcp']
+    }
+    second = instances.allocate('teststack-ci2', ['tests:5000/tcp'], '20000-20009')
+    assert second == {'tests:5000/tcp': 20002}
+
+    instances.release('teststack-ci1')
+    assert instances.allocate('teststack-ci3', ['tests:5000/tcp'], '20000-20009') == {'tests:5000/tcp': 20000}
+
+
+def test_allocate_skips_ports_in_use():
+    with mock.patch('teststack.instances._free', side_effect=lambda port: port != 20000):
+        assert instances.allocate('teststack-ci1', ['tests:5000/tcp'], '20000-20009') == {'tests:5000/tcp': 20001}
+
+
+def test_allocate_pool_exhausted():
+    instances.allocate('teststack-ci1', ['tests:5000/tcp'], '20000-20000')
+    with pytest.raises(click.ClickException):
+        instances.allocate('teststack-ci2', ['tests:5000/tcp'], '20000-20000')
+
+
+def test_host_ports():
+    ctx = mock.MagicMock(obj=DictConfig({'instance': None, 'instances': {'ports': '20000-20009'}}))
+    ports = {'5000/tcp': '5000', '5432/tcp': ''}
+    assert instances.host_ports(ctx, 'teststack', 'tests', ports) == ports
+
+    ctx.obj['instance'] = 'ci1'
+    assert instances.host_ports(ctx, 'teststack-ci1', 'tests', ports) == {'5000/tcp': 20000, '5432/tcp': ''}
+    assert instances.options(ctx) == ['--instance=ci1']
@@ -0,0 +1,68 @@
+from unittest import mock
+
+from teststack import cli
+from teststack import isolation
+
+DATABASE = {'isolation': {'workers': 3, 'setup': ['createdb db_{WORKER}']}}
+CACHE = {'isolation': {'workers': 3, 'replicas': True}}
+
+
+def test_containers():
+    assert isolation.containers('db', {}) == ['db']
+    assert isolation.containers('db', DATABASE) == ['db', 'db', 'db']
+    assert isolation.containers('cache', CACHE) == ['cache', 'cache_1', 'cache_2']
+    assert isolation.replicas('db', DATABASE) == []
+    assert isolation.replicas('cache', CACHE) == ['cache_1', 'cache_2']
+
+
+def test_setup_only_new_containers():
+    client = mock.MagicMock()
+    client.run_command.return_value = 0
+    assert isolation.setup(client, 'db', DATABASE, created=set()) == 0
+    assert client.run_command.called is False
+    assert isolation.setup(client, 'db', DATABASE, created={'db'}) == 0
+    assert client.run_command.call_args_list == [
+        mock.call('db', 'createdb db_0'),
+        mock.call('db', 'createdb db_1'),
+        mock.call('db', 'createdb db_2'),
+    ]
+
+
+def test_render():
+    values = [{'HOST': 'one'}, {'HOST': 'two'}]
+    assert isolation.render('URL', 'redis://{HOST}/{WORKER}', values) == [
+        'export URL_0=redis://one/0',
+        'export URL_1=redis://two/1',
+    ]
+
+
+def test_env_per_worker(runner, attrs, client):
+    client.containers.get.return_value.attrs = attrs
+    client.containers.get.return_value.status = 'running'
+    config = '''
+[services.cache]
+image = "redis"
+
+[services.cache.isolation]
+workers = 2
+replicas = true
+
+[services.cache.ports]
+"6379/tcp" = ""
+
+[services.cache.export]
+REDIS_URL = "redis://{HOST}:{PORT;6379/tcp}/0"
+REDIS_WORKER_URL = "redis://{HOST}:{PORT;6379/tcp}/{WORKER}"
+'''
+    with runner.isolated_filesystem():
+        with open('teststack.toml', 'w') as fh_:
+            fh_.write(config)
+        result = runner.invoke(cli, ['--path=.', '--project-name=teststack', 'env', '--no-export'])
+    assert result.exit_code == 0
+    assert 'REDIS_URL=redis://localhost:19999/0' in result.output
+    assert 'REDIS_WORKER_URL_0=redis://localhost:19999/0' in result.output
+    assert 'REDIS_WORKER_URL_1=redis://localhost:19999/1' in result.output
+    assert [call.args[0] for call in client.containers.get.call_args_list[:2]] == [
+        'teststack_cache',
+        'teststack_cache_1',
+    ]
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+from unittest import mock
+
+import pytest
+from teststack import lazy
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(lazy, 'LAZY', tmp_path / 'lazy')
+
+
+def test_idle():
+    assert lazy.idle({'lazy': True}) == lazy.IDLE
+    assert lazy.idle({'lazy': {'idle': 10}}) == 10
+    assert lazy.eager({'search': {'image': 'search', 'lazy': True}}) == {'search': {'image': 'search'}}
+
+
+def test_container_data():
+    assert lazy.container_data(mock.MagicMock(), 'teststack_search', 'teststack') is None
+
+    lazy.LAZY.mkdir()
+    (lazy.LAZY / 'teststack_search.json').write_text(json.dumps({'pid': os.getpid(), 'ports': {'9200/tcp': 20001}}))
+    client = mock.MagicMock()
+    client.network_gateway.return_value = '172.18.0.1'
+    assert lazy.container_data(client, 'teststack_search', 'teststack') == {
+        'HOST': 'localhost',
+        'PORT;9200/tcp': '20001',
+    }
+    assert lazy.container_data(client, 'teststack_search', 'teststack', inside=True)['HOST'] == '172.18.0.1'
+    client.network_ensure.assert_called_once_with('teststack')
+
+
+def test_listen_hosts():
+    client = mock.MagicMock()
+    client.network_gateway.return_value = '172.18.0.1'
+    assert lazy.listen_hosts(client, 'teststack') == ['127.0.0.1', '172.18.0.1']
+    client.network_ensure.assert_called_once_with('teststack')
+    client.network_gateway.return_value = None
+    assert lazy.listen_hosts(client, 'teststack') == ['127.0.0.1']
+
+
+def test_proxy_wakes_and_sleeps():
+    async def echo(reader, writer):
+        writer.write(await reader.read(100))
+        await writer.drain()
+        writer.close()
+
+    async def main():
+        upstream = await asyncio.start_server(echo, '127.0.0.1', 0)
+        target = upstream.sockets[0].getsockname()[1]
+        wake = mock.MagicMock(return_value={'9200/tcp': ('127.0.0.1', target)})
+        sleep = mock.MagicMock()
+        listen = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)
+        port = listen.sockets[0].getsockname()[1]
+        listen.close()
+        await listen.wait_closed()
+
+        proxy = lazy.Proxy({'9200/tcp': port}, wake, sleep, idle=0.2)
+        # 192.0.2.1 is not an address of this machine, so only the loopback is served
+        serving = asyncio.ensure_future(proxy.serve(['127.0.0.1', '192.0.2.1']))
+        await asyncio.sleep(0.1)
+        assert not wake.called
+
+        for _ in range(2):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'ping')
+            await writer.drain()
+            assert await reader.read(100) == b'ping'
+            writer.close()
+        assert wake.call_count == 1
+
+        await asyncio.sleep(0.5)
+        assert sleep.call_count == 1
+        assert proxy.targets is None
+
+        serving.cancel()
+        upstream.close()
+
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+import json
+import os
+from unittest import mock
+
+import click
+import pytest
+from podman.errors import APIError
+from podman.errors import NotFound
+from teststack.containers import podman
+
+
+@pytest.fixture(autouse=True)
+def registries(tmp_path, monkeypatch):
+    monkeypatch.setattr(podman, '_resolved_images', {})
+    monkeypatch.setattr(podman, '_search_registries', [])
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = tmp_path / 'registries.conf'
+    path.write_text('unqualified-search-registries = ["quay.io", "docker.io"]\n')
+    monkeypatch.setenv('CONTAINERS_REGISTRIES_CONF', str(path))
+
+
+@pytest.mark.parametrize(
+    'name,resolved',
+    [
+        ('postgres:12', 'quay.io/postgres:12'),
+        ('bitnami/redis', 'quay.io/bitnami/redis'),
+        ('registry.example.com/app', 'registry.example.com/app'),
+        ('registry:5000/app:latest', 'registry:5000/app:latest'),
+        ('localhost/app', 'localhost/app'),
+    ],
+)
+def test_podman_image_shortname(tmp_path, name, resolved):
+    with mock.patch('socket.getaddrinfo') as getaddrinfo:
+        assert podman.Client()._process_image_shortname(name) == resolved
+    assert not getaddrinfo.called
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_podman_pull_tries_search_registries(tmp_path, monkeypatch):
+    monkeypatch.setattr(podman, '_search_registries', ['registry.fedoraproject.org', 'docker.io'])
+    client = podman.Client()
+    client._client = mock.MagicMock()
+    client._client.images.pull.side_effect = [APIError('not found'), mock.MagicMock()]
+    client._pull('postgres:12')
+    assert [call.args[0] for call in client.client.images.pull.call_args_list] == [
+        'registry.fedoraproject.org/postgres:12',
+        'docker.io/postgres:12',
+    ]
+    assert client._process_image_shortname('postgres:12') == 'docker.io/postgres:12'
+
+    # remembered on disk for the next process
+    monkeypatch.setattr(podman, '_resolved_images', {})
+    assert client._process_image_shortname('postgres:12') == 'docker.io/postgres:12'
+    client._client.images.pull.side_effect = None
+    client._pull('postgres:12')
+    assert client.client.images.pull.call_args.args[0] == 'docker.io/postgres:12'
+
+    client._client.images.pull.side_effect = APIError('not found')
+    with pytest.raises(APIError):
+        client._pull('missing:1')
+    assert not podman.load_cache(podman.REGISTRY_CACHE).get('missing:1')
+
+
+def test_podman_connection_configs(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('CONTAINERS_CONF', str(tmp_path / 'containers.conf'))
+    configs = podman._connection_configs()
+    assert configs[:3] == [
+        str(tmp_path / 'containers.conf'),
+        str(tmp_path / 'config' / 'containers' / 'podman-connections.json'),
+        str(tmp_path / 'config' / 'containers' / 'containers.conf'),
+    ]
+
+
+def _connections(*names):
+    return json.dumps([{'Name': name, 'URI': f'ssh://{name}', 'Identity': ''} for name in names]).encode()
+
+
+def test_podman_list_connections_cached_until_config_changes(tmp_path, monkeypatch):
+    config = tmp_path / 'podman-connections.json'
+    config.write_text('{}')
+    monkeypatch.setattr(podman, '_connection_configs', lambda: [str(config), str(tmp_path / 'containers.conf')])
+
+    with mock.patch('subprocess.check_output', return_value=_connections('build1')) as check_output:
+        assert [connection['Name'] for connection in podman.Client._list_connections()] == ['build1']
+        assert [connection['Name'] for connection in podman.Client._list_connections()] == ['build1']
+    assert check_output.call_count == 1
+
+    os.utime(config, ns=(0, 10**9))
+    with mock.patch('subprocess.check_output', return_value=_connections('build1', 'build2')):
+        assert len(podman.Client._list_connections()) == 2
+
+    (tmp_path / 'containers.conf').write_text('')
+    with mock.patch('subprocess.check_output', return_value=_connections('build3')):
+        assert podman.Client._list_connections()[0]['Name'] == 'build3'
+
+
+def test_podman_list_connections_without_configs(tmp_path, monkeypatch):
+    monkeypatch.setattr(podman, '_connection_configs', lambda: [str(tmp_path / 'podman-connections.json')])
+
+    with mock.patch('subprocess.check_output', return_value=_connections('build1')):
+        assert podman.Client._list_connections()[0]['Name'] == 'build1'
+    with mock.patch('subprocess.check_output', return_value=_connections('build2')) as check_output:
+        assert podman.Client._list_connections()[0]['Name'] == 'build2'
+    assert check_output.call_count == 1
+
+
+@pytest.fixture
+def pods():
+    client = podman.Client(pod=True)
+    client._client = mock.MagicMock()
+    client._client.pods.get.side_effect = NotFound('no such pod')
+    return client
+
+
+def test_podman_pod_create(pods):
+    assert pods.pod_create('parent.teststack', ports={'5432/tcp': 12345, '53/udp': None}, network='teststack')
+    pods.client.pods.create.assert_called_once_with(
+        'parent.teststack',
+        labels={'teststack.config-hash': mock.ANY},
+        portmappings=[
+            {'container_port': 5432, 'protocol': 'tcp', 'host_port': 12345},
+            {'container_port': 53, 'protocol': 'udp'},
+        ],
+    )
+
+    pods.run('parent.teststack_database', 'postgres:12', ports={'5432/tcp': 12345}, network='teststack')
+    pods.run('parent.teststack_tests', 'teststack:abc', network='teststack')
+    assert pods.client.pods.get.call_count == 1
+    assert pods.client.pods.create.call_count == 1
+    assert pods.client.containers.create.call_args.kwargs['pod'] == 'parent.teststack'
+    assert 'ports' not in pods.client.containers.create.call_args.kwargs
+
+
+def test_podman_pod_create_existing(pods):
+    pods.pod_create('teststack', ports={'5432/tcp': 12345})
+    labels = pods.client.pods.create.call_args.kwargs['labels']
+    pods.client.pods.get.side_effect = None
+    pods.client.pods.get.return_value.id = 'pod'
+    pods.client.pods.get.return_value.attrs = {'Labels': labels}
+    assert pods.pod_create('teststack', ports={'5432/tcp': 12345}) == 'pod'
+    pods.client.pods.get.return_value.start.assert_called_once_with()
+    assert pods.client.pods.create.call_count == 1
+
+    # ports can only be published when the pod is created
+    pods.pod_create('teststack', ports={'5432/tcp': 12345, '6379/tcp': None})
+    pods.client.pods.get.return_value.remove.assert_called_once_with(force=True)
+    assert pods.client.pods.create.call_count == 2
+    assert pods.client.pods.create.call_args.kwargs['labels'] != labels
+
+    assert podman.Client().pod_create('teststack') is None
+
+
+def test_podman_pod_remove(pods):
+    pods.pod_remove('teststack')
+    pods.client.pods.get.side_effect = None
+    pods.client.pods.get.return_value.stop.side_effect = APIError('not running')
+    pods.pod_remove('teststack')
+    pods.client.pods.get.assert_called_with('teststack')
+    pods.client.pods.get.return_value.remove.assert_called_once_with(force=True)
+
+
+@pytest.mark.parametrize(
+    'kwargs,options',
+    [
+        ({}, []),
+        ({'base_url': 'http+unix:///run/podman/podman.sock'}, ['--url=unix:///run/podman/podman.sock']),
+        (
+            {'base_url': 'http+ssh://core@build1:22/run/podman/podman.sock', 'identity': '/home/me/.ssh/id'},
+            ['--url=ssh://core@build1:22/run/podman/podman.sock', '--identity=/home/me/.ssh/id'],
+        ),
+        ({'base_url': 'http://build1:8888'}, ['--url=tcp://build1:8888']),
+    ],
+)
+def test_podman_build_uses_client_connection(kwargs, options):
+    client = podman.Client(**kwargs)
+    with mock.patch('platform.system', return_value='Linux'), mock.patch('subprocess.run') as run:
+        client.build('Dockerfile', 'teststack:abc', False)
+    command = run.call_args.args[0]
+    assert command[: len(options) + 2] == ['podman', *options, 'build']
+
+
+def test_podman_build_uses_machine_connection():
+    client = podman.Client(machine_name='build1')
+    connections = [{'Name': 'build1', 'URI': 'ssh://core@build1/run/podman/podman.sock', 'Identity': '/id'}]
+    with mock.patch.object(podman.Client, '_list_connections', return_value=connections), mock.patch(
+        'subprocess.run'
+    ) as run:
+        client.build('Dockerfile', 'teststack:abc', False)
+    assert run.call_args.args[0][:3] == ['podman', '--url=ssh://core@build1/run/podman/podman.sock', '--identity=/id']
+
+
+def test_podman_tmpfs_mount():
+    assert podman.Client._tmpfs_mount('/data', 'size=64m,mode=1777,ro') == {
+        'type': 'tmpfs',
+        'source': 'tmpfs',
+        'target': '/data',
+        'size': '64m',
+        'mode': '1777',
+        'read_only': True,
+    }
+    assert podman.Client._tmpfs_mount('/tmp', '') == {'type': 'tmpfs', 'source': 'tmpfs', 'target': '/tmp'}
+    with pytest.raises(click.UsageError, match='noexec'):
+        podman.Client._tmpfs_mount('/data', 'size=64m,noexec')
+    with pytest.raises(click.UsageError, match='uid=1000'):
+        podman.Client._tmpfs_mount('/data', 'uid=1000')
@@ -0,0 +1,23 @@
+from unittest import mock
+
+import click
+import pytest
+from teststack import DictConfig
+from teststack import services
+
+
+def test_needed():
+    assert services.needed({'unit': {'command': 'pytest', 'services': []}}) == ()
+    assert services.needed(
+        {'unit': {'command': 'pytest', 'services': ['cache']}, 'db': {'command': 'x', 'services': 'database'}}
+    ) == ('cache', 'database')
+    assert services.needed({'unit': {'command': 'pytest', 'services': []}, 'install': 'pip install .'}) == ('all',)
+
+
+def test_select():
+    ctx = mock.MagicMock(obj=DictConfig({'services': {'database': {}, 'cache': {}}}))
+    assert list(services.select(ctx)) == ['database', 'cache']
+    assert list(services.select(ctx, ('cache',))) == ['cache']
+    assert services.select(ctx, ()) == {}
+    with pytest.raises(click.UsageError):
+        services.select(ctx, ('rabbit',))
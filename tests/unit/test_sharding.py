@@ -0,0 +1,29 @@
+from teststack import sharding
+
+
+def test_split_balances_by_timings():
+    timings = {'slow.py': 30, 'medium.py': 20, 'fast.py': 5}
+    assert sharding.split(['fast.py', 'medium.py', 'slow.py', 'new.py'], 2, timings) == [
+        ['slow.py', 'fast.py'],
+        ['medium.py', 'new.py'],
+    ]
+
+
+def test_update_timings_spreads_shard_duration():
+    timings = sharding.update_timings({'a.py': 10, 'b.py': 30}, [['a.py', 'b.py'], ['c.py']], [8, 3])
+    assert timings == {'a.py': 2.0, 'b.py': 6.0, 'c.py': 3.0}
+
+
+def test_timings_round_trip(tmp_path):
+    path = tmp_path / 'shards' / 'shards.json'
+    assert sharding.load_timings(path) == {}
+    sharding.save_timings({'a.py': 1.5}, path)
+    assert sharding.load_timings(path) == {'a.py': 1.5}
+
+
+def test_prefixed_echo_buffers_partial_lines(capsys):
+    echo = sharding.PrefixedEcho('[1] ')
+    echo(b'pass', nl=False)
+    echo(b'ed\r\nfail', nl=False)
+    echo.flush()
+    assert capsys.readouterr().out == '[1] passed\n[1] fail\n'
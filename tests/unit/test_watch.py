@@ -0,0 +1,44 @@
+import pytest
+from teststack import watch
+
+
+def test_affected():
+    assert watch.affected(['src/app.py'], ['src/**/*.py'])
+    assert watch.affected(['src/app/models.py'], ['src/**/*.py'])
+    assert watch.affected(['setup.cfg'], ['**/*.py', 'setup.cfg'])
+    assert not watch.affected(['docs/index.rst'], ['src/**/*.py'])
+
+
+def test_steps():
+    config = {
+        'install': 'pip install .',
+        'lint': {'command': 'flake8', 'watch': ['**/*.py']},
+        'tests': {'command': 'pytest', 'requires': ['install'], 'watch': ['tests/**/*.py']},
+    }
+    assert watch.steps(config) == {'lint': ['**/*.py'], 'tests': ['tests/**/*.py']}
+    assert watch.steps(config, ['install']) == {'install': ['*']}
+    assert watch.steps({'install': 'pip install .'}) == {'install': ['*']}
+
+
+@pytest.mark.parametrize('watcher', [watch.Inotify, watch.Poller])
+def test_watcher(tmp_path, watcher):
+    (tmp_path / '.dockerignore').write_text('build\n')
+    (tmp_path / 'build').mkdir()
+    (tmp_path / 'src').mkdir()
+    kwargs = {'interval': 0.01} if watcher is watch.Poller else {}
+    watching = watcher(str(tmp_path), watch.ignore_patterns(str(tmp_path)), **kwargs)
+    try:
+        (tmp_path / 'build' / 'out.py').write_text('')
+        (tmp_path / '.git').mkdir()
+        (tmp_path / '.git' / 'HEAD').write_text('')
+        assert watching.wait(0.1) == set()
+
+        (tmp_path / 'src' / 'app.py').write_text('')
+        assert watching.wait(1) >= {'src/app.py'}
+
+        (tmp_path / 'src' / 'pkg').mkdir()
+        watching.wait(0.1)
+        (tmp_path / 'src' / 'pkg' / 'models.py').write_text('')
+        assert watching.wait(1) >= {'src/pkg/models.py'}
+    finally:
+        watching.close()